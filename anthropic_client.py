@@ -0,0 +1,126 @@
+"""
+Registre partagé des clients Anthropic pour EXPERTS IA
+Un seul client, donc un seul pool de connexions HTTP (keep-alive, TLS réutilisé),
+par clé API pour tout le processus, au lieu d'un client par session Streamlit.
+
+Le backend est choisi par variable d'environnement: LLM_BACKEND=anthropic (défaut)
+ou LLM_BACKEND=replay pour le serveur local de rejeu (replay_server.py), qui parle
+le même protocole /v1/messages (tests de charge sans réseau ni coût d'API).
+"""
+
+import os
+import atexit
+import hashlib
+import threading
+
+import httpx
+from anthropic import Anthropic, DefaultHttpxClient
+
+# Paramètres du pool de connexions (surchargeables par variables d'environnement)
+API_MAX_CONNECTIONS = int(os.getenv('ANTHROPIC_MAX_CONNECTIONS', '50'))
+API_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS', '20'))
+API_KEEPALIVE_EXPIRY_S = float(os.getenv('ANTHROPIC_KEEPALIVE_EXPIRY', '60'))
+API_CONNECT_TIMEOUT_S = float(os.getenv('ANTHROPIC_CONNECT_TIMEOUT', '10'))
+API_READ_TIMEOUT_S = float(os.getenv('ANTHROPIC_READ_TIMEOUT', '600'))  # Réponses longues de 8000 tokens
+API_MAX_RETRIES = int(os.getenv('ANTHROPIC_MAX_RETRIES', '0'))  # Réessais gérés par rate_limiter (file partagée)
+
+# Sélection du backend
+BACKEND_ANTHROPIC = 'anthropic'
+BACKEND_REPLAY = 'replay'
+REPLAY_SERVER_URL = os.getenv('REPLAY_SERVER_URL', 'http://127.0.0.1:8765')
+REPLAY_API_KEY = 'replay-local'  # Le serveur de rejeu n'exige pas de vraie clé
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend LLM actif ('anthropic' ou 'replay'), lu à chaque appel pour permettre la bascule en test."""
+    return os.getenv('LLM_BACKEND', BACKEND_ANTHROPIC).strip().lower() or BACKEND_ANTHROPIC
+
+
+def get_base_url():
+    """URL de l'API: LLM_BASE_URL si défini, l'URL du serveur de rejeu en mode replay, sinon celle du SDK."""
+    base_url = os.getenv('LLM_BASE_URL')
+    if base_url:
+        return base_url
+    if get_backend() == BACKEND_REPLAY:
+        return os.getenv('REPLAY_SERVER_URL', REPLAY_SERVER_URL)
+    return None
+
+
+def _registry_key(api_key, base_url=None):
+    """Identifiant du client dans le registre (la clé API elle-même n'est pas conservée comme clé)."""
+    return hashlib.sha256(f"{base_url or ''}|{api_key}".encode('utf-8')).hexdigest()
+
+
+def _build_client(api_key, base_url=None):
+    limits = httpx.Limits(
+        max_connections=API_MAX_CONNECTIONS,
+        max_keepalive_connections=API_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=API_KEEPALIVE_EXPIRY_S,
+    )
+    timeout = httpx.Timeout(API_READ_TIMEOUT_S, connect=API_CONNECT_TIMEOUT_S)
+    http_client = DefaultHttpxClient(limits=limits, timeout=timeout)
+    return Anthropic(api_key=api_key, base_url=base_url, http_client=http_client, timeout=timeout,
+                     max_retries=API_MAX_RETRIES)
+
+
+def get_shared_client(api_key):
+    """
+    Retourne le client Anthropic partagé pour cette clé API (créé au premier appel).
+
+    Args:
+        api_key: Clé API Anthropic
+
+    Returns:
+        Anthropic: Client réutilisable par toutes les sessions et tous les threads
+    """
+    backend = get_backend()
+    if backend == BACKEND_REPLAY:
+        api_key = api_key or REPLAY_API_KEY
+    elif backend != BACKEND_ANTHROPIC:
+        raise ValueError(f"Backend LLM inconnu: {backend} (attendu: {BACKEND_ANTHROPIC} ou {BACKEND_REPLAY})")
+    if not api_key:
+        raise ValueError("Clé API Anthropic manquante.")
+    base_url = get_base_url()
+    key = _registry_key(api_key, base_url)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _build_client(api_key, base_url)
+                _clients[key] = client
+                print(f"Client API partagé créé (backend: {backend}{f', URL: {base_url}' if base_url else ''}, "
+                      f"pool: {API_MAX_CONNECTIONS} connexions, "
+                      f"keep-alive: {API_MAX_KEEPALIVE_CONNECTIONS} / {API_KEEPALIVE_EXPIRY_S:.0f}s)")
+    return client
+
+
+def get_client_registry_stats():
+    """Nombre de clients (pools de connexions) ouverts et paramètres du pool."""
+    return {
+        'backend': get_backend(),
+        'base_url': get_base_url(),
+        'clients': len(_clients),
+        'max_connections': API_MAX_CONNECTIONS,
+        'max_keepalive_connections': API_MAX_KEEPALIVE_CONNECTIONS,
+        'keepalive_expiry_s': API_KEEPALIVE_EXPIRY_S,
+        'connect_timeout_s': API_CONNECT_TIMEOUT_S,
+        'read_timeout_s': API_READ_TIMEOUT_S,
+    }
+
+
+def close_shared_clients():
+    """Ferme tous les clients partagés et leurs connexions (appelé à l'arrêt du processus)."""
+    with _clients_lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception as e:
+                print(f"Erreur lors de la fermeture d'un client Anthropic: {e}")
+        _clients.clear()
+
+
+atexit.register(close_shared_clients)
@@ -3,6 +3,8 @@ import streamlit as st
 import os
 import io
 import html
+import time
+import uuid
 import markdown
 from datetime import datetime
 from dotenv import load_dotenv
@@ -33,6 +35,10 @@ else:
 try:
     from expert_logic import ExpertAdvisor, ExpertProfileManager
     from conversation_manager import ConversationManager
+    from conversation_saver import get_conversation_saver
+    from search_cache import SearchCache
+    from extraction_cache import get_extraction_cache
+    from document_store import get_document_store
     from soumission_generator import SoumissionGenerator
     from entreprise_config import show_entreprise_config
     from client_config import show_clients_management, get_client_selector
@@ -914,6 +920,7 @@ def start_new_consultation():
     st.session_state.messages = []
     st.session_state.current_conversation_id = None
     st.session_state.processed_messages = set()
+    st.session_state.pop('document_session_key', None)
     
     # Réinitialiser aussi l'état des autres modules
     # Variables de session des modules supprimés nettoyées
@@ -928,7 +935,8 @@ def start_new_consultation():
         "role": "assistant",
         "content": f"Bonjour! Je suis votre expert {profile_name}. Comment puis-je vous aider aujourd'hui?\n\n"
                    f"**Commandes rapides :**\n"
-                   f"• `/search` + question → Recherche web"
+                   f"• `/search` + question → Recherche web\n"
+                   f"• `/panel` + question → Panel d'experts (choisis dans la barre latérale)"
     })
     
     # Nettoyer les variables d'état
@@ -941,7 +949,8 @@ def start_new_consultation():
 def load_selected_conversation(conv_id):
     """Charge une conversation depuis la base de données."""
     if st.session_state.conversation_manager:
-        messages = st.session_state.conversation_manager.load_conversation(conv_id)
+        # Relecture avant écriture: l'état pas encore écrit par la file de sauvegarde est prioritaire
+        messages = get_conversation_saver(st.session_state.conversation_manager).load_conversation(conv_id)
         if messages is not None:
             st.session_state.messages = messages
             st.session_state.current_conversation_id = conv_id
@@ -961,6 +970,7 @@ def delete_selected_conversation(conv_id):
     """Supprime une conversation de la base de données."""
     if st.session_state.conversation_manager:
         print(f"Tentative suppression conv {conv_id}")
+        get_conversation_saver(st.session_state.conversation_manager).discard(conv_id)  # Sinon l'écriture différée la recréerait
         success = st.session_state.conversation_manager.delete_conversation(conv_id)
         if success:
             st.success(f"Consultation {conv_id} supprimée.")
@@ -978,7 +988,7 @@ def delete_selected_conversation(conv_id):
         st.error("Gestionnaire de conversations indisponible.")
 
 def save_current_conversation():
-    """Sauvegarde la conversation actuelle (messages) dans la DB."""
+    """Sauvegarde la conversation actuelle (messages) dans la DB, en écriture différée (hors création)."""
     should_save = True
     if st.session_state.conversation_manager and st.session_state.messages:
         is_initial_greeting_only = (
@@ -991,16 +1001,28 @@ def save_current_conversation():
 
         if should_save:
             try:
-                new_id = st.session_state.conversation_manager.save_conversation(
+                new_id = get_conversation_saver(st.session_state.conversation_manager).save(
                     st.session_state.current_conversation_id,
                     st.session_state.messages
                 )
                 if new_id is not None and st.session_state.current_conversation_id is None:
                     st.session_state.current_conversation_id = new_id
+                    # Documents analysés avant la première sauvegarde: les rattacher à la conversation
+                    session_key = st.session_state.pop('document_session_key', None)
+                    if session_key:
+                        get_document_store().rekey(session_key, new_id)
             except Exception as e:
                 st.warning(f"Erreur sauvegarde auto: {e}")
                 st.exception(e)
 
+def get_document_scope():
+    """Clé des documents de la consultation: son identifiant, ou une clé de session tant qu'elle n'est pas sauvegardée."""
+    if st.session_state.current_conversation_id is not None:
+        return st.session_state.current_conversation_id
+    if 'document_session_key' not in st.session_state:
+        st.session_state.document_session_key = f"session:{uuid.uuid4().hex}"
+    return st.session_state.document_session_key
+
 # --- Fonction Export Sidebar Section ---
 def create_export_sidebar_section():
     """Section d'export complète pour la sidebar."""
@@ -1256,14 +1278,8 @@ def create_export_sidebar_section():
                     if not st.session_state.get('user_api_key'):
                         st.sidebar.error("❌ Veuillez d'abord entrer votre clé API Anthropic")
                     else:
-                        # Créer un client Anthropic directement si expert_advisor n'existe pas
-                        if 'expert_advisor' in st.session_state and st.session_state.expert_advisor:
-                            anthropic_client = st.session_state.expert_advisor.anthropic
-                        else:
-                            from anthropic import Anthropic
-                            anthropic_client = Anthropic(api_key=st.session_state.user_api_key)
-
-                        soumission_gen = SoumissionGenerator(anthropic_client)
+                        # Client Anthropic partagé par le processus (un seul pool de connexions par clé)
+                        soumission_gen = SoumissionGenerator(api_key=st.session_state.user_api_key)
 
                         # Extraction des données
                         st.sidebar.info("⚙️ Extraction en cours...")
@@ -1522,6 +1538,17 @@ if 'conversation_manager' not in st.session_state:
         print(f"ConversationManager initialisé avec DB: {os.path.abspath(db_file_path)}")
     except Exception as e: st.error(f"Erreur: Init ConversationManager: {e}"); st.exception(e); st.session_state.conversation_manager = None; st.warning("Historique désactivé.")
 
+# Le résumé glissant des longues consultations est stocké avec la conversation
+if 'expert_advisor' in st.session_state and st.session_state.get('conversation_manager'):
+    st.session_state.expert_advisor.summary_store = st.session_state.conversation_manager
+
+if 'search_cache' not in st.session_state:
+    try:
+        st.session_state.search_cache = SearchCache()
+    except Exception as e:
+        print(f"Cache de recherche web désactivé: {e}")
+        st.session_state.search_cache = None
+
 
 
 
@@ -1659,6 +1686,30 @@ with st.sidebar:
                         st.error(f"Impossible de charger profil '{selected_profile}'.")
         else:
             st.warning("Aucun profil expert trouvé.")
+
+        # --- Profil ciblé: sections pertinentes seulement pour les gros profils ---
+        st.checkbox(
+            "🎯 Profil ciblé (sections pertinentes)",
+            value=st.session_state.expert_advisor.profile_retrieval_enabled,
+            key="profile_retrieval",
+            help="Pour les gros profils (tables de référence), n'envoie que l'en-tête du profil et les sections utiles à la question."
+        )
+        st.session_state.expert_advisor.profile_retrieval_enabled = st.session_state.profile_retrieval
+        last_retrieval = st.session_state.expert_advisor.last_profile_retrieval
+        if st.session_state.profile_retrieval and last_retrieval:
+            st.caption(f"Dernière réponse: {last_retrieval['sections']}/{last_retrieval['total_sections']} sections, "
+                       f"~{last_retrieval['sent_tokens']:,} tokens au lieu de ~{last_retrieval['profile_tokens']:,}".replace(",", " "))
+
+        # --- Panel d'experts (consultation simultanée) ---
+        if profile_names:
+            with st.expander("👥 Panel d'experts"):
+                st.multiselect(
+                    "Experts du panel:",
+                    profile_names,
+                    key="panel_profiles",
+                    help="Tapez `/panel` suivi de votre question pour la poser à tous ces experts en parallèle."
+                )
+                st.checkbox("Synthèse finale", value=True, key="panel_synthese")
     else:
         st.info("Veuillez configurer votre clé API pour accéder aux profils experts.")
 
@@ -1674,6 +1725,25 @@ with st.sidebar:
             key="file_uploader_sidebar",
             label_visibility="collapsed"
         )
+        st.text_input(
+            "Pages PDF (optionnel):",
+            key="pdf_page_range",
+            placeholder="ex: 1-20, 35, 40-",
+            help="Limite l'analyse des PDF à ces pages. Laissez vide pour lire tout le document."
+        )
+        st.session_state.expert_advisor.pdf_page_range = st.session_state.pdf_page_range.strip() or None
+
+        # Documents déjà analysés dans cette consultation: joints par référence aux questions suivantes
+        consultation_documents = get_document_store().get_documents(get_document_scope())
+        if consultation_documents:
+            st.checkbox(
+                f"📎 Joindre les {len(consultation_documents)} document(s) analysé(s) aux questions",
+                value=st.session_state.expert_advisor.attach_documents,
+                key="attach_documents",
+                help="Les documents ne sont ni relus ni réencodés: ils sont joints par référence (préfixe mis en cache)."
+            )
+            st.session_state.expert_advisor.attach_documents = st.session_state.attach_documents
+            st.caption(", ".join(document["name"] for document in consultation_documents))
 
         # Déterminer si le bouton doit être désactivé
         is_disabled = not bool(uploaded_files_sidebar)
@@ -1855,9 +1925,21 @@ with st.sidebar:
     if st.session_state.get('conversation_manager'):
         st.markdown('<hr style="margin: 1rem 0; border-top: 1px solid var(--border-color);">', unsafe_allow_html=True)
         st.markdown('<div class="sidebar-subheader">🕒 HISTORIQUE</div>', unsafe_allow_html=True)
+        history_query = st.text_input("Rechercher dans l'historique", key="history_search_query",
+                                      placeholder="🔎 Rechercher (ex: garage Farnham)", label_visibility="collapsed")
+        if history_query != st.session_state.get('history_search_last_query'):
+            st.session_state.history_search_last_query = history_query
+            st.session_state.history_search_cursor = None
         try:
-            conversations = st.session_state.conversation_manager.list_conversations(limit=100)
-            if not conversations: st.caption("Aucune consultation sauvegardée.")
+            search_page = None
+            if history_query.strip():
+                # Recherche plein texte (noms et messages), classée par pertinence, page par page
+                search_page = st.session_state.conversation_manager.search_conversations(
+                    history_query, limit=30, cursor=st.session_state.get('history_search_cursor'))
+                conversations = search_page["results"]
+            else:
+                conversations = st.session_state.conversation_manager.list_conversations(limit=100)
+            if not conversations: st.caption("Aucune consultation trouvée." if search_page is not None else "Aucune consultation sauvegardée.")
             else:
                 # Style pour les boutons d'historique
                 st.markdown("""
@@ -1973,6 +2055,15 @@ with st.sidebar:
                             with col3:
                                 if st.button("🗑️", key=f"delete_conv_{conv['id']}", help=f"Supprimer '{conv['name']}'", use_container_width=True, type="secondary"):
                                     delete_selected_conversation(conv['id'])
+                            if conv.get('snippet'):
+                                st.caption(conv['snippet'])
+            if search_page is not None:
+                if search_page["next_cursor"] and st.button("Résultats suivants ▶", key="history_search_next", use_container_width=True):
+                    st.session_state.history_search_cursor = search_page["next_cursor"]
+                    st.rerun()
+                if st.session_state.get('history_search_cursor') and st.button("⏮ Début", key="history_search_first", use_container_width=True):
+                    st.session_state.history_search_cursor = None
+                    st.rerun()
         except Exception as e: st.error(f"Erreur historique: {e}"); st.exception(e)
     else: st.caption("Module historique inactif.")
 
@@ -1984,6 +2075,76 @@ with st.sidebar:
     st.markdown('<hr style="margin: 1rem 0; border-top: 1px solid var(--border-color);">', unsafe_allow_html=True)
     st.markdown('<div class="sidebar-subheader">📊 ANALYTICS</div>', unsafe_allow_html=True)
 
+    # Cache des recherches web: taux de succès et latence économisée
+    if st.session_state.get('search_cache'):
+        with st.expander("🔎 Cache Recherche Web"):
+            search_stats = st.session_state.search_cache.get_stats()
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Taux de succès", f"{search_stats['hit_rate'] * 100:.0f}%")
+                st.metric("Entrées actives", search_stats['entries'])
+            with col2:
+                st.metric("Temps économisé", f"{search_stats['saved_seconds']:.0f} s")
+                st.metric("Hits / Misses", f"{search_stats['hits']} / {search_stats['misses']}")
+            st.caption(f"Dont quasi-doublons: {search_stats['near_hits']} • "
+                       f"Par catégorie: " + (", ".join(f"{cat} {n}" for cat, n in search_stats['by_category'].items()) or "aucune"))
+            for entry in search_stats['top_queries']:
+                st.caption(f"• {entry['query'][:50]} — {entry['hit_count']} hit(s), expire {entry['expires_at']}")
+            if st.button("🧹 Purger les entrées expirées", use_container_width=True, key="purge_search_cache"):
+                purged = st.session_state.search_cache.purge_expired()
+                st.success(f"{purged} entrée(s) expirée(s) supprimée(s).")
+
+    # Cache des extractions de fichiers: documents déjà lus (même contenu)
+    with st.expander("📄 Cache Extraction Fichiers"):
+        extraction_stats = get_extraction_cache().get_stats()
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Taux de succès", f"{extraction_stats['hit_ratio'] * 100:.0f}%")
+            st.metric("Entrées", extraction_stats['entries'])
+        with col2:
+            st.metric("Temps économisé", f"{extraction_stats['saved_seconds']:.0f} s")
+            st.metric("Hits / Misses", f"{extraction_stats['hits']} / {extraction_stats['misses']}")
+        st.caption(f"Stockage: {extraction_stats['backend']} • {extraction_stats['size_bytes'] / 1024 / 1024:.1f} MB")
+
+    # Base des conversations: pool de connexions partagé, latence et attente de verrou
+    if st.session_state.get('conversation_manager'):
+        with st.expander("🗄️ Base des Conversations"):
+            db_stats = st.session_state.conversation_manager.get_db_stats()
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Connexions", f"{db_stats['open_connections']} ({db_stats['idle_connections']} libres)")
+                st.metric("Attente verrou max", f"{db_stats['lock_wait_max_s'] * 1000:.0f} ms")
+            with col2:
+                st.metric("Attente pool max", f"{db_stats['pool_wait_max_s'] * 1000:.0f} ms")
+                st.metric("Erreurs 'locked'", db_stats['locked_errors'])
+            for operation, op_stats in sorted(db_stats['operations'].items()):
+                st.caption(f"{operation}: {op_stats['count']} op. • moy. {op_stats['avg_ms']:.1f} ms • "
+                           f"max {op_stats['max_ms']:.1f} ms" + (f" • {op_stats['errors']} erreur(s)" if op_stats['errors'] else ""))
+            saver_stats = get_conversation_saver(st.session_state.conversation_manager).get_stats()
+            st.caption(f"Sauvegarde différée: {saver_stats['writes']} écriture(s) pour {saver_stats['enqueued']} dépôt(s) • "
+                       f"moy. {saver_stats['write_avg_ms']:.1f} ms • retard max {saver_stats['lag_max_s'] * 1000:.0f} ms • "
+                       f"{saver_stats['pending']} en attente" + (f" • {saver_stats['failures']} échec(s)" if saver_stats['failures'] else ""))
+            # Rapport d'espace: lit toute la table des messages, calculé à la demande seulement
+            if st.button("📦 Espace occupé (brut / compressé)", use_container_width=True, key="conversation_storage_report"):
+                st.session_state.conversation_storage_report = st.session_state.conversation_manager.get_storage_report()
+            if st.button("🗜️ Compresser et compacter (VACUUM)", use_container_width=True, key="conversation_compact_storage"):
+                with st.spinner("Compression des anciennes conversations..."):
+                    compact_result = st.session_state.conversation_manager.compact_storage()
+                st.success(f"{compact_result['compressed']} message(s) compressé(s): "
+                           f"{compact_result['file_bytes_before'] / 1024 / 1024:.1f} Mo → {compact_result['file_bytes_after'] / 1024 / 1024:.1f} Mo")
+                st.session_state.conversation_storage_report = st.session_state.conversation_manager.get_storage_report()
+            storage_report = st.session_state.get('conversation_storage_report')
+            if storage_report:
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.metric("Messages (brut)", f"{storage_report['raw_bytes'] / 1024 / 1024:.1f} Mo")
+                    st.metric("Fichier", f"{storage_report['file_bytes'] / 1024 / 1024:.1f} Mo")
+                with col2:
+                    st.metric("Messages (stocké)", f"{storage_report['stored_bytes'] / 1024 / 1024:.1f} Mo",
+                              f"x{storage_report['ratio']:.1f}", delta_color="off")
+                    st.metric("Pages libres", f"{storage_report['free_bytes'] / 1024 / 1024:.1f} Mo")
+                st.caption(f"{storage_report['compressed_messages']} message(s) compressé(s) sur {storage_report['messages']}")
+
     if 'db_integration' in st.session_state and st.session_state.db_integration:
         
         # Bouton pour afficher les statistiques
@@ -2257,6 +2418,7 @@ with main_container:
                        f"• **Recherche web** : Accès aux dernières informations et réglementations\n\n"
                        f"**Commandes rapides :**\n"
                        f"• `/search` + question → Recherche web\n"
+                       f"• `/panel` + question → Panel d'experts (choisis dans la barre latérale)\n"
                        f"• Uploadez des fichiers pour analyse directe"
         })
 
@@ -3428,7 +3590,7 @@ div[data-testid="stChatInput"] button:disabled {
 
 # Interface de chat seulement si clé API disponible
 if st.session_state.user_api_key and 'expert_advisor' in st.session_state:
-    prompt = st.chat_input("Posez votre question ou tapez /search [recherche web]...")
+    prompt = st.chat_input("Posez votre question ou tapez /search [recherche web] ou /panel [panel d'experts]...")
     
     # --- Traitement du nouveau prompt ---
     if prompt:
@@ -3474,7 +3636,15 @@ if action_to_process and action_to_process.get("role") == "user":
         is_search_command = True
         search_query = ""  # Requête vide, à gérer
 
-    # Commandes de modules supprimées - ne garder que /search
+    is_panel_command = False
+    panel_question = ""
+    if user_content.strip().lower().startswith("/panel "):
+        is_panel_command = True
+        panel_question = user_content.strip()[len("/panel "):].strip()
+    elif user_content.strip().lower() == "/panel":
+        is_panel_command = True
+
+    # Commandes de modules supprimées - ne garder que /search et /panel
 
 
 
@@ -3494,8 +3664,14 @@ if action_to_process and action_to_process.get("role") == "user":
                     # Utiliser les fichiers stockés dans st.session_state.files_to_analyze
                     history_context = [m for m in st.session_state.messages[:-1] if m.get("role") != "system"]
 
-                    # Appel à la fonction d'analyse
-                    analysis_response, analysis_details = st.session_state.expert_advisor.analyze_documents(files_for_analysis, history_context)
+                    # Appel à la fonction d'analyse en streaming: le texte s'affiche au fil de la génération
+                    stream_placeholder = st.empty()
+                    analysis_response = stream_placeholder.write_stream(
+                        st.session_state.expert_advisor.analyze_documents_stream(files_for_analysis, history_context,
+                                                                                 conversation_id=get_document_scope())
+                    )
+                    analysis_details = st.session_state.expert_advisor.last_analysis_results
+                    stream_placeholder.empty()
 
                     # Les résultats d'analyse ne sont plus sauvegardés (module supprimé)
 
@@ -3540,8 +3716,9 @@ if action_to_process and action_to_process.get("role") == "user":
                     try:
                         # NOUVEAU : Vérifier le cache d'abord
                         cached_result = None
-                        if 'db_integration' in st.session_state and st.session_state.db_integration:
-                            cached_result = st.session_state.db_integration.get_cached_search(query)
+                        search_cache = st.session_state.get('search_cache')
+                        if search_cache:
+                            cached_result = search_cache.get_cached_search(query)
 
                         if cached_result:
                             # Utiliser le résultat en cache
@@ -3552,17 +3729,20 @@ if action_to_process and action_to_process.get("role") == "user":
                             # Le tracking du cache de recherche n'est plus disponible
                         else:
                             # Nouvelle recherche
+                            search_start = time.perf_counter()
                             search_result = st.session_state.expert_advisor.perform_web_search(query)
+                            search_latency = time.perf_counter() - search_start
                             
-                            # Mettre en cache le résultat
-                            if 'db_integration' in st.session_state and st.session_state.db_integration:
+                            # Mettre en cache le résultat (pas les erreurs)
+                            if search_cache and not search_result.startswith("❌"):
                                 current_profile = st.session_state.expert_advisor.get_current_profile()
                                 profile_name = current_profile.get('name', '') if current_profile else ''
                                 
-                                st.session_state.db_integration.cache_search_result(
+                                search_cache.cache_search_result(
                                     query=query,
                                     results=search_result,
-                                    expert_profile=profile_name
+                                    expert_profile=profile_name,
+                                    latency_s=search_latency
                                 )
                             
                             # Logger la nouvelle recherche
@@ -3601,42 +3781,84 @@ if action_to_process and action_to_process.get("role") == "user":
                         save_current_conversation()
                         st.rerun() # Rerun même après erreur
 
+    elif is_panel_command:
+        # --- Logique Panel d'Experts (consultation parallèle) ---
+        panel_profiles = st.session_state.get("panel_profiles", [])
+        if not panel_question or not panel_profiles:
+            error_msg = ("Commande `/panel` incomplète. Choisissez les experts dans la section "
+                         "« Panel d'experts » de la barre latérale, puis tapez `/panel` suivi de votre question.")
+            with st.chat_message("assistant", avatar="⚠️"):
+                st.warning(error_msg)
+            st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            save_current_conversation()
+            st.rerun()
+        else:
+            with st.chat_message("assistant", avatar="👥"):
+                history_for_claude = [
+                    msg for msg in st.session_state.messages[:-1]
+                    if msg.get("role") in ["user", "assistant", "search_result"]
+                ]
+                panel_results = []
+                panel_sections = []
+                with st.spinner(f"Consultation de {len(panel_profiles)} expert(s) en parallèle..."):
+                    # Les réponses s'affichent au fur et à mesure qu'elles arrivent
+                    for result in st.session_state.expert_advisor.consulter_panel_iter(panel_question, panel_profiles, history_for_claude):
+                        panel_results.append(result)
+                        section = f"### 👤 {result['profile_name']}\n\n" + (result["reponse"] or f"⚠️ {result['erreur']}")
+                        panel_sections.append(section)
+                        st.markdown(section)
+
+                if st.session_state.get("panel_synthese", True):
+                    with st.spinner("Synthèse des avis du panel..."):
+                        synthesis = st.session_state.expert_advisor.synthetiser_panel(panel_question, panel_results)
+                    synthesis_section = f"### 🧭 Synthèse du panel\n\n{synthesis}"
+                    panel_sections.append(synthesis_section)
+                    st.markdown(synthesis_section)
+
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": "\n\n---\n\n".join(panel_sections),
+                    "id": f"panel_result_{datetime.now().isoformat()}"
+                })
+                save_current_conversation()
+                st.rerun()
+
     else: # Traiter comme chat normal - les commandes des modules supprimés ne sont plus supportées
         # --- Logique Réponse Claude ---
         with st.chat_message("assistant", avatar="🏗️"):
             placeholder = st.empty()
-            with st.spinner("L'expert réfléchit..."):
-                try:
-                    # Préparer l'historique pour l'API Claude
-                    # Exclure le dernier message utilisateur de l'historique passé à Claude
-                    history_for_claude = [
-                        msg for msg in st.session_state.messages[:-1]
-                        if msg.get("role") in ["user", "assistant", "search_result"] # Filtrer les rôles valides
-                    ]
-
-                    response_content = st.session_state.expert_advisor.obtenir_reponse(user_content, history_for_claude)
-                    
-                    # Affichage amélioré de la réponse
-                    placeholder.markdown("""
-                    <div class="assistant-response" style="animation: fadeIn 0.6s ease-out;">
-                    """, unsafe_allow_html=True)
-                    
-                    placeholder.markdown(response_content, unsafe_allow_html=False)
-                    
-                    placeholder.markdown("</div>", unsafe_allow_html=True)
-                    
-                    st.session_state.messages.append({"role": "assistant", "content": response_content})
-                    save_current_conversation()
-                    st.rerun() # Rerun après la réponse de Claude
+            try:
+                # Préparer l'historique pour l'API Claude
+                # Exclure le dernier message utilisateur de l'historique passé à Claude
+                history_for_claude = [
+                    msg for msg in st.session_state.messages[:-1]
+                    if msg.get("role") in ["user", "assistant", "search_result"] # Filtrer les rôles valides
+                ]
+
+                # Affichage incrémental de la réponse (streaming), sauvegardée une seule fois à la fin
+                response_content = placeholder.write_stream(
+                    st.session_state.expert_advisor.obtenir_reponse_stream(
+                        user_content, history_for_claude,
+                        conversation_id=st.session_state.current_conversation_id,
+                        document_scope=get_document_scope()  # Même clé que l'analyse des documents
+                    )
+                )
+                stream_metrics = st.session_state.expert_advisor.last_stream_metrics
+                if stream_metrics.get("first_token_s") is not None:
+                    print(f"[STREAM] Premier token: {stream_metrics['first_token_s']:.2f}s • Total: {stream_metrics['total_s']:.2f}s")
+                
+                st.session_state.messages.append({"role": "assistant", "content": response_content})
+                save_current_conversation()
+                st.rerun() # Rerun après la réponse de Claude
 
-                except Exception as e:
-                    error_msg = f"Erreur lors de l'obtention de la réponse de Claude: {e}"
-                    print(error_msg)
-                    st.exception(e)
-                    placeholder.error(f"Désolé, une erreur technique s'est produite avec l'IA ({type(e).__name__}).")
-                    st.session_state.messages.append({"role": "assistant", "content": f"Erreur technique avec l'IA ({type(e).__name__})."})
-                    save_current_conversation()
-                    st.rerun() # Rerun même après erreur
+            except Exception as e:
+                error_msg = f"Erreur lors de l'obtention de la réponse de Claude: {e}"
+                print(error_msg)
+                st.exception(e)
+                placeholder.error(f"Désolé, une erreur technique s'est produite avec l'IA ({type(e).__name__}).")
+                st.session_state.messages.append({"role": "assistant", "content": f"Erreur technique avec l'IA ({type(e).__name__})."})
+                save_current_conversation()
+                st.rerun() # Rerun même après erreur
 
 # --- Footer --- 
 st.markdown("""
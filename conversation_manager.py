@@ -1,11 +1,42 @@
 # conversation_manager.py
+import re
+import zlib
+import hashlib
 import sqlite3
+import unicodedata
 import json
 from datetime import datetime
 import os
 
+from sqlite_pool import get_sqlite_pool
+
+# Colonne 'messages' des conversations migrées vers la table conversation_messages (ancien format: liste JSON)
+MIGRATED_MESSAGES_MARKER = ''
+
+# Compression des messages: contenu et 'extra' au-delà du seuil stockés en BLOB préfixé par le marqueur de
+# format; les valeurs TEXT (anciennes lignes, petits messages) sont lues telles quelles
+COMPRESSED_PAYLOAD_MARKER = b'zlib:'
+MESSAGE_COMPRESS_MIN_BYTES = int(os.getenv('MESSAGE_COMPRESS_MIN_BYTES', '2048'))
+MESSAGE_COMPRESS_LEVEL = int(os.getenv('MESSAGE_COMPRESS_LEVEL', '6'))
+COMPACT_BATCH_SIZE = 500  # Messages recompressés par transaction (verrou d'écriture gardé brièvement)
+
+# Index plein texte: rowid = (conversation_id << 20) + seq + 1 (0 = nom de la conversation), ce qui
+# permet d'effacer les lignes d'une conversation par plage de rowid, sans parcourir l'index
+SEARCH_ROWID_SHIFT = 20
+SEARCH_ROWID_MASK = (1 << SEARCH_ROWID_SHIFT) - 1
+SEARCH_NAME_WEIGHT = 10.0  # Un terme dans le nom pèse plus qu'un terme dans un message
+SEARCH_SNIPPET_TOKENS = 14
+SEARCH_PROBE_MAX_CANDIDATES = 20  # Au-delà, un terme est lu en entier plutôt que vérifié conversation par conversation
+SEARCH_RANK_MAX_ROWS = 20000      # Terme plus fréquent: IDF quasi nul, il filtre sans servir au classement
+SEARCH_STOP_WORDS = {"le", "la", "les", "de", "du", "des", "un", "une", "et", "ou", "a", "au", "aux", "en",
+                     "pour", "sur", "dans", "avec", "par", "the", "of", "from", "for", "and", "in", "on", "to"}
+
 class ConversationManager:
-    """Gère la sauvegarde et le chargement des conversations dans une base de données SQLite."""
+    """Gère la sauvegarde et le chargement des conversations dans une base de données SQLite.
+
+    Les messages sont stockés un par ligne dans 'conversation_messages' (ajout seulement):
+    une sauvegarde n'insère que les nouveaux messages au lieu de réécrire tout l'historique.
+    """
 
     def __init__(self, db_path="conversations.db"):
         """Initialise le gestionnaire et crée la table si elle n'existe pas."""
@@ -17,38 +48,207 @@ class ConversationManager:
             print(f"Création du dossier pour la base de données: {db_dir}")
 
         print(f"Initialisation ConversationManager avec db: {self.db_path}")
+        self._pool = get_sqlite_pool(self.db_path)
+        self.search_enabled = True  # Passe à False si SQLite n'a pas FTS5
         self._create_table()
+        self._migrate_legacy_messages()
+
+    def _connect(self, operation="autre"):
+        """Prête une connexion du pool partagé (WAL, délai sur verrou) pour la durée du bloc 'with'."""
+        return self._pool.connection(operation)
+
+    def get_db_stats(self):
+        """Latence par opération, attente du pool et du verrou d'écriture (voir SQLitePool.get_stats)."""
+        return self._pool.get_stats()
 
-    def _connect(self):
-        """Établit une connexion à la base de données."""
+    def get_storage_report(self):
+        """Taille des messages avant et après compression, et taille du fichier (dont pages libres récupérables)."""
+        report = {"messages": 0, "compressed_messages": 0, "raw_bytes": 0, "stored_bytes": 0,
+                  "file_bytes": 0, "free_bytes": 0, "ratio": 1.0}
         try:
-            # isolation_level=None pour autocommit simple, ou gérer les transactions manuellement
-            conn = sqlite3.connect(self.db_path, isolation_level=None)
-            # Retourner les lignes comme des dictionnaires
-            conn.row_factory = sqlite3.Row
-            return conn
+            with self._connect("storage_report") as conn:
+                cursor = conn.cursor()
+                # Lignes antérieures à la compression (raw_size NULL): texte brut, taille stockée = taille brute
+                cursor.execute("""
+                    SELECT COUNT(*) AS messages,
+                           COALESCE(SUM(typeof(content) = 'blob' OR typeof(extra) = 'blob'), 0) AS compressed_messages,
+                           COALESCE(SUM(length(CAST(content AS BLOB)) + COALESCE(length(CAST(extra AS BLOB)), 0)), 0)
+                               AS stored_bytes,
+                           COALESCE(SUM(COALESCE(raw_size, length(CAST(content AS BLOB))
+                                                 + COALESCE(length(CAST(extra AS BLOB)), 0))), 0) AS raw_bytes
+                    FROM conversation_messages
+                """)
+                report.update(dict(cursor.fetchone()))
+                page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+                report["file_bytes"] = cursor.execute("PRAGMA page_count").fetchone()[0] * page_size
+                report["free_bytes"] = cursor.execute("PRAGMA freelist_count").fetchone()[0] * page_size
         except sqlite3.Error as e:
-            print(f"Erreur de connexion à la base de données SQLite ({self.db_path}): {e}")
-            raise # Renvoyer l'erreur pour que l'appelant puisse la gérer
+            print(f"Erreur SQLite lors du calcul de l'espace occupé: {e}")
+        if report["stored_bytes"]:
+            report["ratio"] = report["raw_bytes"] / report["stored_bytes"]
+        return report
+
+    def compact_storage(self, vacuum=True):
+        """
+        Migration ponctuelle: compresse les messages enregistrés en clair au-delà du seuil, par lots
+        (une transaction courte par lot), puis reconstruit le fichier (VACUUM) pour rendre l'espace libéré.
+
+        Returns:
+            dict: {"compressed": messages compressés, "file_bytes_before", "file_bytes_after"}
+        """
+        result = {"compressed": 0, "file_bytes_before": self.get_storage_report()["file_bytes"], "file_bytes_after": 0}
+        last_rowid = 0
+        try:
+            with self._connect("compact") as conn:
+                cursor = conn.cursor()
+                while True:
+                    cursor.execute("""
+                        SELECT rowid, content, extra FROM conversation_messages
+                        WHERE rowid > ?
+                          AND ((typeof(content) = 'text' AND length(CAST(content AS BLOB)) >= ?)
+                               OR (typeof(extra) = 'text' AND length(CAST(extra AS BLOB)) >= ?))
+                        ORDER BY rowid LIMIT ?
+                    """, (last_rowid, MESSAGE_COMPRESS_MIN_BYTES, MESSAGE_COMPRESS_MIN_BYTES, COMPACT_BATCH_SIZE))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    last_rowid = rows[-1]['rowid']
+                    updates = []
+                    for row in rows:
+                        content, extra = self._unpack_payload(row['content']), self._unpack_payload(row['extra'])
+                        raw_size = len(content.encode('utf-8')) + (len(extra.encode('utf-8')) if extra else 0)
+                        updates.append((self._pack_payload(content), self._pack_payload(extra), raw_size, row['rowid']))
+                    self._pool.begin_immediate(cursor)
+                    cursor.executemany("UPDATE conversation_messages SET content = ?, extra = ?, raw_size = ? WHERE rowid = ?",
+                                       updates)
+                    cursor.execute("COMMIT")
+                    result["compressed"] += sum(1 for update in updates
+                                                if isinstance(update[0], bytes) or isinstance(update[1], bytes))
+                if vacuum:
+                    cursor.execute("VACUUM")
+                    cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la compression des conversations: {e}")
+        result["file_bytes_after"] = self.get_storage_report()["file_bytes"]
+        print(f"[STOCKAGE] {result['compressed']} message(s) compressé(s), fichier: "
+              f"{result['file_bytes_before'] / 1024 / 1024:.1f} Mo -> {result['file_bytes_after'] / 1024 / 1024:.1f} Mo")
+        return result
 
     def _create_table(self):
         """Crée la table 'conversations' si elle n'existe pas."""
         try:
-            with self._connect() as conn:
+            with self._connect("schema") as conn:
                 cursor = conn.cursor()
+                # Une seule transaction: des sessions qui démarrent ensemble ne migrent pas le schéma deux fois
+                self._pool.begin_immediate(cursor)
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS conversations (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         name TEXT NOT NULL,
                         created_at TEXT NOT NULL,
                         last_updated_at TEXT NOT NULL,
-                        messages TEXT NOT NULL -- Stocke la liste des messages en JSON
+                        messages TEXT NOT NULL -- Ancien format (liste JSON), vide une fois migré vers conversation_messages
                     )
                 """)
+                # Migration: résumé glissant des anciens échanges (historique budgété en tokens)
+                cursor.execute("PRAGMA table_info(conversations)")
+                existing_columns = {row['name'] for row in cursor.fetchall()}
+                if 'summary' not in existing_columns:
+                    cursor.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+                if 'summary_upto' not in existing_columns:
+                    # Nombre de messages d'historique (user/assistant) couverts par le résumé
+                    cursor.execute("ALTER TABLE conversations ADD COLUMN summary_upto INTEGER NOT NULL DEFAULT 0")
+                if 'message_count' not in existing_columns:
+                    cursor.execute("ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+                if 'messages_hash' not in existing_columns:
+                    # Empreinte des messages enregistrés (voir _messages_hash); NULL: réécrits à la prochaine sauvegarde
+                    cursor.execute("ALTER TABLE conversations ADD COLUMN messages_hash TEXT")
+                # Liste de l'historique triée par date de mise à jour (et pagination par clé)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_conversations_last_updated
+                    ON conversations (last_updated_at DESC, id DESC)
+                """)
+                # Un message par ligne, numérotés (seq) à partir de 0 dans l'ordre de la conversation
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS conversation_messages (
+                        conversation_id INTEGER NOT NULL,
+                        seq INTEGER NOT NULL,
+                        role TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        created_at TEXT NOT NULL,
+                        extra TEXT, -- Autres clés du message (ex: id) en JSON
+                        raw_size INTEGER, -- Octets de content + extra avant compression
+                        PRIMARY KEY (conversation_id, seq)
+                    )
+                """)
+                cursor.execute("PRAGMA table_info(conversation_messages)")
+                if 'raw_size' not in {row['name'] for row in cursor.fetchall()}:
+                    cursor.execute("ALTER TABLE conversation_messages ADD COLUMN raw_size INTEGER")
+                self._create_search_index(cursor)
+                cursor.execute("COMMIT")
                 # print("Table 'conversations' vérifiée/créée.") # Décommentez pour debug
         except sqlite3.Error as e:
             print(f"Erreur lors de la création de la table 'conversations': {e}")
 
+    def _create_search_index(self, cursor):
+        """Crée l'index plein texte (FTS5) des noms et messages; l'alimente avec l'existant à sa création."""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'conversation_search'")
+        index_exists = cursor.fetchone() is not None
+        try:
+            if not index_exists:
+                # Accents ignorés: 'beton' trouve 'béton'
+                cursor.execute("""
+                    CREATE VIRTUAL TABLE conversation_search USING fts5(
+                        name, content, tokenize = 'unicode61 remove_diacritics 2'
+                    )
+                """)
+            # Vocabulaire de l'index: nombre de passages par terme, pour commencer par le terme le plus rare
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS conversation_search_vocab
+                USING fts5vocab(conversation_search, 'row')
+            """)
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 indisponible dans cette version de SQLite ({e}), recherche limitée aux noms.")
+            self.search_enabled = False
+            return
+        if index_exists:
+            return
+        cursor.execute("""
+            INSERT INTO conversation_search (rowid, name, content)
+            SELECT id << ?, name, '' FROM conversations
+        """, (SEARCH_ROWID_SHIFT,))
+        # Texte décompressé: les contenus compressés ne sont pas indexables tels quels
+        cursor.execute("SELECT conversation_id, seq, content FROM conversation_messages")
+        rows = [(self._search_rowid(row['conversation_id'], row['seq']), self._unpack_payload(row['content']))
+                for row in cursor.fetchall()]
+        cursor.executemany("INSERT INTO conversation_search (rowid, name, content) VALUES (?, '', ?)",
+                           [row for row in rows if row[1]])
+        print(f"Index de recherche créé ({sum(1 for row in rows if row[1])} message(s) indexé(s)).")
+
+    @staticmethod
+    def _search_rowid(conversation_id, seq=-1):
+        return (conversation_id << SEARCH_ROWID_SHIFT) + seq + 1
+
+    def _index_name(self, cursor, conversation_id, name):
+        if self.search_enabled:
+            cursor.execute("DELETE FROM conversation_search WHERE rowid = ?", (self._search_rowid(conversation_id),))
+            cursor.execute("INSERT INTO conversation_search (rowid, name, content) VALUES (?, ?, '')",
+                           (self._search_rowid(conversation_id), name))
+
+    def _index_messages(self, cursor, conversation_id, messages, first_seq):
+        if self.search_enabled:
+            cursor.executemany("INSERT INTO conversation_search (rowid, name, content) VALUES (?, '', ?)", [
+                (self._search_rowid(conversation_id, first_seq + offset), message["content"])
+                for offset, message in enumerate(messages)
+                if isinstance(message.get("content"), str) and message["content"]
+                and first_seq + offset < SEARCH_ROWID_MASK])
+
+    def _unindex_conversation(self, cursor, conversation_id, messages_only=False):
+        if self.search_enabled:
+            first_rowid = self._search_rowid(conversation_id, 0 if messages_only else -1)
+            cursor.execute("DELETE FROM conversation_search WHERE rowid BETWEEN ? AND ?",
+                           (first_rowid, (conversation_id << SEARCH_ROWID_SHIFT) + SEARCH_ROWID_MASK))
+
     def _generate_conversation_name(self, messages):
         """Génère un nom par défaut pour une conversation."""
         # Essayer de prendre les premiers mots du premier message utilisateur
@@ -70,8 +270,102 @@ class ConversationManager:
         # Éviter les noms trop longs
         return name[:80] # Limite arbitraire
 
-    def save_conversation(self, conversation_id, messages, name=None):
-        """Sauvegarde ou met à jour une conversation. Retourne l'ID de la conversation."""
+    @staticmethod
+    def _message_row(message):
+        """(role, content, extra) d'un message: les clés autres que role/content sont gardées en JSON."""
+        content = message.get("content")
+        extra = {key: value for key, value in message.items() if key not in ("role", "content")}
+        if not isinstance(content, str):
+            extra["content"] = content  # Contenu structuré (blocs): restitué tel quel au chargement
+            content = ""
+        return message.get("role", ""), content, json.dumps(extra, ensure_ascii=False) if extra else None
+
+    @staticmethod
+    def _pack_payload(text):
+        """Compresse un texte au-delà du seuil (BLOB marqué); sinon, ou si le gain est nul, le garde en TEXT."""
+        if not text:
+            return text
+        raw = text.encode('utf-8')
+        if len(raw) < MESSAGE_COMPRESS_MIN_BYTES:
+            return text
+        packed = COMPRESSED_PAYLOAD_MARKER + zlib.compress(raw, MESSAGE_COMPRESS_LEVEL)
+        return packed if len(packed) < len(raw) else text
+
+    @staticmethod
+    def _unpack_payload(value):
+        """Texte d'une valeur stockée: BLOB marqué décompressé, TEXT (ancien format) inchangé."""
+        if isinstance(value, bytes) and value.startswith(COMPRESSED_PAYLOAD_MARKER):
+            return zlib.decompress(value[len(COMPRESSED_PAYLOAD_MARKER):]).decode('utf-8')
+        return value
+
+    @classmethod
+    def _stored_message_row(cls, message):
+        """(role, content, extra, raw_size) tels qu'enregistrés: content et extra compressés au-delà du seuil."""
+        role, content, extra = cls._message_row(message)
+        raw_size = len(content.encode('utf-8')) + (len(extra.encode('utf-8')) if extra else 0)
+        return role, cls._pack_payload(content), cls._pack_payload(extra), raw_size
+
+    @classmethod
+    def _row_to_message(cls, row):
+        message = {"role": row['role'], "content": cls._unpack_payload(row['content'])}
+        extra = cls._unpack_payload(row['extra'])
+        if extra:
+            message.update(json.loads(extra))
+        return message
+
+    def _insert_messages(self, cursor, conversation_id, messages, first_seq, now_iso):
+        cursor.executemany("""
+            INSERT INTO conversation_messages (conversation_id, seq, role, content, extra, raw_size, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(conversation_id, first_seq + offset, *self._stored_message_row(message), now_iso)
+              for offset, message in enumerate(messages)])
+        self._index_messages(cursor, conversation_id, messages, first_seq)
+
+    def _migrate_legacy_messages(self):
+        """Migre les conversations à l'ancien format (liste JSON dans 'messages') vers conversation_messages."""
+        try:
+            with self._connect("migration") as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, messages, last_updated_at FROM conversations WHERE messages != ?",
+                               (MIGRATED_MESSAGES_MARKER,))
+                legacy_rows = cursor.fetchall()
+                if not legacy_rows:
+                    return 0
+                self._pool.begin_immediate(cursor)
+                try:
+                    for row in legacy_rows:
+                        try:
+                            messages = json.loads(row['messages'])
+                        except json.JSONDecodeError as e:
+                            print(f"Erreur JSON: conversation {row['id']} non migrée ({e}).")
+                            continue
+                        cursor.execute("DELETE FROM conversation_messages WHERE conversation_id = ?", (row['id'],))
+                        self._unindex_conversation(cursor, row['id'], messages_only=True)
+                        self._insert_messages(cursor, row['id'], messages, 0, row['last_updated_at'])
+                        cursor.execute("""
+                            UPDATE conversations SET messages = ?, message_count = ?, messages_hash = ? WHERE id = ?
+                        """, (MIGRATED_MESSAGES_MARKER, len(messages), self._messages_hash(messages).hexdigest(),
+                              row['id']))
+                    cursor.execute("COMMIT")
+                except Exception:
+                    cursor.execute("ROLLBACK")
+                    raise
+                print(f"{len(legacy_rows)} conversation(s) migrée(s) vers le stockage par message.")
+                return len(legacy_rows)
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la migration des messages: {e}")
+            return 0
+
+    def save_conversation(self, conversation_id, messages, name=None, raise_errors=False, create_missing=True):
+        """Sauvegarde ou met à jour une conversation. Retourne l'ID de la conversation.
+
+        Seuls les messages ajoutés depuis la dernière sauvegarde sont insérés. Si l'historique
+        enregistré ne correspond plus au début de 'messages' (message modifié ou retiré),
+        les messages de la conversation sont réécrits. Avec raise_errors, les erreurs sont
+        propagées au lieu d'être seulement journalisées (écriture différée: nouvel essai).
+        Avec create_missing=False, un ID absent de la base (conversation supprimée) n'est pas
+        recréé: rien n'est écrit et None est retourné.
+        """
         if not messages: # Ne pas sauvegarder une conversation vide
             return conversation_id # Retourner l'ID existant s'il y en avait un
 
@@ -79,91 +373,172 @@ class ConversationManager:
         current_name = name # Initialiser current_name
 
         try:
-            with self._connect() as conn:
+            with self._connect("save") as conn:
                 cursor = conn.cursor()
-                messages_json = json.dumps(messages) # Convertir la liste en chaîne JSON
-
-                if conversation_id is not None:
-                    # Tenter de mettre à jour une conversation existante
-                    cursor.execute("SELECT name FROM conversations WHERE id = ?", (conversation_id,))
-                    row = cursor.fetchone()
+                self._pool.begin_immediate(cursor)
+                try:
+                    if conversation_id is not None:
+                        # Tenter de mettre à jour une conversation existante
+                        cursor.execute("SELECT name, message_count, messages_hash FROM conversations WHERE id = ?",
+                                       (conversation_id,))
+                        row = cursor.fetchone()
 
-                    if row: # L'ID existe bien
-                        if name is None: # Si aucun nom n'est fourni, on garde l'ancien
-                            current_name = row['name']
-                        else: # Sinon, on utilise le nouveau nom fourni
-                            current_name = name
+                        if row: # L'ID existe bien
+                            if name is None: # Si aucun nom n'est fourni, on garde l'ancien
+                                current_name = row['name']
+                            stored_count = row['message_count']
+                            # Historique enregistré = début de 'messages'? Comparé sur l'empreinte de tout le préfixe
+                            messages_hash = self._messages_hash(messages[:stored_count])
+                            if stored_count and (stored_count > len(messages)
+                                                 or row['messages_hash'] != messages_hash.hexdigest()):
+                                cursor.execute("DELETE FROM conversation_messages WHERE conversation_id = ?",
+                                               (conversation_id,))
+                                self._unindex_conversation(cursor, conversation_id, messages_only=True)
+                                stored_count = 0
+                                messages_hash = hashlib.sha256()
+                            if current_name != row['name']:
+                                self._index_name(cursor, conversation_id, current_name)
+                            self._insert_messages(cursor, conversation_id, messages[stored_count:], stored_count, now_iso)
+                            self._messages_hash(messages[stored_count:], messages_hash)
+                            cursor.execute("""
+                                UPDATE conversations
+                                SET last_updated_at = ?, name = ?, message_count = ?, messages_hash = ?
+                                WHERE id = ?
+                            """, (now_iso, current_name, len(messages), messages_hash.hexdigest(), conversation_id))
+                            cursor.execute("COMMIT")
+                            return conversation_id
+                        elif not create_missing:
+                            cursor.execute("ROLLBACK")
+                            print(f"Conversation {conversation_id} introuvable (supprimée?): sauvegarde ignorée.")
+                            return None
+                        else:
+                            # L'ID fourni n'existe pas dans la base, on va donc créer une nouvelle entrée
+                            print(f"Avertissement: ID {conversation_id} non trouvé pour mise à jour, création d'une nouvelle conversation.")
+                            conversation_id = None # Forcer la création
 
-                        cursor.execute("""
-                            UPDATE conversations
-                            SET messages = ?, last_updated_at = ?, name = ?
-                            WHERE id = ?
-                        """, (messages_json, now_iso, current_name, conversation_id))
-                        # print(f"Conversation {conversation_id} mise à jour.") # Décommentez pour debug
-                        return conversation_id
-                    else:
-                        # L'ID fourni n'existe pas dans la base, on va donc créer une nouvelle entrée
-                        print(f"Avertissement: ID {conversation_id} non trouvé pour mise à jour, création d'une nouvelle conversation.")
-                        conversation_id = None # Forcer la création
-
-                # Créer une nouvelle conversation si conversation_id est None ou était invalide
-                if conversation_id is None:
+                    # Créer une nouvelle conversation si conversation_id est None ou était invalide
                     if current_name is None: # Si aucun nom n'a été défini (ni fourni, ni récupéré)
                         current_name = self._generate_conversation_name(messages)
-                    created_at = now_iso # Utiliser l'heure actuelle pour la création
-
                     cursor.execute("""
-                        INSERT INTO conversations (name, created_at, last_updated_at, messages)
-                        VALUES (?, ?, ?, ?)
-                    """, (current_name, created_at, now_iso, messages_json))
+                        INSERT INTO conversations (name, created_at, last_updated_at, messages, message_count,
+                                                   messages_hash)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    """, (current_name, now_iso, now_iso, MIGRATED_MESSAGES_MARKER, len(messages),
+                          self._messages_hash(messages).hexdigest()))
                     new_id = cursor.lastrowid
-                    # print(f"Nouvelle conversation {new_id} ('{current_name}') créée.") # Décommentez pour debug
+                    self._index_name(cursor, new_id, current_name)
+                    self._insert_messages(cursor, new_id, messages, 0, now_iso)
+                    cursor.execute("COMMIT")
                     return new_id
+                except Exception:
+                    cursor.execute("ROLLBACK")
+                    raise
 
         except sqlite3.Error as e:
             print(f"Erreur SQLite lors de la sauvegarde de la conversation (ID: {conversation_id}): {e}")
+            if raise_errors:
+                raise
             return conversation_id # Retourner l'ID original en cas d'erreur
-        except json.JSONDecodeError as e:
+        except (TypeError, ValueError) as e:
             print(f"Erreur JSON lors de la sérialisation des messages pour sauvegarde: {e}")
+            if raise_errors:
+                raise
             return conversation_id # Retourner l'ID original
 
-    def load_conversation(self, conversation_id):
-        """Charge les messages d'une conversation par son ID."""
+    @classmethod
+    def _messages_hash(cls, messages, hasher=None):
+        """Empreinte SHA-256 (incrémentale) de la suite des messages sous leur forme enregistrée."""
+        if hasher is None:
+            hasher = hashlib.sha256()
+        for message in messages:
+            for field in cls._message_row(message):
+                data = (field or "").encode('utf-8')
+                hasher.update(len(data).to_bytes(8, 'big'))  # Longueurs préfixées: pas d'ambiguïté entre champs
+                hasher.update(data)
+        return hasher
+
+    def load_conversation(self, conversation_id, tail=None):
+        """Charge les messages d'une conversation par son ID (les 'tail' derniers seulement si fourni)."""
         if conversation_id is None:
             return [] # Retourner une liste vide si aucun ID n'est fourni
+        if tail is not None:
+            return self.load_conversation_page(conversation_id, limit=tail)["messages"]
 
         try:
-            with self._connect() as conn:
+            with self._connect("load") as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT messages FROM conversations WHERE id = ?", (conversation_id,))
-                row = cursor.fetchone()
-                if row:
-                    messages_json = row['messages']
-                    messages = json.loads(messages_json) # Convertir JSON en liste Python
-                    # print(f"Conversation {conversation_id} chargée.") # Décommentez pour debug
-                    return messages
-                else:
+                cursor.execute("SELECT 1 FROM conversations WHERE id = ?", (conversation_id,))
+                if cursor.fetchone() is None:
                     print(f"Aucune conversation trouvée avec l'ID {conversation_id}.")
                     return [] # Retourner une liste vide si l'ID n'est pas trouvé
+                cursor.execute("""
+                    SELECT role, content, extra FROM conversation_messages
+                    WHERE conversation_id = ? ORDER BY seq
+                """, (conversation_id,))
+                return [self._row_to_message(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
             print(f"Erreur SQLite lors du chargement de la conversation {conversation_id}: {e}")
             return []
-        except json.JSONDecodeError as e:
-            print(f"Erreur JSON lors du chargement des messages pour la conversation {conversation_id}: {e}")
+        except (json.JSONDecodeError, zlib.error, UnicodeDecodeError) as e:
+            print(f"Erreur de décodage lors du chargement des messages pour la conversation {conversation_id}: {e}")
             return [] # Retourner liste vide si les données sont corrompues
 
-    def list_conversations(self, limit=50):
-        """Retourne une liste des conversations récentes (id, name, last_updated_at)."""
+    def load_conversation_page(self, conversation_id, limit=50, before_seq=None):
+        """Charge une page de messages en remontant l'historique (pagination par seq).
+
+        Retourne {"messages": [...] (ordre chronologique), "first_seq": seq du premier message de la page
+        (à passer en 'before_seq' pour la page précédente), "has_more": bool, "total": nombre de messages}.
+        """
+        page = {"messages": [], "first_seq": None, "has_more": False, "total": 0}
+        if conversation_id is None:
+            return page
         try:
-            with self._connect() as conn:
+            with self._connect("load_page") as conn:
                 cursor = conn.cursor()
-                # Sélectionner les champs nécessaires et trier par date de mise à jour décroissante
+                cursor.execute("SELECT message_count FROM conversations WHERE id = ?", (conversation_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    return page
+                page["total"] = row['message_count']
                 cursor.execute("""
-                    SELECT id, name, last_updated_at
-                    FROM conversations
-                    ORDER BY last_updated_at DESC
-                    LIMIT ?
-                """, (limit,))
+                    SELECT seq, role, content, extra FROM conversation_messages
+                    WHERE conversation_id = ? AND seq < ?
+                    ORDER BY seq DESC LIMIT ?
+                """, (conversation_id, before_seq if before_seq is not None else page["total"], limit))
+                rows = cursor.fetchall()[::-1]
+                if rows:
+                    page["messages"] = [self._row_to_message(row) for row in rows]
+                    page["first_seq"] = rows[0]['seq']
+                    page["has_more"] = rows[0]['seq'] > 0
+                return page
+        except (sqlite3.Error, json.JSONDecodeError, zlib.error, UnicodeDecodeError) as e:
+            print(f"Erreur lors du chargement paginé de la conversation {conversation_id}: {e}")
+            return page
+
+    def list_conversations(self, limit=50, before=None):
+        """Retourne une liste des conversations récentes (id, name, last_updated_at).
+
+        'before' = (last_updated_at, id) de la dernière conversation de la page précédente (pagination par clé).
+        """
+        try:
+            with self._connect("list") as conn:
+                cursor = conn.cursor()
+                # Sélectionner les champs nécessaires et trier par date de mise à jour décroissante (index)
+                if before is None:
+                    cursor.execute("""
+                        SELECT id, name, last_updated_at
+                        FROM conversations
+                        ORDER BY last_updated_at DESC, id DESC
+                        LIMIT ?
+                    """, (limit,))
+                else:
+                    cursor.execute("""
+                        SELECT id, name, last_updated_at
+                        FROM conversations
+                        WHERE (last_updated_at, id) < (?, ?)
+                        ORDER BY last_updated_at DESC, id DESC
+                        LIMIT ?
+                    """, (before[0], before[1], limit))
                 conversations = cursor.fetchall()
                 # Convertir les objets Row en dictionnaires simples pour une utilisation facile
                 return [dict(row) for row in conversations]
@@ -171,6 +546,212 @@ class ConversationManager:
             print(f"Erreur SQLite lors de la récupération de la liste des conversations: {e}")
             return []
 
+    @staticmethod
+    def build_search_terms(text):
+        """Termes du texte saisi, normalisés comme dans l'index (minuscules, sans accents), hors mots vides."""
+        terms = []
+        for word in re.findall(r"\w+", text or ""):
+            decomposed = unicodedata.normalize('NFKD', word.lower())
+            term = "".join(char for char in decomposed if not unicodedata.combining(char))
+            if term not in SEARCH_STOP_WORDS and term not in terms:
+                terms.append(term)
+        return terms
+
+    @staticmethod
+    def _match_expression(terms):
+        """Requête FTS5: n'importe lequel des termes, en préfixe ('garage' trouve aussi 'garages')."""
+        return " OR ".join(f'"{term}"*' for term in terms)
+
+    def _conversation_rowid_range(self, conversation_id):
+        return self._search_rowid(conversation_id), (conversation_id << SEARCH_ROWID_SHIFT) + SEARCH_ROWID_MASK
+
+    @staticmethod
+    def _term_row_count(cursor, term):
+        cursor.execute("SELECT COALESCE(SUM(doc), 0) FROM conversation_search_vocab WHERE term >= ? AND term < ?",
+                       (term, term + "\uffff"))
+        return cursor.fetchone()[0]
+
+    def _conversations_with_term(self, cursor, term):
+        cursor.execute("SELECT rowid >> ? FROM conversation_search WHERE conversation_search MATCH ?",
+                       (SEARCH_ROWID_SHIFT, self._match_expression([term])))
+        return {row[0] for row in cursor}
+
+    def _conversation_has_term(self, cursor, conversation_id, term):
+        cursor.execute("""
+            SELECT 1 FROM conversation_search
+            WHERE conversation_search MATCH ? AND rowid BETWEEN ? AND ? LIMIT 1
+        """, (self._match_expression([term]), *self._conversation_rowid_range(conversation_id)))
+        return cursor.fetchone() is not None
+
+    def _find_candidates(self, cursor, terms):
+        """Conversations contenant tous les termes (nom ou messages), en partant du terme le plus rare."""
+        row_counts = {term: self._term_row_count(cursor, term) for term in terms}
+        if not all(row_counts.values()):
+            return set(), row_counts
+        ordered = sorted(terms, key=row_counts.get)
+        candidates = self._conversations_with_term(cursor, ordered[0])
+        for term in ordered[1:]:
+            if not candidates:
+                break
+            if len(candidates) <= SEARCH_PROBE_MAX_CANDIDATES:
+                candidates = {conversation_id for conversation_id in candidates
+                              if self._conversation_has_term(cursor, conversation_id, term)}
+            else:
+                candidates &= self._conversations_with_term(cursor, term)
+        return candidates, row_counts
+
+    def search_conversations(self, text, limit=20, cursor=None, updated_from=None, updated_to=None):
+        """Recherche plein texte dans les noms et messages des conversations.
+
+        Chaque terme doit apparaître dans la conversation (nom ou n'importe quel message). Les conversations
+        sont classées par pertinence (somme BM25 des passages, nom pondéré) sur les termes discriminants;
+        si tous les termes sont très fréquents, par date de mise à jour. Chaque résultat porte l'extrait
+        de son meilleur passage.
+
+        Args:
+            cursor: Valeur 'next_cursor' de la page précédente (pagination par clé)
+            updated_from / updated_to: Bornes ISO sur la date de dernière mise à jour
+
+        Returns:
+            dict: {"results": [{"id", "name", "last_updated_at", "score", "seq", "snippet"}],
+                   "next_cursor": tuple ou None}
+        """
+        page = {"results": [], "next_cursor": None}
+        terms = self.build_search_terms(text)
+        if not terms:
+            return page
+        if not self.search_enabled:
+            return self._search_names_fallback(text, limit)
+        try:
+            with self._connect("search") as conn:
+                db_cursor = conn.cursor()
+                candidates, row_counts = self._find_candidates(db_cursor, terms)
+                if not candidates:
+                    return page
+                ranking_terms = [term for term in terms if row_counts[term] <= SEARCH_RANK_MAX_ROWS]
+                mode = "pertinence" if ranking_terms else "recence"
+                if cursor is not None and cursor[0] != mode:
+                    cursor = None  # Index modifié entre deux pages: reprise au début
+                conditions, params = [], []
+                if updated_from:
+                    conditions.append("c.last_updated_at >= ?")
+                    params.append(updated_from)
+                if updated_to:
+                    conditions.append("c.last_updated_at <= ?")
+                    params.append(updated_to)
+                if mode == "pertinence":
+                    conditions.append("c.id IN (SELECT value FROM json_each(?))")
+                    params.append(json.dumps(sorted(candidates)))
+                    if cursor is not None:
+                        conditions.append("(r.score > ? OR (r.score = ? AND c.id > ?))")
+                        params.extend([cursor[1], cursor[1], cursor[2]])
+                    # bm25() n'est pas permis dans un agrégat: les passages sont matérialisés avant le regroupement
+                    db_cursor.execute(f"""
+                        WITH hits AS MATERIALIZED (
+                            SELECT rowid >> ? AS conversation_id, bm25(conversation_search, ?, 1.0) AS score
+                            FROM conversation_search
+                            WHERE conversation_search MATCH ?
+                        ), ranked AS (
+                            SELECT conversation_id, SUM(score) AS score FROM hits GROUP BY conversation_id
+                        )
+                        SELECT c.id, c.name, c.last_updated_at, r.score
+                        FROM ranked r JOIN conversations c ON c.id = r.conversation_id
+                        WHERE {' AND '.join(conditions)}
+                        ORDER BY r.score, c.id
+                        LIMIT ?
+                    """, (SEARCH_ROWID_SHIFT, SEARCH_NAME_WEIGHT, self._match_expression(ranking_terms), *params, limit))
+                    rows = db_cursor.fetchall()
+                else:
+                    if cursor is not None:
+                        conditions.append("(c.last_updated_at, c.id) < (?, ?)")
+                        params.extend([cursor[1], cursor[2]])
+                    # Termes fréquents: presque toutes les conversations sont candidates, le parcours par date
+                    # (idx_conversations_last_updated) s'arrête dès la page remplie
+                    db_cursor.execute(f"""
+                        SELECT c.id, c.name, c.last_updated_at, NULL AS score
+                        FROM conversations c
+                        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+                        ORDER BY c.last_updated_at DESC, c.id DESC
+                    """, params)
+                    rows = []
+                    for row in db_cursor:
+                        if row['id'] in candidates:
+                            rows.append(row)
+                            if len(rows) == limit:
+                                break
+                snippet_query = self._match_expression(ranking_terms or [min(terms, key=row_counts.get)])
+                for row in rows:
+                    # Meilleur passage de la conversation: plage de rowid, lue directement dans l'index
+                    db_cursor.execute("""
+                        SELECT rowid, snippet(conversation_search, -1, '**', '**', '…', ?) AS snippet
+                        FROM conversation_search
+                        WHERE conversation_search MATCH ? AND rowid BETWEEN ? AND ?
+                        ORDER BY bm25(conversation_search, ?, 1.0) LIMIT 1
+                    """, (SEARCH_SNIPPET_TOKENS, snippet_query, *self._conversation_rowid_range(row['id']),
+                          SEARCH_NAME_WEIGHT))
+                    best = db_cursor.fetchone()
+                    seq = (best['rowid'] & SEARCH_ROWID_MASK) - 1 if best else -1
+                    page["results"].append({"id": row['id'], "name": row['name'],
+                                            "last_updated_at": row['last_updated_at'], "score": row['score'],
+                                            "seq": seq if seq >= 0 else None,
+                                            "snippet": best['snippet'] if best else ""})
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la recherche '{text}': {e}")
+            return page
+
+        if len(rows) == limit:
+            last = rows[-1]
+            page["next_cursor"] = (mode, last['score'] if mode == "pertinence" else last['last_updated_at'], last['id'])
+        return page
+
+    def _search_names_fallback(self, text, limit):
+        """Recherche sur les noms seulement (SQLite sans FTS5)."""
+        conversations = []
+        try:
+            with self._connect("search") as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, name, last_updated_at FROM conversations
+                    WHERE name LIKE ? ORDER BY last_updated_at DESC, id DESC LIMIT ?
+                """, (f"%{text.strip()}%", limit))
+                conversations = [dict(row, score=0.0, seq=None, snippet="") for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la recherche '{text}': {e}")
+        return {"results": conversations, "next_cursor": None}
+
+    def get_conversation_summary(self, conversation_id):
+        """Retourne (résumé, nombre de messages couverts) pour une conversation, ou (None, 0)."""
+        if conversation_id is None:
+            return None, 0
+        try:
+            with self._connect("summary_read") as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT summary, summary_upto FROM conversations WHERE id = ?", (conversation_id,))
+                row = cursor.fetchone()
+                if row:
+                    return row['summary'], row['summary_upto'] or 0
+                return None, 0
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la lecture du résumé de la conversation {conversation_id}: {e}")
+            return None, 0
+
+    def save_conversation_summary(self, conversation_id, summary, summary_upto):
+        """Enregistre le résumé glissant d'une conversation (sans toucher aux messages)."""
+        if conversation_id is None:
+            return False
+        try:
+            with self._connect("summary_write") as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE conversations
+                    SET summary = ?, summary_upto = ?
+                    WHERE id = ? AND summary_upto <= ?
+                """, (summary, summary_upto, conversation_id, summary_upto))
+                return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la sauvegarde du résumé de la conversation {conversation_id}: {e}")
+            return False
+
     def update_conversation_title(self, conversation_id, new_title):
         """Met à jour le titre d'une conversation existante."""
         if conversation_id is None or not new_title:
@@ -185,8 +766,9 @@ class ConversationManager:
         new_title = new_title[:80]
 
         try:
-            with self._connect() as conn:
+            with self._connect("rename") as conn:
                 cursor = conn.cursor()
+                self._pool.begin_immediate(cursor)
                 cursor.execute("""
                     UPDATE conversations
                     SET name = ?, last_updated_at = ?
@@ -194,6 +776,9 @@ class ConversationManager:
                 """, (new_title, datetime.now().isoformat(), conversation_id))
 
                 updated_count = cursor.rowcount
+                if updated_count > 0:
+                    self._index_name(cursor, conversation_id, new_title)
+                cursor.execute("COMMIT")
                 if updated_count > 0:
                     print(f"Titre de la conversation {conversation_id} mis à jour: '{new_title}'")
                     return True
@@ -209,10 +794,18 @@ class ConversationManager:
         if conversation_id is None:
             return False
         try:
-            with self._connect() as conn:
+            with self._connect("delete") as conn:
                 cursor = conn.cursor()
-                cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
-                deleted_count = cursor.rowcount
+                self._pool.begin_immediate(cursor)
+                try:
+                    cursor.execute("DELETE FROM conversation_messages WHERE conversation_id = ?", (conversation_id,))
+                    self._unindex_conversation(cursor, conversation_id)
+                    cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+                    deleted_count = cursor.rowcount
+                    cursor.execute("COMMIT")
+                except Exception:
+                    cursor.execute("ROLLBACK")
+                    raise
                 if deleted_count > 0:
                     # print(f"Conversation {conversation_id} supprimée.") # Décommentez pour debug
                     return True
@@ -221,4 +814,29 @@ class ConversationManager:
                     return False
         except sqlite3.Error as e:
             print(f"Erreur SQLite lors de la suppression de la conversation {conversation_id}: {e}")
-            return False
\ No newline at end of file
+            return False
+
+
+def main():
+    """Commande ponctuelle: rapport d'espace et compression des anciennes conversations (puis VACUUM)."""
+    import argparse
+    parser = argparse.ArgumentParser(description="Compression et compactage de la base des conversations")
+    parser.add_argument("--db", default="conversations.db", help="Fichier de la base")
+    parser.add_argument("--report", action="store_true", help="Afficher le rapport d'espace sans rien modifier")
+    parser.add_argument("--no-vacuum", action="store_true", help="Compresser sans reconstruire le fichier")
+    args = parser.parse_args()
+
+    manager = ConversationManager(db_path=args.db)
+    if not args.report:
+        manager.compact_storage(vacuum=not args.no_vacuum)
+    report = manager.get_storage_report()
+    print(f"Messages: {report['messages']} (dont {report['compressed_messages']} compressés)")
+    print(f"Contenu brut: {report['raw_bytes'] / 1024 / 1024:.1f} Mo • stocké: {report['stored_bytes'] / 1024 / 1024:.1f} Mo "
+          f"(x{report['ratio']:.1f})")
+    print(f"Fichier: {report['file_bytes'] / 1024 / 1024:.1f} Mo (dont {report['free_bytes'] / 1024 / 1024:.1f} Mo libres)")
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -0,0 +1,231 @@
+"""
+Sauvegarde différée des conversations pour EXPERTS IA
+Le script Streamlit dépose l'état de la conversation dans une file en mémoire
+et continue sans attendre le disque. Un thread d'écriture regroupe les
+sauvegardes d'une même conversation (seul le dernier état est écrit, et
+save_conversation n'insère que les messages nouveaux), les écrit après un
+court délai borné, réessaie en cas de verrou, et vide la file à l'arrêt.
+Les états pas encore écrits restent lisibles (relecture avant écriture).
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import threading
+
+WRITE_BEHIND_DELAY_S = float(os.getenv('WRITE_BEHIND_DELAY_MS', '250')) / 1000          # Regroupement des sauvegardes rapprochées
+WRITE_BEHIND_MAX_DELAY_S = float(os.getenv('WRITE_BEHIND_MAX_DELAY_MS', '2000')) / 1000  # Délai maximal avant écriture
+WRITE_BEHIND_MAX_RETRIES = 5
+WRITE_BEHIND_SHUTDOWN_TIMEOUT_S = 10.0
+
+
+class WriteBehindSaver:
+    """File de sauvegardes différées vers un ConversationManager, vidée par un thread d'écriture."""
+
+    def __init__(self, manager, delay_s=WRITE_BEHIND_DELAY_S, max_delay_s=WRITE_BEHIND_MAX_DELAY_S):
+        self.manager = manager
+        self.delay_s = delay_s
+        self.max_delay_s = max(delay_s, max_delay_s)
+        self._pending = {}      # conversation_id -> dernier état en attente
+        self._inflight = None   # (conversation_id, état) en cours d'écriture
+        self._discarded = set() # Conversations en cours d'abandon (suppression): ni remises en file ni écrites
+        self._closed = False
+        self._condition = threading.Condition()
+        self.stats = {"enqueued": 0, "coalesced": 0, "writes": 0, "failures": 0, "dropped": 0, "missing": 0,
+                      "write_s": 0.0, "write_max_s": 0.0, "lag_max_s": 0.0}
+        self._thread = threading.Thread(target=self._run, name="conversation-saver", daemon=True)
+        self._thread.start()
+
+    def save(self, conversation_id, messages):
+        """
+        Dépose l'état d'une conversation pour écriture différée. Retourne l'ID de la conversation.
+
+        Une nouvelle conversation (ID None) est créée immédiatement: son identifiant sert tout de
+        suite (rattachement des documents, historique). Les sauvegardes suivantes sont différées.
+        """
+        if conversation_id is None or self._closed:
+            return self.manager.save_conversation(conversation_id, messages)
+        snapshot = [dict(message) for message in messages]  # La session continue de modifier sa liste
+        now = time.monotonic()
+        with self._condition:
+            if conversation_id in self._discarded:
+                return conversation_id
+            entry = self._pending.get(conversation_id)
+            if entry is not None:
+                entry["messages"] = snapshot
+                entry["last_at"] = now
+                self.stats["coalesced"] += 1
+            else:
+                self._pending[conversation_id] = {"messages": snapshot, "first_at": now, "last_at": now,
+                                                  "attempts": 0}
+            self.stats["enqueued"] += 1
+            self._condition.notify_all()
+        return conversation_id
+
+    def pending_messages(self, conversation_id):
+        """Dernier état pas encore écrit d'une conversation (copie), ou None."""
+        with self._condition:
+            entry = self._pending.get(conversation_id)
+            if entry is None and self._inflight is not None and self._inflight[0] == conversation_id:
+                entry = self._inflight[1]
+            return [dict(message) for message in entry["messages"]] if entry is not None else None
+
+    def load_conversation(self, conversation_id):
+        """Messages d'une conversation: état en attente s'il y en a un, sinon lecture en base."""
+        messages = self.pending_messages(conversation_id)
+        if messages is not None:
+            return messages
+        return self.manager.load_conversation(conversation_id)
+
+    def discard(self, conversation_id):
+        """Abandonne l'écriture en attente d'une conversation (avant sa suppression) et attend celle en cours.
+
+        Si l'écriture en cours échoue (verrou), elle n'est pas remise en file: la conversation
+        supprimée ensuite ne doit pas être réécrite.
+        """
+        with self._condition:
+            self._discarded.add(conversation_id)
+            try:
+                self._pending.pop(conversation_id, None)
+                self._condition.wait_for(lambda: self._inflight is None or self._inflight[0] != conversation_id)
+                self._pending.pop(conversation_id, None)
+            finally:
+                self._discarded.discard(conversation_id)
+
+    def flush(self, timeout=None):
+        """Écrit tout de suite les états en attente et attend la fin des écritures. Retourne True si la file est vide."""
+        with self._condition:
+            for entry in self._pending.values():
+                entry["first_at"] = float('-inf')  # Échéance dépassée: écrit au prochain tour
+            self._condition.notify_all()
+            if threading.current_thread() is self._thread:
+                return False
+            return self._condition.wait_for(lambda: not self._pending and self._inflight is None, timeout)
+
+    def shutdown(self, timeout=WRITE_BEHIND_SHUTDOWN_TIMEOUT_S):
+        """Vide la file puis arrête le thread d'écriture (arrêt de l'application)."""
+        flushed = self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        if not flushed:
+            print(f"[SAUVEGARDE] Arrêt: {len(self._pending)} conversation(s) non écrite(s) après {timeout:.0f}s")
+        return flushed
+
+    def _due_at(self, entry):
+        return min(entry["last_at"] + self.delay_s, entry["first_at"] + self.max_delay_s)
+
+    def _next_due(self):
+        """(ID à écrire maintenant, None) ou (None, secondes avant la prochaine échéance ou None si file vide)."""
+        if not self._pending:
+            return None, None
+        conversation_id, entry = min(self._pending.items(), key=lambda item: self._due_at(item[1]))
+        wait_s = self._due_at(entry) - time.monotonic()
+        if wait_s <= 0 or self._closed:
+            return conversation_id, None
+        return None, wait_s
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    conversation_id, wait_s = self._next_due()
+                    if conversation_id is not None:
+                        break
+                    if self._closed:
+                        return
+                    self._condition.wait(wait_s)
+                entry = self._pending.pop(conversation_id)
+                if conversation_id in self._discarded:
+                    self._condition.notify_all()  # File peut-être vide: réveiller flush()
+                    continue
+                self._inflight = (conversation_id, entry)
+            try:
+                self._write(conversation_id, entry)
+            finally:
+                with self._condition:
+                    self._inflight = None
+                    self._condition.notify_all()
+
+    def _write(self, conversation_id, entry):
+        started_at = time.monotonic()
+        try:
+            # Mise à jour seulement: une conversation supprimée entre-temps (autre session) n'est pas recréée
+            saved_id = self.manager.save_conversation(conversation_id, entry["messages"], raise_errors=True,
+                                                      create_missing=False)
+        except sqlite3.Error as e:
+            self._retry(conversation_id, entry, e)
+            return
+        except Exception as e:
+            with self._condition:
+                self.stats["failures"] += 1
+                self.stats["dropped"] += 1
+            print(f"[SAUVEGARDE] Conversation {conversation_id} non sauvegardée: {e}")
+            return
+        if saved_id is None:
+            with self._condition:
+                self.stats["missing"] += 1
+                self.stats["dropped"] += 1
+            return
+        finished_at = time.monotonic()
+        with self._condition:
+            self.stats["writes"] += 1
+            self.stats["write_s"] += finished_at - started_at
+            self.stats["write_max_s"] = max(self.stats["write_max_s"], finished_at - started_at)
+            if entry["first_at"] != float('-inf'):
+                self.stats["lag_max_s"] = max(self.stats["lag_max_s"], finished_at - entry["first_at"])
+
+    def _retry(self, conversation_id, entry, error):
+        """Remet un état en file après une erreur SQLite (verrou), sauf si un état plus récent l'a remplacé."""
+        with self._condition:
+            self.stats["failures"] += 1
+            entry["attempts"] += 1
+            if conversation_id in self._discarded:
+                print(f"[SAUVEGARDE] Conversation {conversation_id} abandonnée (suppression en cours): pas de nouvel essai")
+            elif entry["attempts"] > WRITE_BEHIND_MAX_RETRIES:
+                self.stats["dropped"] += 1
+                print(f"[SAUVEGARDE] Conversation {conversation_id} abandonnée après {entry['attempts']} essais: {error}")
+            elif conversation_id not in self._pending:
+                entry["first_at"] = entry["last_at"] = time.monotonic()  # Nouvel essai après le délai
+                self._pending[conversation_id] = entry
+            else:
+                # Un état plus récent est déjà en file: il contient celui-ci, le premier dépôt fixe l'échéance
+                self._pending[conversation_id]["first_at"] = min(self._pending[conversation_id]["first_at"],
+                                                                 entry["first_at"])
+
+    def get_stats(self):
+        """Compteurs de la file: dépôts, regroupements, écritures (durée moyenne/max), retard max, en attente."""
+        with self._condition:
+            stats = dict(self.stats)
+            stats["pending"] = len(self._pending) + (1 if self._inflight is not None else 0)
+            stats["write_avg_ms"] = stats["write_s"] / stats["writes"] * 1000 if stats["writes"] else 0.0
+            return stats
+
+
+_savers = {}
+_savers_lock = threading.Lock()
+
+
+def get_conversation_saver(manager):
+    """Retourne la file de sauvegarde partagée par le processus pour la base de ce gestionnaire."""
+    key = os.path.abspath(manager.db_path)
+    saver = _savers.get(key)
+    if saver is None:
+        with _savers_lock:
+            saver = _savers.get(key)
+            if saver is None:
+                saver = _savers[key] = WriteBehindSaver(manager)
+    return saver
+
+
+def shutdown_conversation_savers():
+    """Écrit les sauvegardes en attente de toutes les bases (appelé à l'arrêt du processus)."""
+    with _savers_lock:
+        savers = list(_savers.values())
+    for saver in savers:
+        saver.shutdown()
+
+
+atexit.register(shutdown_conversation_savers)
@@ -0,0 +1,89 @@
+"""
+Découpage des gros documents pour EXPERTS IA
+Un texte extrait trop long pour une seule requête est découpé en parties
+bornées en tokens, aux frontières de pages et de paragraphes, en conservant
+les pages couvertes par chaque partie (marqueurs [Page N]) pour les citations.
+"""
+
+import os
+import re
+
+from history_builder import CHARS_PER_TOKEN, estimate_tokens
+
+ANALYSIS_DIRECT_MAX_TOKENS = int(os.getenv('ANALYSIS_DIRECT_MAX_TOKENS', '120000'))  # Au-delà: analyse par parties
+ANALYSIS_CHUNK_TOKENS = int(os.getenv('ANALYSIS_CHUNK_TOKENS', '40000'))
+
+_PAGE_MARKER_PATTERN = re.compile(r"^\[Page (\d+)\]", re.MULTILINE)
+
+
+def _split_oversized(unit, max_tokens):
+    """Découpe un bloc trop long par lignes, puis par caractères pour une ligne démesurée."""
+    max_chars = max(1, int(max_tokens * CHARS_PER_TOKEN))
+    pieces, current, current_chars = [], [], 0
+    for line in unit.split("\n"):
+        while len(line) > max_chars:
+            if current:
+                pieces.append("\n".join(current))
+                current, current_chars = [], 0
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and current_chars + len(line) + 1 > max_chars:
+            pieces.append("\n".join(current))
+            current, current_chars = [], 0
+        current.append(line)
+        current_chars += len(line) + 1
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def split_text_into_chunks(text, max_tokens=ANALYSIS_CHUNK_TOKENS):
+    """
+    Découpe un texte en parties d'au plus 'max_tokens' (estimation locale), sans couper de paragraphe
+    quand c'est possible.
+
+    Returns:
+        list: Parties {"text", "tokens", "first_page", "last_page"} (pages None si le texte n'a pas de marqueurs)
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    current_page = None
+    first_page = None
+
+    def close_chunk():
+        chunk_text = "\n\n".join(current)
+        chunks.append({"text": chunk_text, "tokens": estimate_tokens(chunk_text),
+                       "first_page": first_page, "last_page": current_page})
+
+    for unit in text.split("\n\n"):
+        if not unit.strip():
+            continue
+        pieces = _split_oversized(unit, max_tokens) if estimate_tokens(unit) > max_tokens else [unit]
+        for piece in pieces:
+            piece_tokens = estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                close_chunk()
+                current, current_tokens = [], 0
+            if not current:
+                first_page = current_page
+            page_markers = _PAGE_MARKER_PATTERN.findall(piece)
+            if page_markers:
+                if not current and piece.startswith("[Page "):
+                    first_page = int(page_markers[0])
+                current_page = int(page_markers[-1])
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        close_chunk()
+    return chunks
+
+
+def describe_chunk(chunk, index, total):
+    """Libellé d'une partie: 'partie 2/5, pages 41-80'."""
+    label = f"partie {index}/{total}"
+    if chunk.get("first_page") and chunk.get("last_page"):
+        if chunk["first_page"] == chunk["last_page"]:
+            label += f", page {chunk['first_page']}"
+        else:
+            label += f", pages {chunk['first_page']}-{chunk['last_page']}"
+    return label
@@ -0,0 +1,519 @@
+"""
+Lecture des fichiers téléversés pour EXPERTS IA
+Parseurs par format au niveau du module (sérialisables pour un pool de processus)
+et étape d'ingestion parallèle: les formats coûteux en CPU (PDF, tableurs, images)
+sont lus dans des processus séparés, avec un délai maximal par fichier. Les
+résultats reviennent dans l'ordre des fichiers téléversés. Les gros PDF sont
+découpés en tranches de pages lues en parallèle. Un fichier déjà lu (même
+contenu) est servi par le cache d'extraction sans relancer de parseur. Chaque
+fichier est lu depuis un seul tampon partagé (sans copie), projeté en mémoire
+par les processus pour les gros fichiers.
+"""
+
+import os
+import atexit
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import docx
+
+from encoding_detection import decode_text
+from extraction_cache import get_extraction_cache
+from image_pipeline import (IMAGE_OUTPUT_FORMAT, ImageBudgetError, image_block_bytes, prepare_image_block,
+                            shrink_image_block)
+from pdf_extraction import (PDF_PARALLEL_MIN_PAGES, PageRangeError, extract_page_span, extract_pdf_text,
+                            fitz, get_page_count, join_pages, parse_page_range, split_page_spans)
+from spreadsheet_reader import read_spreadsheet_streaming
+from upload_buffer import UploadBuffer, mapped_file, measure_peak_memory, open_stream, read_buffer
+
+# Support étendu des formats - 27 types de fichiers
+SUPPORTED_FORMATS = [
+    # Documents
+    '.pdf', '.docx', '.doc', '.xlsx', '.xls', '.csv', '.txt', '.rtf', '.md',
+    # Images
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp',
+    # Code
+    '.py', '.js', '.html', '.htm', '.css', '.json', '.xml', '.yaml', '.yml',
+    # Audio
+    '.mp3', '.wav', '.m4a', '.ogg', '.flac', '.aac'
+]
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
+# Formats dont la lecture est coûteuse en CPU: lus dans le pool de processus
+CPU_BOUND_EXTENSIONS = {'.pdf', '.xlsx', '.xls'} | set(IMAGE_EXTENSIONS)
+
+INGESTION_MAX_WORKERS = int(os.getenv('INGESTION_MAX_WORKERS', str(max(1, min(4, os.cpu_count() or 1)))))
+INGESTION_FILE_TIMEOUT_S = float(os.getenv('INGESTION_FILE_TIMEOUT', '120'))
+MAX_TOTAL_IMAGE_MB = 18  # Laisse de la place au texte sous la limite de 20MB par requête
+# À incrémenter quand un parseur change de sortie: les extractions en cache de l'ancienne version sont ignorées
+EXTRACTOR_VERSION = "4"
+EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE', '1') == '1'
+
+# Préfixes des messages d'erreur retournés par les parseurs (au lieu d'un contenu)
+ERROR_PREFIXES = ("Erreur", "Format", "Aucun texte", "INFO", "Impossible", "L'image", "Délai")
+
+
+def is_error_content(content):
+    """Indique si le résultat d'un parseur est un message d'erreur plutôt qu'un contenu."""
+    return isinstance(content, str) and content.startswith(ERROR_PREFIXES)
+
+
+def extract_content(filename, file_bytes, pdf_pages=None):
+    """
+    Extrait le contenu d'un fichier selon son extension.
+
+    Args:
+        file_bytes: Contenu (bytes, memoryview ou mmap), lu sans copie par les parseurs
+        pdf_pages: Sélection de pages des PDF ("1-20, 35"); toutes si None
+
+    Returns:
+        str (texte ou message d'erreur) ou dict (bloc image de l'API)
+    """
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in SUPPORTED_FORMATS:
+        return f"Format de fichier non supporté: {filename}. Formats acceptés: {', '.join(SUPPORTED_FORMATS)}"
+
+    try:
+        file_stream = open_stream(file_bytes)
+
+        # Documents PDF
+        if file_ext == '.pdf':
+            return read_pdf(file_stream, filename, pdf_pages)
+
+        # Documents Word
+        elif file_ext == '.docx':
+            return read_docx(file_stream, filename)
+        elif file_ext == '.doc':
+            return read_doc_legacy(file_bytes, filename)
+
+        # Tableurs et CSV
+        elif file_ext in ['.xlsx', '.xls', '.csv']:
+            return read_spreadsheet(file_stream, filename, file_ext)
+
+        # Texte et documents légers
+        elif file_ext in ['.txt', '.md', '.rtf']:
+            return read_text_document(file_stream, filename, file_ext)
+
+        # Images
+        elif file_ext in IMAGE_EXTENSIONS:
+            return read_image(file_bytes, filename, file_ext)
+
+        # Code
+        elif file_ext in ['.py', '.js', '.html', '.htm', '.css', '.json', '.xml', '.yaml', '.yml']:
+            return read_code_file(file_stream, filename, file_ext)
+
+        # Audio
+        elif file_ext in ['.mp3', '.wav', '.m4a', '.ogg', '.flac', '.aac']:
+            return read_audio_file(file_bytes, filename, file_ext)
+
+        else:
+            return f"Format de fichier interne non géré : {filename}"
+
+    except Exception as e:
+        return f"Erreur générale lors de la lecture du fichier {filename}: {str(e)}"
+
+
+def _extract_timed(filename, file_bytes, pdf_pages=None):
+    """Extraction mesurée: (contenu, durée en secondes, pic de mémoire en Mo ou None)."""
+    start_time = time.perf_counter()
+    with measure_peak_memory() as memory:
+        content = extract_content(filename, file_bytes, pdf_pages)
+    return content, time.perf_counter() - start_time, memory.peak_mb
+
+
+def _extract_mapped_timed(filename, file_path, pdf_pages=None):
+    """Extraction mesurée d'un gros fichier projeté en mémoire (exécutée dans un processus du pool)."""
+    with mapped_file(file_path) as file_view:
+        return _extract_timed(filename, file_view, pdf_pages)
+
+
+def _extract_span_timed(pdf_path, page_numbers):
+    """Extraction mesurée d'une tranche de pages d'un PDF (exécutée dans un processus du pool)."""
+    start_time = time.perf_counter()
+    with measure_peak_memory() as memory:
+        page_texts = extract_page_span(pdf_path, page_numbers)
+    return page_texts, time.perf_counter() - start_time, memory.peak_mb
+
+
+def _cache_key(filename, file_bytes, pdf_pages=None):
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in SUPPORTED_FORMATS:
+        return None
+    if file_ext == '.pdf' and pdf_pages:
+        # La sélection de pages change le contenu extrait
+        file_ext = f"{file_ext}[{''.join(str(pdf_pages).split())}]"
+    elif file_ext in IMAGE_EXTENSIONS:
+        file_ext = f"{file_ext}[{IMAGE_OUTPUT_FORMAT}]"
+    return get_extraction_cache().make_key(file_bytes, file_ext, EXTRACTOR_VERSION)
+
+
+def _store_extraction(cache_key, content, elapsed_s):
+    """Met en cache un contenu extrait (jamais un message d'erreur: le fichier pourra être relu)."""
+    if cache_key is not None and content and not is_error_content(content):
+        get_extraction_cache().set(cache_key, content, elapsed_s)
+
+
+def extract_content_cached(filename, file_bytes, pdf_pages=None):
+    """
+    Extrait le contenu d'un fichier en consultant d'abord le cache d'extraction.
+
+    Returns:
+        tuple: (contenu, durée en secondes, servi par le cache, pic de mémoire en Mo ou None)
+    """
+    start_time = time.perf_counter()
+    cache_key = _cache_key(filename, file_bytes, pdf_pages)
+    if cache_key is not None:
+        cached = get_extraction_cache().get(cache_key)
+        if cached is not None:
+            return cached["content"], time.perf_counter() - start_time, True, None
+    content, elapsed_s, peak_mb = _extract_timed(filename, file_bytes, pdf_pages)
+    _store_extraction(cache_key, content, elapsed_s)
+    return content, elapsed_s, False, peak_mb
+
+
+def read_pdf(file_stream, filename, pages=None):
+    file_stream.seek(0)
+    return extract_pdf_text(file_stream, filename, pages)
+
+
+def read_docx(file_stream, filename):
+    try:
+        file_stream.seek(0)
+        doc = docx.Document(file_stream)
+        return "\n".join([p.text for p in doc.paragraphs if p.text is not None])
+    except Exception as e: return f"Erreur lors de la lecture du DOCX {filename}: {str(e)}"
+
+
+def read_doc_legacy(file_bytes, filename):
+    try:
+        # Tentative avec docx2txt si disponible
+        try:
+            import docx2txt
+            text = docx2txt.process(open_stream(file_bytes))
+            return text if text else f"Aucun contenu texte extrait de {filename}"
+        except ImportError:
+            return "INFO: Lecture des fichiers .DOC nécessite la bibliothèque 'docx2txt'. Veuillez l'installer : pip install docx2txt"
+    except Exception as e:
+        return f"Erreur lors de la lecture du DOC {filename}: {str(e)}"
+
+
+def read_spreadsheet(file_stream, filename, file_ext):
+    try:
+        return read_spreadsheet_streaming(file_stream, filename, file_ext)
+    except Exception as e:
+        return f"Erreur lors du traitement du tableur {filename}: {str(e)}"
+
+
+def read_text_document(file_stream, filename, file_ext):
+    try:
+        raw_bytes = read_buffer(file_stream)
+
+        if file_ext == '.rtf':
+            try:
+                from striprtf.striprtf import rtf_to_text
+                text = rtf_to_text(decode_text(raw_bytes))
+                return text
+            except ImportError:
+                return "INFO: La bibliothèque 'striprtf' est requise pour lire les fichiers RTF. Veuillez l'installer."
+            except Exception as e:
+                return f"Erreur lors de la lecture du RTF {filename}: {str(e)}"
+
+        # Pour TXT et MD
+        return decode_text(raw_bytes, filename)
+
+    except Exception as e: 
+        return f"Erreur lors de la lecture du fichier texte {filename}: {str(e)}"
+
+
+def read_code_file(file_stream, filename, file_ext):
+    try:
+        raw_bytes = read_buffer(file_stream)
+
+        # Détection d'encodage pour fichiers code (UTF-8 strict d'abord)
+        content = decode_text(raw_bytes, filename)
+
+        # Formatage simple selon le type
+        if file_ext == '.json':
+            try:
+                import json
+                parsed = json.loads(content)
+                content = json.dumps(parsed, indent=2, ensure_ascii=False)
+            except:
+                pass  # Garder le contenu original si parsing échoue
+
+        elif file_ext in ['.yaml', '.yml']:
+            try:
+                import yaml
+                parsed = yaml.safe_load(content)
+                content = yaml.dump(parsed, default_flow_style=False, allow_unicode=True)
+            except:
+                pass  # Garder le contenu original si parsing échoue
+
+        return content
+
+    except Exception as e:
+        return f"Erreur lors de la lecture du fichier code {filename}: {str(e)}"
+
+
+def read_audio_file(file_bytes, filename, file_ext):
+    """Lecture basique des métadonnées audio."""
+    try:
+        return f"Fichier audio: {filename}\nTaille: {len(file_bytes) / 1024 / 1024:.2f} MB\nFormat: {file_ext.upper()}\n\nNote: Analyse audio complète nécessite des bibliothèques spécialisées (pydub, librosa, speechrecognition)"
+    except Exception as e:
+        return f"Erreur lors de l'analyse audio {filename}: {str(e)}"
+
+
+def read_image(file_bytes, filename, file_ext):
+    """Photo ou plan prêt pour l'API: réduit dès le décodage, sans EXIF, qualité adaptée au budget par image."""
+    try:
+        if file_ext not in IMAGE_EXTENSIONS:
+            return f"Format d'image non supporté par l'API: {filename}"
+        return prepare_image_block(file_bytes, filename)
+    except ImageBudgetError as e:
+        return f"L'image {filename} ne tient pas dans la limite de l'API: {str(e)}"
+    except Exception as e: return f"Erreur lors du traitement de l'image {filename}: {str(e)}"
+
+
+# --- Ingestion parallèle ---
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    """Pool de processus partagé (créé au premier besoin; 'spawn' car l'application est multithread)."""
+    global _process_pool
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                _process_pool = ProcessPoolExecutor(max_workers=INGESTION_MAX_WORKERS,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+                print(f"[INGESTION] Pool de {INGESTION_MAX_WORKERS} processus démarré pour la lecture des fichiers")
+    return _process_pool
+
+
+def _reset_process_pool():
+    """Abandonne le pool (processus bloqué sur un fichier ou pool brisé); un nouveau sera créé au besoin."""
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is None:
+        return
+    # Un parseur bloqué ne peut pas être annulé: terminer ses processus
+    for process in list(getattr(pool, '_processes', {}).values()):
+        try:
+            process.terminate()
+        except Exception:
+            pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_ingestion_pool():
+    """Arrête le pool de processus (arrêt de l'application)."""
+    _reset_process_pool()
+
+
+atexit.register(shutdown_ingestion_pool)
+
+
+def _submit_pdf_spans(pool, upload, pdf_pages=None):
+    """
+    Soumet un gros PDF au pool en tranches de pages (une tâche par tranche).
+
+    Le PDF est écrit une seule fois dans le fichier temporaire du tampon, que chaque tâche ouvre,
+    au lieu de copier ses octets vers chaque processus.
+
+    Returns:
+        list ou None: Futures dans l'ordre des pages; None si une seule tâche suffit
+                      (petit PDF, un seul processus, sélection invalide)
+    """
+    if fitz is None or INGESTION_MAX_WORKERS < 2:
+        return None
+    try:
+        page_numbers = parse_page_range(pdf_pages, get_page_count(upload.view))
+    except PageRangeError:
+        return None  # Le message d'erreur est produit par la lecture normale
+    except Exception:
+        return None  # Illisible par PyMuPDF: la lecture normale passe au repli PyPDF2
+    if len(page_numbers) < PDF_PARALLEL_MIN_PAGES:
+        return None
+    pdf_path = upload.spill()
+    spans = split_page_spans(page_numbers)
+    print(f"[INGESTION] {upload.name}: {len(page_numbers)} pages lues en {len(spans)} tranches parallèles")
+    return [pool.submit(_extract_span_timed, pdf_path, span) for span in spans]
+
+
+def _submit_file(pool, upload, pdf_pages=None):
+    """Soumet un fichier au pool: chemin du fichier projeté pour un gros fichier, octets pour un petit."""
+    if upload.is_large:
+        return pool.submit(_extract_mapped_timed, upload.name, upload.spill(), pdf_pages)
+    return pool.submit(_extract_timed, upload.name, upload.payload(), pdf_pages)
+
+
+def ingest_files(uploaded_files, timeout=INGESTION_FILE_TIMEOUT_S, pdf_pages=None):
+    """
+    Lit tous les fichiers téléversés: formats coûteux en parallèle dans le pool de processus,
+    formats légers dans le thread courant pendant ce temps.
+
+    Args:
+        uploaded_files: Fichiers téléversés (attribut .name et .getbuffer() ou .getvalue())
+        timeout: Délai maximal de lecture par fichier (secondes)
+        pdf_pages: Sélection de pages appliquée aux PDF ("1-20, 35"); toutes si None
+
+    Returns:
+        list: Un dict par fichier, dans l'ordre d'entrée:
+              {"name", "content", "elapsed_s", "cached", "size_mb", "peak_mb"}
+    """
+    uploads = [UploadBuffer.from_upload(uploaded_file) for uploaded_file in uploaded_files]
+    try:
+        return _ingest_uploads(uploads, timeout, pdf_pages)
+    finally:
+        for upload in uploads:
+            upload.close()
+
+
+def _ingest_uploads(uploads, timeout, pdf_pages):
+    results = [None] * len(uploads)
+    futures = {}      # index -> liste de futures (plusieurs pour un PDF découpé en tranches)
+    span_jobs = set() # index des PDF découpés en tranches
+    submitted_at = {}
+    cache_keys = {}
+
+    def file_result(upload, content, elapsed_s, cached, peak_mb):
+        return {"name": upload.name, "content": content, "elapsed_s": elapsed_s, "cached": cached,
+                "size_mb": upload.size / (1024 * 1024), "peak_mb": peak_mb}
+
+    for index, upload in enumerate(uploads):
+        file_ext = os.path.splitext(upload.name)[1].lower()
+        if file_ext in CPU_BOUND_EXTENSIONS and file_ext in SUPPORTED_FORMATS:
+            # Cache consulté avant d'envoyer le fichier au pool
+            lookup_start = time.perf_counter()
+            cache_key = _cache_key(upload.name, upload.view, pdf_pages)
+            cached = get_extraction_cache().get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                results[index] = file_result(upload, cached["content"], time.perf_counter() - lookup_start, True, None)
+                continue
+            try:
+                pool = _get_process_pool()
+                submitted_at[index] = time.perf_counter()
+                spans = _submit_pdf_spans(pool, upload, pdf_pages) if file_ext == '.pdf' else None
+                if spans is not None:
+                    futures[index] = spans
+                    span_jobs.add(index)
+                else:
+                    futures[index] = [_submit_file(pool, upload, pdf_pages)]
+                cache_keys[index] = cache_key
+                continue
+            except Exception as e:
+                print(f"[INGESTION] Pool de processus indisponible ({type(e).__name__}: {e}), lecture locale.")
+                futures.pop(index, None)
+                _reset_process_pool()
+        content, elapsed_s, cached, peak_mb = extract_content_cached(upload.name, upload.view, pdf_pages)
+        results[index] = file_result(upload, content, elapsed_s, cached, peak_mb)
+
+    pool_broken = False
+    for index, job_futures in futures.items():
+        upload = uploads[index]
+        filename = upload.name
+        deadline = submitted_at[index] + timeout if timeout else None
+        peak_mb = None
+        try:
+            if index in span_jobs:
+                page_texts, span_peaks = [], []
+                for future in job_futures:
+                    span_texts, _span_s, span_peak_mb = future.result(
+                        timeout=max(0.0, deadline - time.perf_counter()) if deadline else None)
+                    page_texts.extend(span_texts)
+                    span_peaks.append(span_peak_mb)
+                content = join_pages(page_texts, filename)
+                elapsed_s = time.perf_counter() - submitted_at[index]
+                peak_mb = max((peak for peak in span_peaks if peak is not None), default=None)  # Par processus
+            else:
+                content, elapsed_s, peak_mb = job_futures[0].result(
+                    timeout=max(0.0, deadline - time.perf_counter()) if deadline else None)
+        except FutureTimeoutError:
+            content = f"Délai de lecture dépassé pour {filename} ({timeout:.0f}s). Le fichier est-il trop volumineux ?"
+            elapsed_s = time.perf_counter() - submitted_at[index]
+            pool_broken = True
+        except BrokenProcessPool:
+            # Processus tué (mémoire) ou pool arrêté: relire ce fichier localement
+            pool_broken = True
+            content, elapsed_s, peak_mb = _extract_timed(filename, upload.view, pdf_pages)
+        except Exception as e:
+            content = f"Erreur générale lors de la lecture du fichier {filename}: {str(e)}"
+            elapsed_s = time.perf_counter() - submitted_at[index]
+        _store_extraction(cache_keys[index], content, elapsed_s)
+        results[index] = file_result(upload, content, elapsed_s, False, peak_mb)
+
+    if pool_broken:
+        _reset_process_pool()
+    return results
+
+
+def allocate_image_budget(image_sizes, budget_bytes):
+    """
+    Répartit le budget d'octets des images d'une requête: les petites images gardent leur taille,
+    le reste est partagé également entre les plus grosses (qui seront recompressées).
+
+    Returns:
+        list: Octets alloués à chaque image, dans l'ordre reçu
+    """
+    allocations = [0] * len(image_sizes)
+    remaining = budget_bytes
+    order = sorted(range(len(image_sizes)), key=lambda index: image_sizes[index])
+    for position, index in enumerate(order):
+        share = remaining // (len(order) - position)
+        allocations[index] = min(image_sizes[index], share)
+        remaining -= allocations[index]
+    return allocations
+
+
+def select_contents_for_request(ingested_files, max_total_image_mb=MAX_TOTAL_IMAGE_MB):
+    """
+    Répartit les fichiers lus entre contenus valides et résultats par fichier (erreurs, temps d'extraction),
+    en appliquant le budget total d'images de la requête: les images qui ne tiennent pas sont recompressées
+    plutôt qu'écartées.
+
+    Returns:
+        tuple: (analysis_results, processed_contents, filenames, content_types)
+    """
+    analysis_results, processed_contents, filenames, content_types = [], [], [], []
+    image_indices = [index for index, ingested in enumerate(ingested_files)
+                     if isinstance(ingested["content"], dict) and ingested["content"].get('type') == 'image']
+    allocations = dict(zip(image_indices, allocate_image_budget(
+        [image_block_bytes(ingested_files[index]["content"]) for index in image_indices],
+        int(max_total_image_mb * 1024 * 1024) * 3 // 4)))  # Budget exprimé en base64, tel qu'envoyé
+
+    for index, ingested in enumerate(ingested_files):
+        name, content, elapsed_s = ingested["name"], ingested["content"], ingested["elapsed_s"]
+        timing = f"cache: {elapsed_s:.2f} s" if ingested.get("cached") else f"extraction: {elapsed_s:.2f} s"
+        if ingested.get("peak_mb") is not None:
+            timing += f", mémoire max: +{ingested['peak_mb']:.0f} Mo pour {ingested['size_mb']:.1f} Mo"
+        if is_error_content(content):
+            analysis_results.append((name, f"{content} ({timing})"))  # Include error messages
+        elif index in allocations:
+            status = "Image prête"
+            if image_block_bytes(content) > allocations[index]:
+                try:
+                    content = shrink_image_block(content, allocations[index])
+                except ImageBudgetError as e:
+                    analysis_results.append((name, f"Taille totale des images pour cette requête dépasserait la limite de l'API ({e}). Cette image n'a pas été ajoutée."))
+                    continue  # Skip this image
+                status = f"Image recompressée pour la limite de la requête: {image_block_bytes(content) // 1024} Ko"
+            processed_contents.append(content)
+            filenames.append(name)
+            content_types.append('image')
+            analysis_results.append((name, f"{status} ({timing})"))
+        elif isinstance(content, str):
+            processed_contents.append(content)
+            filenames.append(name)
+            content_types.append('text')
+            analysis_results.append((name, f"Texte extrait: {len(content):,} caractères".replace(",", " ") + f" ({timing})"))
+        else:
+            analysis_results.append((name, f"Erreur interne: Type de contenu inattendu ({type(content)})"))
+
+    return analysis_results, processed_contents, filenames, content_types
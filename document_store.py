@@ -0,0 +1,170 @@
+"""
+Documents de consultation pour EXPERTS IA
+Un fichier analysé est enregistré une seule fois par conversation (clé: hash du
+contenu) comme bloc réutilisable: référence de fichier de l'API (mode 'files')
+ou bloc de contenu placé dans un préfixe de messages cacheable (mode 'prefix').
+Les tours suivants le joignent par référence au lieu de refaire lecture et
+encodage du fichier.
+Stockage en mémoire seulement (processus Streamlit): les documents enregistrés
+sont perdus au redémarrage et doivent alors être téléversés de nouveau.
+"""
+
+import os
+import time
+import base64
+import threading
+from collections import OrderedDict
+
+from history_builder import estimate_tokens
+from response_cache import hash_text
+
+DOCUMENT_REFERENCE_MODE = os.getenv('DOCUMENT_REFERENCE_MODE', 'prefix')  # 'prefix' ou 'files'
+FILES_API_BETA = "files-api-2025-04-14"
+DOCUMENT_ATTACH_MAX_TOKENS = int(os.getenv('DOCUMENT_ATTACH_MAX_TOKENS', '60000'))  # Documents joints à un tour
+DOCUMENT_STORE_MAX_CONVERSATIONS = 200
+CACHE_CONTROL_EPHEMERAL = {"type": "ephemeral"}
+
+DOCUMENTS_INTRO = "Documents joints à cette consultation (déjà analysés), disponibles pour les questions suivantes: {names}."
+DOCUMENTS_ACK = "Documents reçus. Je m'y référerai pour la suite de la consultation."
+
+
+def content_hash(content):
+    """Hash d'un contenu extrait (texte ou bloc image)."""
+    if isinstance(content, dict):
+        return hash_text(content.get('source', {}).get('data', ''))
+    return hash_text(content)
+
+
+class ConversationDocumentStore:
+    """Documents enregistrés par conversation, partagés par toutes les sessions du processus."""
+
+    def __init__(self, mode=DOCUMENT_REFERENCE_MODE, max_conversations=DOCUMENT_STORE_MAX_CONVERSATIONS):
+        self.mode = mode
+        self.max_conversations = max_conversations
+        self._conversations = OrderedDict()  # conversation -> OrderedDict(hash -> document), LRU
+        self._lock = threading.Lock()
+        self.stats = {"registered": 0, "reused": 0, "uploaded": 0, "upload_failures": 0, "attached": 0}
+
+    def register(self, conversation_id, name, content, content_type, uploader=None):
+        """
+        Enregistre un document (une seule fois par contenu) pour la conversation.
+
+        Args:
+            content: Texte extrait ou bloc image de l'API
+            content_type: 'text' ou 'image'
+            uploader: Fonction (nom, octets, type MIME) -> file_id, utilisée en mode 'files'
+
+        Returns:
+            dict: Le document enregistré {"hash", "name", "content_type", "content", "tokens", "file_id"}
+        """
+        doc_hash = content_hash(content)
+        with self._lock:
+            documents = self._conversations.setdefault(conversation_id, OrderedDict())
+            self._conversations.move_to_end(conversation_id)
+            existing = documents.get(doc_hash)
+            if existing is not None:
+                self.stats["reused"] += 1
+                return existing
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+        document = {"hash": doc_hash, "name": name, "content_type": content_type, "content": content,
+                    "tokens": estimate_tokens(content if content_type == 'text' else [content]),
+                    "file_id": None, "registered_at": time.time()}
+        if self.mode == 'files' and uploader is not None:
+            document["file_id"] = self._upload(document, uploader)
+
+        with self._lock:
+            documents = self._conversations.setdefault(conversation_id, OrderedDict())
+            documents.setdefault(doc_hash, document)
+            self.stats["registered"] += 1
+            return documents[doc_hash]
+
+    def _upload(self, document, uploader):
+        """Téléverse le document vers l'API de fichiers; None si l'envoi échoue (repli sur le mode 'prefix')."""
+        try:
+            if document["content_type"] == 'image':
+                source = document["content"]["source"]
+                file_id = uploader(document["name"], base64.b64decode(source["data"]), source["media_type"])
+            else:
+                base_name = os.path.splitext(document["name"])[0]
+                file_id = uploader(f"{base_name}.txt", document["content"].encode('utf-8'), "text/plain")
+            self.stats["uploaded"] += 1
+            print(f"[DOCUMENTS] {document['name']} téléversé une fois ({file_id}), joint par référence ensuite")
+            return file_id
+        except Exception as e:
+            self.stats["upload_failures"] += 1
+            print(f"[DOCUMENTS] Téléversement de {document['name']} impossible ({e}), envoi en préfixe cacheable.")
+            return None
+
+    def get_documents(self, conversation_id):
+        """Documents de la conversation, dans l'ordre d'enregistrement."""
+        with self._lock:
+            return list(self._conversations.get(conversation_id, {}).values())
+
+    def rekey(self, old_conversation_id, new_conversation_id):
+        """Rattache les documents d'une consultation pas encore sauvegardée à son identifiant définitif."""
+        with self._lock:
+            documents = self._conversations.pop(old_conversation_id, None)
+            if documents:
+                self._conversations.setdefault(new_conversation_id, OrderedDict()).update(documents)
+
+    def clear(self, conversation_id):
+        with self._lock:
+            return len(self._conversations.pop(conversation_id, {}) or {})
+
+    def _reference_block(self, document):
+        if document["file_id"]:
+            if document["content_type"] == 'image':
+                return {"type": "image", "source": {"type": "file", "file_id": document["file_id"]}}
+            return {"type": "document", "source": {"type": "file", "file_id": document["file_id"]},
+                    "title": document["name"]}
+        if document["content_type"] == 'image':
+            return document["content"]
+        return {"type": "text", "text": f"DEBUT Document: {document['name']}\n{document['content']}\nFIN Document: {document['name']}"}
+
+    def build_prefix_messages(self, conversation_id, max_tokens=DOCUMENT_ATTACH_MAX_TOKENS):
+        """
+        Messages à placer avant l'historique: les documents de la conversation (les plus récents
+        d'abord dans la limite du budget) puis un accusé de réception. Le bloc final est cacheable:
+        ce préfixe ne change que lorsqu'un document est ajouté.
+
+        Returns:
+            tuple: (messages, utilise des références de fichiers)
+        """
+        selected, used_tokens = [], 0
+        for document in reversed(self.get_documents(conversation_id)):
+            # Une référence de fichier ne pèse pas sur la taille de la requête, mais bien sur le contexte
+            if used_tokens + document["tokens"] > max_tokens:
+                continue
+            selected.append(document)
+            used_tokens += document["tokens"]
+        if not selected:
+            return [], False
+        selected.reverse()
+        blocks = [self._reference_block(document) for document in selected]
+        names = ", ".join(document["name"] for document in selected)
+        blocks.append({"type": "text", "text": DOCUMENTS_INTRO.format(names=names),
+                       "cache_control": CACHE_CONTROL_EPHEMERAL})
+        self.stats["attached"] += 1
+        uses_files = any(document["file_id"] for document in selected)
+        return [{"role": "user", "content": blocks}, {"role": "assistant", "content": DOCUMENTS_ACK}], uses_files
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, mode=self.mode, conversations=len(self._conversations),
+                        documents=sum(len(docs) for docs in self._conversations.values()))
+
+
+_shared_document_store = None
+_shared_document_store_lock = threading.Lock()
+
+
+def get_document_store():
+    """Retourne le magasin de documents partagé par le processus (créé au premier appel)."""
+    global _shared_document_store
+    if _shared_document_store is None:
+        with _shared_document_store_lock:
+            if _shared_document_store is None:
+                _shared_document_store = ConversationDocumentStore()
+    return _shared_document_store
@@ -0,0 +1,118 @@
+"""
+Détection d'encodage des fichiers texte et code pour EXPERTS IA
+UTF-8 strict d'abord (décodage en C, quelques millisecondes même pour des
+fichiers de plusieurs Mo). Sinon chardet.UniversalDetector est alimenté par
+échantillons bornés (début du fichier, autour du premier octet invalide, puis
+fenêtres réparties) et s'arrête dès qu'il est sûr de lui, au lieu d'analyser
+tout le fichier. Un résultat peu sûr, ou une page de code mono-octet non
+occidentale (souvent devinée à tort sur un court texte français en cp1252),
+est remplacé par cp1252. Le résultat est mis en cache par hash du contenu.
+"""
+
+import os
+import codecs
+
+from extraction_cache import hash_bytes
+from memory_cache import MemoryLRUCache
+
+ENCODING_SAMPLE_CHUNK_BYTES = 16 * 1024
+ENCODING_SAMPLE_MAX_BYTES = int(os.getenv('ENCODING_SAMPLE_MAX_KB', '256')) * 1024  # Octets analysés au plus
+ENCODING_CACHE_MAX_ENTRIES = 2000
+FALLBACK_ENCODING = 'cp1252'  # Exports Windows (Excel, logiciels de chantier) sans encodage déclaré
+ENCODING_MIN_CONFIDENCE = float(os.getenv('ENCODING_MIN_CONFIDENCE', '0.5'))  # En dessous: FALLBACK_ENCODING
+WESTERN_SINGLE_BYTE_ENCODINGS = {'cp1252', 'iso8859-1', 'iso8859-15', 'mac-roman'}
+
+_BOMS = ((b'\xef\xbb\xbf', 'utf-8-sig'), (b'\xff\xfe', 'utf-16'), (b'\xfe\xff', 'utf-16'))
+
+_encoding_cache = MemoryLRUCache(max_entries=ENCODING_CACHE_MAX_ENTRIES)
+
+
+def _sample_offsets(size, error_position, chunk=ENCODING_SAMPLE_CHUNK_BYTES, max_bytes=ENCODING_SAMPLE_MAX_BYTES):
+    """Débuts des échantillons: début du fichier, premier octet invalide, puis fenêtres régulières."""
+    offsets = [0, max(0, error_position - chunk // 2)]
+    windows = max(1, max_bytes // chunk - len(offsets))
+    step = max(chunk, size // (windows + 1))
+    offsets.extend(range(step, size, step))
+    seen, ordered = set(), []
+    for offset in offsets:
+        offset = min(offset, max(0, size - chunk))
+        if offset not in seen:
+            seen.add(offset)
+            ordered.append(offset)
+    return ordered[:max(2, max_bytes // chunk)]
+
+
+def detect_encoding(raw_bytes, error_position=0):
+    """
+    Détecte l'encodage d'un contenu qui n'est pas de l'UTF-8 valide, par échantillons bornés.
+
+    Returns:
+        tuple: (encodage, confiance entre 0 et 1)
+    """
+    try:
+        from chardet.universaldetector import UniversalDetector
+    except ImportError:
+        return FALLBACK_ENCODING, 0.0
+    view = memoryview(raw_bytes).cast('B')
+    detector = UniversalDetector()
+    for offset in _sample_offsets(len(view), error_position):
+        detector.feed(bytes(view[offset:offset + ENCODING_SAMPLE_CHUNK_BYTES]))
+        if detector.done:
+            break
+    result = detector.close()
+    if not result.get('encoding'):
+        return FALLBACK_ENCODING, 0.0
+    return result['encoding'], result.get('confidence') or 0.0
+
+
+def _is_single_byte(encoding):
+    """Page de code mono-octet: chacun des 256 octets donne un caractère (les codecs multi-octets en regroupent)."""
+    return len(bytes(range(256)).decode(encoding, errors='replace')) == 256
+
+
+def choose_encoding(encoding, confidence):
+    """
+    Encodage retenu pour un résultat de détection: FALLBACK_ENCODING si la confiance est
+    sous ENCODING_MIN_CONFIDENCE ou si c'est une page de code mono-octet non occidentale
+    (Windows-1250, 1257, MacCyrillic...): sur un court texte français en cp1252, chardet
+    les propose souvent à tort ('très' lu 'trčs').
+    """
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return FALLBACK_ENCODING
+    if confidence < ENCODING_MIN_CONFIDENCE:
+        return FALLBACK_ENCODING
+    if name not in WESTERN_SINGLE_BYTE_ENCODINGS and _is_single_byte(name):
+        return FALLBACK_ENCODING  # Ascii inclus: un octet invalide en UTF-8 n'est pas de l'ASCII
+    return encoding
+
+
+def decode_text(raw_bytes, filename=None):
+    """
+    Décode un fichier texte: BOM, puis UTF-8 strict, puis encodage détecté (en cache par hash du contenu).
+    Les octets invalides pour l'encodage retenu sont remplacés.
+
+    Args:
+        raw_bytes: Contenu (bytes ou memoryview, non copié pour le cas UTF-8)
+
+    Returns:
+        str: Texte décodé
+    """
+    for bom, bom_encoding in _BOMS:
+        if bytes(raw_bytes[:len(bom)]) == bom:
+            return str(raw_bytes, bom_encoding, errors='replace')
+    try:
+        return str(raw_bytes, 'utf-8')
+    except UnicodeDecodeError as e:
+        error_position = e.start
+
+    cache_key = hash_bytes(raw_bytes)
+    encoding = _encoding_cache.get(cache_key)
+    if encoding is None:
+        detected, confidence = detect_encoding(raw_bytes, error_position)
+        encoding = choose_encoding(detected, confidence)
+        if filename:
+            print(f"[ENCODAGE] {filename}: {encoding} (détecté {detected}, confiance {confidence:.2f})")
+        _encoding_cache.set(cache_key, encoding)
+    return str(raw_bytes, encoding, errors='replace')
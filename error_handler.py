@@ -4,6 +4,7 @@ Logging, notifications et récupération d'erreurs
 """
 
 import logging
+import random
 import traceback
 import sys
 from datetime import datetime
@@ -77,6 +78,11 @@ class ExtractionError(ExpertsIAError):
     pass
 
 
+class CircuitOpenError(APIError):
+    """Appels API suspendus après une série d'échecs (disjoncteur ouvert)"""
+    pass
+
+
 def log_error(error, context=None):
     """
     Log une erreur avec contexte complet
@@ -240,9 +246,83 @@ def handle_api_error(error):
         }
 
 
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}  # 529: API surchargée
+
+
+def get_retry_after(error):
+    """
+    Extrait le délai Retry-After (en secondes) d'une erreur API, si présent
+
+    Args:
+        error: Exception (ex: anthropic.RateLimitError)
+
+    Returns:
+        float ou None
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    # retry-after-ms (précis) en priorité, puis retry-after (secondes)
+    for header, divisor in (('retry-after-ms', 1000.0), ('retry-after', 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) / divisor)
+        except (TypeError, ValueError):
+            try:
+                # Format date HTTP
+                from email.utils import parsedate_to_datetime
+                retry_date = parsedate_to_datetime(value)
+                return max(0.0, retry_date.timestamp() - datetime.now(retry_date.tzinfo).timestamp())
+            except Exception:
+                continue
+    return None
+
+
+def is_retryable_error(error):
+    """
+    Indique si une erreur est transitoire (limite de taux, surcharge, réseau)
+
+    Args:
+        error: Exception
+
+    Returns:
+        bool: True si un nouvel essai a du sens
+    """
+    status_code = getattr(error, 'status_code', None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    error_name = type(error).__name__.lower()
+    return any(marker in error_name for marker in ('timeout', 'connection', 'overloaded', 'ratelimit'))
+
+
+def compute_backoff_delay(attempt, backoff_factor=2, retry_after=None, max_delay=60.0):
+    """
+    Calcule le délai avant le prochain essai: Retry-After si fourni, sinon
+    délai exponentiel avec gigue complète (évite les réessais synchronisés)
+
+    Args:
+        attempt: Numéro de la tentative échouée (0 pour la première)
+        backoff_factor: Base du délai exponentiel
+        retry_after: Délai imposé par le serveur (secondes)
+        max_delay: Délai maximum
+
+    Returns:
+        float: Délai en secondes
+    """
+    if retry_after is not None:
+        # Respecter le serveur, avec une petite gigue pour étaler les sessions
+        return min(max_delay, retry_after + random.uniform(0, 0.5))
+    return random.uniform(0, min(max_delay, backoff_factor ** (attempt + 1)))
+
+
 def retry_with_backoff(func, max_retries=3, backoff_factor=2, *args, **kwargs):
     """
-    Réessaie une fonction avec délai exponentiel
+    Réessaie une fonction avec délai exponentiel (gigue, Retry-After respecté)
+
+    Seules les erreurs transitoires (429, surcharge, réseau) sont réessayées.
 
     Args:
         func: Fonction à exécuter
@@ -254,7 +334,7 @@ def retry_with_backoff(func, max_retries=3, backoff_factor=2, *args, **kwargs):
         Résultat de la fonction
 
     Raises:
-        Exception: Si toutes les tentatives échouent
+        Exception: Si toutes les tentatives échouent ou si l'erreur n'est pas transitoire
     """
     import time
 
@@ -269,9 +349,12 @@ def retry_with_backoff(func, max_retries=3, backoff_factor=2, *args, **kwargs):
 
         except Exception as e:
             last_error = e
+            if not is_retryable_error(e):
+                logger.error(f"❌ Erreur non transitoire pour {func.__name__}, abandon: {e}")
+                raise
             if attempt < max_retries - 1:
-                delay = backoff_factor ** attempt
-                logger.warning(f"⚠️ Échec tentative {attempt + 1}, réessai dans {delay}s: {e}")
+                delay = compute_backoff_delay(attempt, backoff_factor, get_retry_after(e))
+                logger.warning(f"⚠️ Échec tentative {attempt + 1}, réessai dans {delay:.1f}s: {e}")
                 time.sleep(delay)
             else:
                 logger.error(f"❌ Toutes les tentatives ont échoué pour {func.__name__}")
@@ -2,99 +2,79 @@
 # REMINDER: Update requirements.txt if needed
 
 import os
-import io
-import base64
-import csv
 from datetime import datetime
 import time # Import time for potential delays/retries
-
-import PyPDF2
-import docx
-# import openpyxl # Uncomment this line ONLY if you keep/uncomment the XLSX reading code below
-from PIL import Image
-from anthropic import Anthropic, APIError # Importer APIError pour une meilleure gestion des erreurs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from anthropic import APIError # Importer APIError pour une meilleure gestion des erreurs
+
+from anthropic_client import get_shared_client
+from document_ingestion import SUPPORTED_FORMATS, extract_content_cached, ingest_files, select_contents_for_request
+from upload_buffer import UploadBuffer
+from document_chunking import ANALYSIS_DIRECT_MAX_TOKENS, describe_chunk, split_text_into_chunks
+from document_store import FILES_API_BETA, get_document_store
+from profile_registry import get_profile_registry
+from profile_retrieval import get_profile_retriever, RETRIEVAL_HISTORY_MESSAGES
+from error_handler import compute_backoff_delay, is_retryable_error
+from rate_limiter import (get_admission_controller, estimate_request_tokens, API_CALL_MAX_RETRIES,
+                          PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)
+from response_cache import get_response_cache
+from history_builder import (HistoryBuilder, estimate_tokens, truncate_to_tokens, format_messages_for_summary,
+                             summary_refresher, SUMMARY_MAX_TOKENS, SUMMARY_INPUT_MAX_TOKENS, SUMMARY_SYSTEM_PROMPT)
 
 # Constants
 SEPARATOR_DOUBLE = "=" * 50
 SEPARATOR_SINGLE = "-" * 50
+CACHE_CONTROL_EPHEMERAL = {"type": "ephemeral"} # Marqueur de bloc cacheable (prompt caching Anthropic)
+
+PANEL_MAX_WORKERS = 4 # Nombre max d'experts interrogés simultanément en mode panel
+ANALYSIS_HISTORY_BUDGET_TOKENS = 6000 # Historique joint à une analyse de documents
+ANALYSIS_MAP_MAX_WORKERS = int(os.getenv('ANALYSIS_MAP_MAX_WORKERS', '8')) # Parties analysées simultanément (le limiteur partagé garde le dernier mot)
+ANALYSIS_MAP_MAX_TOKENS = 3000 # Notes produites par partie
+SUMMARY_MIN_NEW_TOKENS = 300 # Volume minimal d'échanges sortis de la fenêtre avant de rafraîchir le résumé
+
+ANALYSIS_INSTRUCTIONS_SINGLE = "\nAnalysez ce document/image et fournissez une analyse structurée comprenant :\n1.  **RÉSUMÉ / DESCRIPTION GÉNÉRALE:** Décrivez brièvement le contenu du fichier.\n2.  **ANALYSE TECHNIQUE / ÉLÉMENTS CLÉS:** Identifiez les points techniques, données, ou éléments visuels importants. S'il s'agit de plans ou schémas, décrivez-les.\n3.  **ANALYSE FINANCIÈRE (si applicable et possible):** Si des informations financières sont présentes ou peuvent être inférées, commentez-les.\n4.  **RECOMMANDATIONS / QUESTIONS:** Basé sur l'analyse, quelles sont vos recommandations ou quelles questions supplémentaires se posent ?"
+ANALYSIS_MAP_INSTRUCTIONS = "\nCe texte est une partie ({part}) du fichier {filename}, trop volumineux pour être analysé d'un seul tenant. Rédigez des notes d'analyse factuelles et concises qui serviront à une synthèse finale :\n-   **CONTENU:** De quoi traite cette partie.\n-   **ÉLÉMENTS TECHNIQUES:** Dimensions, matériaux, normes, exigences, méthodes.\n-   **QUANTITÉS ET MONTANTS:** Toutes les données chiffrées utiles.\n-   **POINTS À SIGNALER:** Risques, incohérences, exclusions, informations manquantes.\nCitez les pages ([Page N]) quand elles sont indiquées. Ne rédigez pas de conclusion générale."
+ANALYSIS_REDUCE_NOTE = "\nNote: les fichiers volumineux ont été analysés par parties; pour ceux-ci, le contenu fourni correspond aux notes d'analyse de chaque partie (avec les pages citées). Basez votre analyse sur l'ensemble de ces notes."
+ANALYSIS_INSTRUCTIONS_MULTI = "\nAnalysez l'ensemble de ces documents/images et fournissez une synthèse intégrée :\n1.  **ANALYSE INDIVIDUELLE SUCCINCTE:** Pour chaque fichier ({filenames}), résumez son contenu principal et son type.\n2.  **POINTS COMMUNS ET DIVERGENCES:** Y a-t-il des thèmes, des données ou des informations qui se recoupent ou se contredisent entre les fichiers ?\n3.  **ANALYSE D'ENSEMBLE / SYNTHÈSE:** Quelle est la compréhension globale qui émerge de la combinaison de ces fichiers ?\n4.  **RECOMMANDATIONS INTÉGRÉES:** Quelles recommandations ou conclusions pouvez-vous tirer de l'ensemble des informations fournies ?"
 
 # --- ExpertProfileManager Class ---
 class ExpertProfileManager:
+    """Accès aux profils experts via le registre partagé (noms indexés, contenus chargés à la demande)."""
+
     def __init__(self, profile_dir="profiles"):
-        self.profiles = {}
         self.profile_dir = profile_dir
-        self.load_profiles()
-
-    def load_profiles(self):
-        """Charge les profils experts depuis le dossier spécifié."""
-        print(f"Chargement des profils depuis: {self.profile_dir}")
-        if not os.path.exists(self.profile_dir):
-            print(f"AVERTISSEMENT: Le dossier de profils '{self.profile_dir}' n'existe pas.")
-            if not self.profiles:
-                 self.add_profile("default_expert", "Expert par Défaut", "Je suis un expert IA généraliste.")
-            return
+        self.registry = get_profile_registry(profile_dir)
 
-        try:
-            profile_files = [f for f in os.listdir(self.profile_dir) if f.endswith('.txt')]
-            if not profile_files:
-                 print("Aucun fichier de profil .txt trouvé.")
-                 if not self.profiles:
-                     self.add_profile("default_expert", "Expert par Défaut", "Je suis un expert IA généraliste.")
-                 return
-
-            for profile_file in profile_files:
-                profile_id = os.path.splitext(profile_file)[0]
-                profile_path = os.path.join(self.profile_dir, profile_file)
-                try:
-                    with open(profile_path, 'r', encoding='utf-8') as file:
-                        content = file.read().strip()
-                        if not content:
-                            print(f"AVERTISSEMENT: Fichier de profil vide: {profile_file}")
-                            continue
-                        lines = content.split('\n', 1)
-                        name = lines[0].strip() if lines else f"Profil_{profile_id}"
-                        profile_content = lines[1].strip() if len(lines) > 1 else f"Profil: {name}"
-                        self.add_profile(profile_id, name, profile_content)
-                        print(f"Profil chargé: {profile_id} - {name}")
-                except Exception as e:
-                    print(f"Erreur lors du chargement du profil {profile_file}: {str(e)}")
-
-        except Exception as e:
-            print(f"Erreur lors de l'accès au dossier des profils '{self.profile_dir}': {str(e)}")
-            if not self.profiles:
-                 self.add_profile("default_expert", "Expert par Défaut", "Je suis un expert IA généraliste.")
+    @property
+    def profiles(self):
+        return self.registry.as_mapping()
 
+    def load_profiles(self):
+        """Relit l'index des profils depuis le dossier spécifié."""
+        self.registry.reload()
 
     def add_profile(self, profile_id, display_name, profile_content):
-        self.profiles[profile_id] = {
-            "id": profile_id,
-            "name": display_name,
-            "content": profile_content
-        }
+        self.registry.add_profile(profile_id, display_name, profile_content)
 
     def get_profile(self, profile_id):
-        return self.profiles.get(profile_id, None)
+        return self.registry.get_profile(profile_id)
 
     def get_profile_by_name(self, name):
-        for profile in self.profiles.values():
-            if profile["name"] == name:
-                return profile
-        return None
+        return self.registry.get_profile_by_name(name)
 
     def get_all_profiles(self):
-        return self.profiles
+        """Mapping id -> profil (lecture seule); le contenu d'un profil n'est lu qu'à l'accès."""
+        return self.registry.as_mapping()
 
     def get_profile_names(self):
-        if not self.profiles:
-            self.load_profiles()
-        names = [p["name"] for p in self.profiles.values()]
-        # ✅ Tri alphabétique avec support des accents français
-        import unicodedata
-        def normalize_for_sort(text):
-            """Normalise le texte pour le tri en supprimant les accents."""
-            return unicodedata.normalize('NFD', text.lower()).encode('ascii', 'ignore').decode('ascii')
-        
-        return sorted(names, key=normalize_for_sort)
+        # ✅ Tri alphabétique avec support des accents français (pré-calculé par le registre)
+        return self.registry.get_profile_names()
+
+    def select_profile_sections(self, profile, question, recent_texts=()):
+        """En-tête et sections pertinentes d'un gros profil (index BM25 local), ou None s'il est envoyé en entier."""
+        return get_profile_retriever().select_sections(profile, question, recent_texts)
 
 
 # --- ExpertAdvisor Class ---
@@ -102,22 +82,43 @@ class ExpertAdvisor:
     def __init__(self, api_key):
         if not api_key:
             raise ValueError("Clé API Anthropic manquante.")
-        self.anthropic = Anthropic(api_key=api_key)
+        self.anthropic = get_shared_client(api_key) # Client et pool de connexions partagés par le processus
+        self.admission = get_admission_controller() # Limiteur de débit partagé par toutes les sessions
         print("Client API Anthropic initialisé.")
         self.model_name_global = "claude-sonnet-4-5-20250929" # Votre modèle unique
         print(f"Utilisation globale du modèle : {self.model_name_global}")
 
+        # Prompt caching: le profil (souvent 30k+ tokens) et le préfixe stable de la
+        # conversation sont marqués cacheables pour éviter de les repayer à chaque tour.
+        self.prompt_caching = True
+        self.last_usage = {}
+        self.usage_history = deque(maxlen=200) # Compteurs de tokens (dont cache) par appel
+        self.last_stream_metrics = {} # Latences du dernier appel en streaming
+        self.last_analysis_results = [] # Détails par fichier de la dernière analyse en streaming
+
+        # Cache persistant des réponses (partagé entre sessions et processus)
+        self.response_cache_enabled = True
+        self.response_cache = get_response_cache()
+
+        # Historique budgété en tokens; les anciens échanges sont repliés dans un résumé
+        # glissant stocké avec la conversation (summary_store = ConversationManager, défini par l'app)
+        self.history_builder = HistoryBuilder()
+        self.analysis_history_builder = HistoryBuilder(budget_tokens=ANALYSIS_HISTORY_BUDGET_TOKENS)
+        self.summary_store = None
+
+        # Mode optionnel: pour les gros profils (tables de référence), n'envoyer que l'en-tête
+        # et les sections pertinentes pour la question au lieu du profil complet
+        self.profile_retrieval_enabled = os.getenv('PROFILE_RETRIEVAL', '0') == '1'
+        self.last_profile_retrieval = None
+        # Sélection de pages appliquée aux PDF analysés ("1-20, 35"); None = toutes les pages
+        self.pdf_page_range = None
+        self.last_analysis_map = None # Parties analysées lors de la dernière analyse par parties
+        # Documents analysés joints par référence aux questions suivantes de la même conversation
+        self.document_store = get_document_store()
+        self.attach_documents = True
+
         # Support étendu des formats - 27 types de fichiers
-        self.supported_formats = [
-            # Documents
-            '.pdf', '.docx', '.doc', '.xlsx', '.xls', '.csv', '.txt', '.rtf', '.md',
-            # Images
-            '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp',
-            # Code
-            '.py', '.js', '.html', '.htm', '.css', '.json', '.xml', '.yaml', '.yml',
-            # Audio
-            '.mp3', '.wav', '.m4a', '.ogg', '.flac', '.aac'
-        ]
+        self.supported_formats = SUPPORTED_FORMATS
         
         self.profile_manager = ExpertProfileManager()
         all_profiles = self.profile_manager.get_all_profiles()
@@ -154,284 +155,136 @@ class ExpertAdvisor:
         return [ext.lstrip('.') for ext in self.supported_formats]
 
     def read_file(self, uploaded_file):
-        file_ext = os.path.splitext(uploaded_file.name)[1].lower()
-        if file_ext not in self.supported_formats:
-            return f"Format de fichier non supporté: {uploaded_file.name}. Formats acceptés: {', '.join(self.supported_formats)}"
-        
+        """Extrait le contenu d'un fichier téléversé (texte, bloc image ou message d'erreur)."""
+        upload = UploadBuffer.from_upload(uploaded_file)
         try:
-            file_bytes = uploaded_file.getvalue()
-            file_stream = io.BytesIO(file_bytes)
-            
-            # Documents PDF
-            if file_ext == '.pdf':
-                return self._read_pdf(file_stream, uploaded_file.name)
-            
-            # Documents Word
-            elif file_ext == '.docx':
-                return self._read_docx(file_stream, uploaded_file.name)
-            elif file_ext == '.doc':
-                return self._read_doc_legacy(file_bytes, uploaded_file.name)
-            
-            # Tableurs et CSV
-            elif file_ext in ['.xlsx', '.xls', '.csv']:
-                return self._read_spreadsheet(file_stream, uploaded_file.name, file_ext)
-            
-            # Texte et documents légers
-            elif file_ext in ['.txt', '.md', '.rtf']:
-                return self._read_text_document(file_stream, uploaded_file.name, file_ext)
-            
-            # Images
-            elif file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
-                return self._read_image(file_bytes, uploaded_file.name, file_ext)
-            
-            # Code
-            elif file_ext in ['.py', '.js', '.html', '.htm', '.css', '.json', '.xml', '.yaml', '.yml']:
-                return self._read_code_file(file_stream, uploaded_file.name, file_ext)
-            
-            # Audio
-            elif file_ext in ['.mp3', '.wav', '.m4a', '.ogg', '.flac', '.aac']:
-                return self._read_audio_file(file_bytes, uploaded_file.name, file_ext)
-            
-            else:
-                return f"Format de fichier interne non géré : {uploaded_file.name}"
-                
-        except Exception as e:
-            return f"Erreur générale lors de la lecture du fichier {uploaded_file.name}: {str(e)}"
-
-    def _read_pdf(self, file_stream, filename):
-        text = ""
-        try:
-            file_stream.seek(0)
-            pdf_reader = PyPDF2.PdfReader(file_stream)
-            for page in pdf_reader.pages:
-                page_text = page.extract_text()
-                if page_text: text += page_text + "\n"
-            if not text: return f"Aucun texte n'a pu être extrait de {filename}. Le PDF est-il basé sur une image ou protégé ?"
-            return text
-        except Exception as e: return f"Erreur lors de la lecture du PDF {filename}: {str(e)}"
-
-    def _read_docx(self, file_stream, filename):
-        try:
-            file_stream.seek(0)
-            doc = docx.Document(file_stream)
-            return "\n".join([p.text for p in doc.paragraphs if p.text is not None])
-        except Exception as e: return f"Erreur lors de la lecture du DOCX {filename}: {str(e)}"
-
-    def _read_doc_legacy(self, file_bytes, filename):
-        try:
-            # Tentative avec docx2txt si disponible
-            try:
-                import docx2txt
-                text = docx2txt.process(io.BytesIO(file_bytes))
-                return text if text else f"Aucun contenu texte extrait de {filename}"
-            except ImportError:
-                return f"INFO: Lecture des fichiers .DOC nécessite la bibliothèque 'docx2txt'. Veuillez l'installer : pip install docx2txt"
-        except Exception as e:
-            return f"Erreur lors de la lecture du DOC {filename}: {str(e)}"
-
-    def _read_spreadsheet(self, file_stream, filename, file_ext):
-        try:
-            if file_ext == '.csv':
-                file_stream.seek(0)
-                decoded_content = None
-                try: decoded_content = file_stream.read().decode('utf-8')
-                except UnicodeDecodeError:
-                    print(f"Décodage UTF-8 échoué pour {filename}, essai avec Latin-1.")
-                    file_stream.seek(0)
-                    try: decoded_content = file_stream.read().decode('latin1')
-                    except Exception as de: return f"Erreur de décodage pour {filename}: {str(de)}"
-                if decoded_content is None: return f"Impossible de décoder le contenu de {filename}."
-                text_stream = io.StringIO(decoded_content)
-                reader = csv.reader(text_stream)
-                output_string_io = io.StringIO()
-                writer = csv.writer(output_string_io, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-                for row in reader: writer.writerow(row)
-                return output_string_io.getvalue()
-            
-            elif file_ext == '.xlsx':
-                try:
-                    import openpyxl
-                    file_stream.seek(0)
-                    workbook = openpyxl.load_workbook(file_stream)
-                    sheet = workbook.active
-                    csv_output = io.StringIO()
-                    writer = csv.writer(csv_output)
-                    for row in sheet.iter_rows(values_only=True):
-                        writer.writerow([str(cell) if cell is not None else "" for cell in row])
-                    return csv_output.getvalue()
-                except ImportError:
-                    return "INFO: La bibliothèque 'openpyxl' est requise pour lire les fichiers .xlsx. Veuillez l'installer."
-                except Exception as e_xlsx:
-                    return f"Erreur lors de la lecture du XLSX {filename}: {str(e_xlsx)}"
-            
-            elif file_ext == '.xls':
-                try:
-                    import xlrd
-                    file_stream.seek(0)
-                    workbook = xlrd.open_workbook(file_contents=file_stream.read())
-                    sheet = workbook.sheet_by_index(0)
-                    csv_output = io.StringIO()
-                    writer = csv.writer(csv_output)
-                    for row_idx in range(sheet.nrows):
-                        row = [str(cell.value) for cell in sheet.row(row_idx)]
-                        writer.writerow(row)
-                    return csv_output.getvalue()
-                except ImportError:
-                    return "INFO: La bibliothèque 'xlrd' est requise pour lire les fichiers .xls. Veuillez l'installer."
-                except Exception as e_xls:
-                    return f"Erreur lors de la lecture du XLS {filename}: {str(e_xls)}"
-                    
-        except Exception as e: 
-            return f"Erreur lors du traitement du tableur {filename}: {str(e)}"
-
-    def _read_text_document(self, file_stream, filename, file_ext):
-        try:
-            file_stream.seek(0)
-            raw_bytes = file_stream.read()
-            
-            if file_ext == '.rtf':
-                try:
-                    from striprtf.striprtf import rtf_to_text
-                    text = rtf_to_text(raw_bytes.decode('utf-8'))
-                    return text
-                except ImportError:
-                    return f"INFO: La bibliothèque 'striprtf' est requise pour lire les fichiers RTF. Veuillez l'installer."
-                except Exception as e:
-                    return f"Erreur lors de la lecture du RTF {filename}: {str(e)}"
-            
-            # Pour TXT et MD
-            try: 
-                return raw_bytes.decode('utf-8')
-            except UnicodeDecodeError:
-                try:
-                    import chardet
-                    detected = chardet.detect(raw_bytes)
-                    encoding = detected.get('encoding', 'utf-8')
-                    return raw_bytes.decode(encoding, errors='replace')
-                except:
-                    return raw_bytes.decode('cp1252', errors='replace')
-                    
-        except Exception as e: 
-            return f"Erreur lors de la lecture du fichier texte {filename}: {str(e)}"
-
-    def _read_code_file(self, file_stream, filename, file_ext):
-        try:
-            file_stream.seek(0)
-            raw_bytes = file_stream.read()
-            
-            # Détection d'encodage pour fichiers code
-            try:
-                import chardet
-                detected = chardet.detect(raw_bytes)
-                encoding = detected.get('encoding', 'utf-8')
-                content = raw_bytes.decode(encoding)
-            except ImportError:
-                content = raw_bytes.decode('utf-8', errors='replace')
-            except UnicodeDecodeError:
-                content = raw_bytes.decode('utf-8', errors='replace')
-            
-            # Formatage simple selon le type
-            if file_ext == '.json':
-                try:
-                    import json
-                    parsed = json.loads(content)
-                    content = json.dumps(parsed, indent=2, ensure_ascii=False)
-                except:
-                    pass  # Garder le contenu original si parsing échoue
-            
-            elif file_ext in ['.yaml', '.yml']:
-                try:
-                    import yaml
-                    parsed = yaml.safe_load(content)
-                    content = yaml.dump(parsed, default_flow_style=False, allow_unicode=True)
-                except:
-                    pass  # Garder le contenu original si parsing échoue
-            
-            return content
-            
-        except Exception as e:
-            return f"Erreur lors de la lecture du fichier code {filename}: {str(e)}"
-
-    def _read_audio_file(self, file_bytes, filename, file_ext):
-        """Lecture basique des métadonnées audio."""
-        try:
-            return f"Fichier audio: {filename}\nTaille: {len(file_bytes) / 1024 / 1024:.2f} MB\nFormat: {file_ext.upper()}\n\nNote: Analyse audio complète nécessite des bibliothèques spécialisées (pydub, librosa, speechrecognition)"
-        except Exception as e:
-            return f"Erreur lors de l'analyse audio {filename}: {str(e)}"
-
-    def _read_image(self, file_bytes, filename, file_ext):
-        try:
-            img = Image.open(io.BytesIO(file_bytes))
-            mime_types = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', 
-                         '.gif': 'image/gif', '.bmp': 'image/bmp', '.webp': 'image/webp'}
-            mime_type = mime_types.get(file_ext)
-            if not mime_type: return f"Format d'image non supporté par l'API: {filename}"
-            
-            # Claude 3 image size limits: max 5MB per image, max 20MB per request, max 1568x1568 pixels
-            if len(file_bytes) > 5 * 1024 * 1024: # 5MB
-                return f"L'image {filename} dépasse la limite de 5MB par image."
-
-            max_pixels = 1568 * 1568 
-            if img.width * img.height > max_pixels:
-                 print(f"Redimensionnement de l'image {filename} car elle dépasse la taille max de pixels ({img.width}x{img.height}).")
-                 img.thumbnail((1568, 1568), Image.Resampling.LANCZOS)
-
-            buffered = io.BytesIO()
-            img_format = mime_type.split('/')[1].upper()
-            if img_format == 'JPEG' and img.mode in ('RGBA', 'LA', 'P'):
-                 print(f"Conversion de l'image {filename} en RGB pour sauvegarde JPEG.")
-                 img = img.convert('RGB')
-            
-            # Save with quality settings if JPEG to control size a bit more
-            if img_format == 'JPEG':
-                img.save(buffered, format=img_format, quality=85, optimize=True)
-            else:
-                img.save(buffered, format=img_format)
-
-            # Final check on encoded size
-            if buffered.tell() > 5 * 1024 * 1024:
-                 return f"L'image {filename} après encodage/redimensionnement dépasse toujours 5MB."
-
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            return {'type': 'image', 'source': {'type': 'base64', 'media_type': mime_type, 'data': img_str}}
-        except Exception as e: return f"Erreur lors du traitement de l'image {filename}: {str(e)}"
-
-    def analyze_documents(self, uploaded_files, conversation_history):
-        if not uploaded_files: return "Veuillez téléverser au moins un fichier.", []
-        
-        analysis_results, processed_contents, filenames, content_types = [], [], [], []
-        total_image_size_mb = 0
-
-        for uploaded_file in uploaded_files:
-            content = self.read_file(uploaded_file)
-            if isinstance(content, str) and (content.startswith("Erreur") or content.startswith("Format") or content.startswith("Aucun texte") or content.startswith("INFO") or content.startswith("Impossible") or content.startswith("L'image")):
-                analysis_results.append((uploaded_file.name, content)) # Include error messages
-            elif isinstance(content, dict) and content.get('type') == 'image':
-                # Estimate size of base64 string for total request limit
-                # Base64 is approx 4/3 original size. Add some overhead.
-                image_size_bytes = len(content['source']['data']) * 3 / 4
-                total_image_size_mb += image_size_bytes / (1024 * 1024)
-                if total_image_size_mb > 18: # Leave some room for text and overhead from 20MB limit
-                    analysis_results.append((uploaded_file.name, "Taille totale des images pour cette requête dépasserait la limite de l'API. Cette image n'a pas été ajoutée."))
-                    continue # Skip this image
-                processed_contents.append(content)
-                filenames.append(uploaded_file.name)
-                content_types.append('image')
-            elif isinstance(content, str):
-                 processed_contents.append(content)
-                 filenames.append(uploaded_file.name)
-                 content_types.append('text')
-            else: 
-                analysis_results.append((uploaded_file.name, f"Erreur interne: Type de contenu inattendu ({type(content)})"))
+            content, _elapsed_s, _cached, _peak_mb = extract_content_cached(upload.name, upload.view)
+        finally:
+            upload.close()
+        return content
+
+    def _build_system_prompt(self, system_text, conversation_summary=None, profile_sections=None):
+        """Retourne le prompt système, sous forme de bloc cacheable si le mode cache est actif.
+
+        Les sections de profil sélectionnées et le résumé glissant éventuel sont ajoutés après
+        le profil (ou son en-tête) pour ne pas invalider son cache.
+        """
+        extra_texts = []
+        if profile_sections:
+            extra_texts.append(f"Extraits de ta base de connaissances pertinents pour cette question:\n{profile_sections}")
+        if conversation_summary:
+            extra_texts.append(f"Résumé des échanges précédents de cette consultation:\n{conversation_summary}")
+        if not self.prompt_caching:
+            return "\n\n".join([system_text] + extra_texts)
+        system_blocks = [{"type": "text", "text": system_text, "cache_control": CACHE_CONTROL_EPHEMERAL}]
+        for text in extra_texts:
+            system_blocks.append({"type": "text", "text": text})
+        return system_blocks
+
+    def _select_profile_context(self, profile, question, conversation_history):
+        """Retourne (texte système, sections pertinentes ou None) selon le mode de sélection des sections."""
+        profile_content = profile.get('content', 'Vous êtes un expert IA utile.')
+        if not self.profile_retrieval_enabled:
+            return profile_content, None
+        recent_texts = [msg.get("content") for msg in conversation_history[-RETRIEVAL_HISTORY_MESSAGES:]
+                        if msg.get("role") != "system" and isinstance(msg.get("content"), str)]
+        selection = self.profile_manager.select_profile_sections(profile, question, recent_texts)
+        if selection is None:
+            return profile_content, None
+        self.last_profile_retrieval = {"profile_id": profile.get("id"), "sections": len(selection["selected"]),
+                                       "total_sections": selection["total_sections"],
+                                       "profile_tokens": selection["profile_tokens"],
+                                       "sent_tokens": selection["sent_tokens"]}
+        print(f"[PROFIL] {profile.get('id')}: {len(selection['selected'])}/{selection['total_sections']} sections "
+              f"(~{selection['sent_tokens']} tokens au lieu de ~{selection['profile_tokens']})")
+        return selection["header"], selection["sections_text"] or None
+
+    def _mark_stable_prefix(self, api_messages):
+        """Marque la fin du préfixe stable de la conversation (tout sauf le dernier message) comme cacheable."""
+        if not self.prompt_caching or len(api_messages) < 2:
+            return api_messages
+        prefix_msg = api_messages[-2]
+        content = prefix_msg["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        else:
+            content = [dict(block) for block in content]
+        if not content:
+            return api_messages
+        content[-1]["cache_control"] = CACHE_CONTROL_EPHEMERAL
+        marked_messages = list(api_messages)
+        marked_messages[-2] = {**prefix_msg, "content": content}
+        return marked_messages
+
+    def _call_api(self, priority=PRIORITY_INTERACTIVE, **request_kwargs):
+        """messages.create sous le contrôle d'admission partagé (débit, concurrence, réessais, disjoncteur)."""
+        return self.admission.create_message(self.anthropic, priority=priority, **request_kwargs)
+
+    def _record_usage(self, response, call_type):
+        """Enregistre les compteurs de tokens d'un appel, dont les lectures/écritures du cache de prompt."""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return None
+        usage_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "call_type": call_type,
+            "model": self.model_name_global,
+            "input_tokens": getattr(usage, 'input_tokens', 0) or 0,
+            "output_tokens": getattr(usage, 'output_tokens', 0) or 0,
+            "cache_creation_input_tokens": getattr(usage, 'cache_creation_input_tokens', 0) or 0,
+            "cache_read_input_tokens": getattr(usage, 'cache_read_input_tokens', 0) or 0,
+        }
+        self.last_usage = usage_entry
+        self.usage_history.append(usage_entry)
+        print(f"[CACHE] {call_type}: lecture cache={usage_entry['cache_read_input_tokens']} tokens, "
+              f"écriture cache={usage_entry['cache_creation_input_tokens']} tokens, "
+              f"entrée non cachée={usage_entry['input_tokens']} tokens")
+        return usage_entry
+
+    def get_cache_usage_summary(self):
+        """Agrège les compteurs de tokens des derniers appels (lecture/écriture cache, entrée, sortie)."""
+        summary = {"calls": 0, "input_tokens": 0, "output_tokens": 0,
+                   "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+        for entry in self.usage_history:
+            summary["calls"] += 1
+            for key in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+                summary[key] += entry.get(key, 0)
+        total_input = summary["input_tokens"] + summary["cache_creation_input_tokens"] + summary["cache_read_input_tokens"]
+        summary["cache_hit_ratio"] = (summary["cache_read_input_tokens"] / total_input) if total_input else 0.0
+        return summary
+
+    def _prepare_analysis_request(self, uploaded_files, conversation_history, conversation_id=None):
+        """Lit les fichiers et prépare la requête d'analyse.
+
+        Retourne (request_kwargs, analysis_results, filenames); request_kwargs vaut None
+        si aucun fichier n'a pu être traité. Avec un conversation_id, les contenus sont
+        enregistrés pour être joints par référence aux questions suivantes.
+        """
+        # Lecture parallèle (pool de processus pour PDF, tableurs et images), résultats dans l'ordre des fichiers
+        ingestion_start = time.perf_counter()
+        ingested_files = ingest_files(uploaded_files, pdf_pages=self.pdf_page_range)
+        print(f"[INGESTION] {len(ingested_files)} fichier(s) lu(s) en {time.perf_counter() - ingestion_start:.2f}s "
+              f"(somme séquentielle: {sum(f['elapsed_s'] for f in ingested_files):.2f}s, "
+              f"{sum(1 for f in ingested_files if f.get('cached'))} depuis le cache)")
+        analysis_results, processed_contents, filenames, content_types = select_contents_for_request(ingested_files)
 
         if not processed_contents: 
-            # If only errors, return them
-            error_summary = "Aucun fichier n'a pu être traité avec succès pour l'analyse.\n"
-            for name, reason in analysis_results:
-                error_summary += f"- {name}: {reason}\n"
-            return error_summary, analysis_results
+            return None, analysis_results, filenames
 
         profile = self.get_current_profile()
+        # Documents trop volumineux pour une seule requête: analyse par parties (map), puis synthèse (reduce)
+        self.last_analysis_map = None
+        text_tokens = sum(estimate_tokens(c) for c, t in zip(processed_contents, content_types) if t == 'text')
+        map_reduce = text_tokens > ANALYSIS_DIRECT_MAX_TOKENS
+        if map_reduce:
+            processed_contents = self._map_analysis_chunks(profile, processed_contents, filenames, content_types,
+                                                           analysis_results)
+            if processed_contents is None:
+                return None, analysis_results, filenames
+
+        if conversation_id is not None:
+            self._register_documents(conversation_id, processed_contents, filenames, content_types)
+
         prompt_text_parts = [f"En tant qu'expert {profile['name']}, analysez le(s) contenu(s) suivant(s) provenant du/des fichier(s) nommé(s) : {', '.join(filenames)}."]
         history_str = self._format_history_for_api(conversation_history)
         if history_str != "Aucun historique": 
@@ -440,9 +293,11 @@ class ExpertAdvisor:
         num_valid_files = len(processed_contents)
         
         if num_valid_files == 1:
-            prompt_text_parts.append("\nAnalysez ce document/image et fournissez une analyse structurée comprenant :\n1.  **RÉSUMÉ / DESCRIPTION GÉNÉRALE:** Décrivez brièvement le contenu du fichier.\n2.  **ANALYSE TECHNIQUE / ÉLÉMENTS CLÉS:** Identifiez les points techniques, données, ou éléments visuels importants. S'il s'agit de plans ou schémas, décrivez-les.\n3.  **ANALYSE FINANCIÈRE (si applicable et possible):** Si des informations financières sont présentes ou peuvent être inférées, commentez-les.\n4.  **RECOMMANDATIONS / QUESTIONS:** Basé sur l'analyse, quelles sont vos recommandations ou quelles questions supplémentaires se posent ?")
+            prompt_text_parts.append(ANALYSIS_INSTRUCTIONS_SINGLE)
         else:
-            prompt_text_parts.append(f"\nAnalysez l'ensemble de ces documents/images et fournissez une synthèse intégrée :\n1.  **ANALYSE INDIVIDUELLE SUCCINCTE:** Pour chaque fichier ({', '.join(filenames)}), résumez son contenu principal et son type.\n2.  **POINTS COMMUNS ET DIVERGENCES:** Y a-t-il des thèmes, des données ou des informations qui se recoupent ou se contredisent entre les fichiers ?\n3.  **ANALYSE D'ENSEMBLE / SYNTHÈSE:** Quelle est la compréhension globale qui émerge de la combinaison de ces fichiers ?\n4.  **RECOMMANDATIONS INTÉGRÉES:** Quelles recommandations ou conclusions pouvez-vous tirer de l'ensemble des informations fournies ?")
+            prompt_text_parts.append(ANALYSIS_INSTRUCTIONS_MULTI.format(filenames=', '.join(filenames)))
+        if map_reduce:
+            prompt_text_parts.append(ANALYSIS_REDUCE_NOTE)
 
         final_prompt_instruction = "\n".join(prompt_text_parts) + "\n\nFournissez votre réponse de manière claire et bien structurée."
         api_system_prompt = profile.get('content', 'Vous êtes un expert IA compétent.')
@@ -461,14 +316,137 @@ class ExpertAdvisor:
         # Add the final instruction
         user_message_content.append({"type": "text", "text": final_prompt_instruction})
         
-        api_messages = [{"role": "user", "content": user_message_content}]
+        request_kwargs = {
+            "model": self.model_name_global,
+            "max_tokens": 8000,
+            "messages": [{"role": "user", "content": user_message_content}],
+            "system": self._build_system_prompt(api_system_prompt),
+        }
+        return request_kwargs, analysis_results, filenames
 
+    def _analyze_chunk(self, system_prompt, filename, chunk, part_label):
+        """Analyse d'une partie de document (phase map); retourne (notes, erreur, durée)."""
+        start_time = time.perf_counter()
         try:
-            print(f"Appel API Claude pour analyse de {num_valid_files} fichier(s)... Modèle: {self.model_name_global}")
-            response = self.anthropic.messages.create(
-                model=self.model_name_global, max_tokens=8000,
-                messages=api_messages, system=api_system_prompt
+            response = self._call_api(
+                model=self.model_name_global,
+                max_tokens=ANALYSIS_MAP_MAX_TOKENS,
+                messages=[{"role": "user", "content": [
+                    {"type": "text", "text": f"{SEPARATOR_DOUBLE}\nDEBUT Contenu Fichier: {filename} ({part_label})\n{SEPARATOR_SINGLE}\n{chunk['text']}\n{SEPARATOR_SINGLE}\nFIN Contenu Fichier: {filename} ({part_label})\n{SEPARATOR_DOUBLE}\n"},
+                    {"type": "text", "text": ANALYSIS_MAP_INSTRUCTIONS.format(part=part_label, filename=filename)},
+                ]}],
+                system=system_prompt,
             )
+            self._record_usage(response, "analyse:partie")
+            if response.content and len(response.content) > 0 and response.content[0].text:
+                return response.content[0].text, None, time.perf_counter() - start_time
+            return None, "Réponse vide de l'API.", time.perf_counter() - start_time
+        except APIError as e:
+            return None, f"Erreur API ({getattr(e, 'status_code', 'N/A')}): {e.message}", time.perf_counter() - start_time
+        except Exception as e:
+            return None, f"Erreur technique: {type(e).__name__} - {e}", time.perf_counter() - start_time
+
+    def _map_analysis_chunks(self, profile, processed_contents, filenames, content_types, analysis_results):
+        """
+        Phase map: découpe les textes en parties et les analyse en parallèle (appels soumis au limiteur partagé).
+
+        Retourne les contenus où chaque texte est remplacé par les notes de ses parties,
+        ou None si aucune partie n'a pu être analysée.
+        """
+        start_time = time.perf_counter()
+        # Même prompt système pour toutes les parties: le profil n'est mis en cache qu'une fois
+        system_prompt = self._build_system_prompt(profile.get('content', 'Vous êtes un expert IA compétent.'))
+        # Les plus gros textes passent par les parties jusqu'à ce que le reste tienne dans la moitié du budget
+        # (les petits fichiers restent envoyés tels quels à la synthèse)
+        text_sizes = sorted(((estimate_tokens(c), i) for i, (c, t) in enumerate(zip(processed_contents, content_types))
+                             if t == 'text'), reverse=True)
+        direct_tokens = sum(tokens for tokens, _index in text_sizes)
+        mapped_indexes = []
+        for tokens, index in text_sizes:
+            if direct_tokens <= ANALYSIS_DIRECT_MAX_TOKENS // 2:
+                break
+            mapped_indexes.append(index)
+            direct_tokens -= tokens
+
+        jobs = []  # (index du contenu, numéro de partie, nombre de parties, partie)
+        for index in sorted(mapped_indexes):
+            chunks = split_text_into_chunks(processed_contents[index])
+            jobs.extend((index, part, len(chunks), chunk) for part, chunk in enumerate(chunks, start=1))
+
+        print(f"[ANALYSE] Analyse par parties: {len(jobs)} partie(s) (max {ANALYSIS_MAP_MAX_WORKERS} simultanées)")
+        notes = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(ANALYSIS_MAP_MAX_WORKERS, len(jobs)))) as executor:
+            futures = {
+                executor.submit(self._analyze_chunk, system_prompt, filenames[index], chunk,
+                                describe_chunk(chunk, part, total)): (index, part)
+                for index, part, total, chunk in jobs
+            }
+            for future in as_completed(futures):
+                notes[futures[future]] = future.result()
+
+        mapped_contents = list(processed_contents)
+        failures, durations = 0, []
+        # Les notes de toutes les parties doivent tenir dans la requête de synthèse
+        max_note_tokens = max(500, ANALYSIS_DIRECT_MAX_TOKENS // max(1, len(jobs)))
+        for index, part, total, chunk in jobs:
+            text, error, duration_s = notes[(index, part)]
+            durations.append(duration_s)
+            part_label = describe_chunk(chunk, part, total)
+            if error:
+                failures += 1
+                analysis_results.append((f"{filenames[index]} ({part_label})", error))
+                text = f"[Notes indisponibles pour cette partie: {error}]"
+            else:
+                text = truncate_to_tokens(text, max_note_tokens)
+            if part == 1:
+                mapped_contents[index] = ""
+            mapped_contents[index] += f"\n--- Notes d'analyse, {part_label} ---\n{text}\n"
+
+        total_time = time.perf_counter() - start_time
+        self.last_analysis_map = {"parts": len(jobs), "failures": failures, "duration_s": total_time,
+                                  "sequential_s": sum(durations)}
+        print(f"[ANALYSE] Parties analysées en {total_time:.2f}s (somme séquentielle: {sum(durations):.2f}s)")
+        analysis_results.append(("Analyse par parties",
+                                 f"{len(jobs) - failures}/{len(jobs)} partie(s) analysée(s) en {total_time:.1f} s"))
+        if failures == len(jobs):
+            return None
+        return mapped_contents
+
+    def _upload_document_file(self, filename, data, mime_type):
+        """Téléverse un fichier vers l'API de fichiers (sous le limiteur partagé) et retourne son identifiant."""
+        file_metadata = self.admission.call(self.anthropic.beta.files.upload, priority=PRIORITY_BACKGROUND,
+                                            file=(filename, data, mime_type))
+        return file_metadata.id
+
+    def _register_documents(self, conversation_id, processed_contents, filenames, content_types):
+        """Enregistre les contenus analysés (texte extrait, notes par parties ou image) pour la conversation."""
+        for content, filename, content_type in zip(processed_contents, filenames, content_types):
+            try:
+                self.document_store.register(conversation_id, filename, content, content_type,
+                                             uploader=self._upload_document_file)
+            except Exception as e:
+                print(f"[DOCUMENTS] Enregistrement de {filename} impossible: {e}")
+
+    def _summarize_analysis_errors(self, analysis_results):
+        error_summary = "Aucun fichier n'a pu être traité avec succès pour l'analyse.\n"
+        for name, reason in analysis_results:
+            error_summary += f"- {name}: {reason}\n"
+        return error_summary
+
+    def analyze_documents(self, uploaded_files, conversation_history, conversation_id=None):
+        if not uploaded_files: return "Veuillez téléverser au moins un fichier.", []
+        
+        request_kwargs, analysis_results, filenames = self._prepare_analysis_request(uploaded_files, conversation_history,
+                                                                                     conversation_id)
+        if request_kwargs is None:
+            # If only errors, return them
+            return self._summarize_analysis_errors(analysis_results), analysis_results
+
+        num_valid_files = len(filenames)
+        try:
+            print(f"Appel API Claude pour analyse de {num_valid_files} fichier(s)... Modèle: {self.model_name_global}")
+            response = self._call_api(**request_kwargs)
+            self._record_usage(response, "analyse")
             if response.content and len(response.content) > 0 and response.content[0].text:
                 api_response_text = response.content[0].text
                 # Add successful analysis to results
@@ -495,85 +473,213 @@ class ExpertAdvisor:
                 analysis_results.append(("Erreur API Claude (Analyse)", error_msg))
             return error_msg, analysis_results
 
+    def analyze_documents_stream(self, uploaded_files, conversation_history, conversation_id=None):
+        """Générateur: produit l'analyse des documents par fragments de texte.
+
+        Les détails par fichier sont disponibles dans self.last_analysis_results
+        une fois le générateur épuisé.
+        """
+        self.last_analysis_results = []
+        if not uploaded_files:
+            yield "Veuillez téléverser au moins un fichier."
+            return
+
+        request_kwargs, analysis_results, filenames = self._prepare_analysis_request(uploaded_files, conversation_history,
+                                                                                     conversation_id)
+        self.last_analysis_results = analysis_results
+        if request_kwargs is None:
+            yield self._summarize_analysis_errors(analysis_results)
+            return
+
+        num_valid_files = len(filenames)
+        print(f"Appel API Claude (streaming) pour analyse de {num_valid_files} fichier(s)... Modèle: {self.model_name_global}")
+        for text in self._stream_request(request_kwargs, "analyse"):
+            yield text
+        if self.last_stream_metrics.get("error"):
+            analysis_results.append(("Erreur API Claude (Analyse)", self.last_stream_metrics["error"]))
+        else:
+            analysis_results.append(("Analyse Combinée" if num_valid_files > 1 else f"Analyse: {filenames[0]}", "Succès"))
+
+    def _stream_request(self, request_kwargs, call_type, cache_key=None, cache_tag=None):
+        """Exécute une requête en streaming et produit les fragments de texte.
+
+        Mesure la latence du premier token et la durée totale dans self.last_stream_metrics.
+        Si cache_key est fourni, la réponse complète est mise en cache à la fin du flux.
+        La place du limiteur est tenue tant que le flux de l'API est ouvert: elle est libérée
+        à la fin du flux, sur erreur, ou quand l'appelant ferme le générateur (close(),
+        générateur abandonné puis ramassé, arrêt du script Streamlit).
+        """
+        start_time = time.perf_counter()
+        metrics = {"call_type": call_type, "first_token_s": None, "total_s": None, "error": None, "cached": False}
+        self.last_stream_metrics = metrics
+        received_text = False
+        received_chunks = []
+        estimated_tokens = estimate_request_tokens(request_kwargs)
+        attempt = 0
+        try:
+            while True:
+                self.admission.acquire(PRIORITY_INTERACTIVE, estimated_tokens)
+                try:
+                    with self.anthropic.messages.stream(**request_kwargs) as stream:
+                        for text in stream.text_stream:
+                            if not text:
+                                continue
+                            if metrics["first_token_s"] is None:
+                                metrics["first_token_s"] = time.perf_counter() - start_time
+                                print(f"[STREAM] {call_type}: premier token après {metrics['first_token_s']:.2f}s")
+                            received_text = True
+                            received_chunks.append(text)
+                            yield text
+                        final_message = stream.get_final_message()
+                except Exception as e:
+                    self.admission.release(e)
+                    # Réessai seulement avant le premier fragment (rien n'a encore été affiché)
+                    if received_text or not is_retryable_error(e) or attempt >= API_CALL_MAX_RETRIES:
+                        raise
+                    attempt += 1
+                    self.admission.stats['retries'] += 1
+                    print(f"[STREAM] {call_type}: erreur transitoire ({type(e).__name__}), essai {attempt}/{API_CALL_MAX_RETRIES}")
+                    if getattr(e, 'status_code', None) not in (429, 529):  # Sinon la pause commune du limiteur s'applique
+                        time.sleep(compute_backoff_delay(attempt - 1))
+                    continue
+                except BaseException:
+                    # GeneratorExit (flux fermé par l'appelant) ou interruption: pas un échec du service
+                    self.admission.release()
+                    raise
+                self.admission.release()
+                break
+            self._record_usage(final_message, call_type)
+            if not received_text:
+                metrics["error"] = "Réponse vide de l'API (streaming)."
+                yield "Désolé, j'ai reçu une réponse vide de l'IA Claude. Veuillez réessayer."
+            elif cache_key and self.response_cache is not None:
+                self.response_cache.set(cache_key, "".join(received_chunks), profile_id=cache_tag)
+        except APIError as e:
+            metrics["error"] = f"{type(e).__name__} ({getattr(e, 'status_code', 'N/A')}) - {e.message}"
+            print(f"Erreur API Anthropic (streaming {call_type}): {metrics['error']}")
+            yield f"\n\nDésolé, une erreur API technique est survenue avec l'IA Claude ({getattr(e, 'status_code', 'N/A')}). Veuillez réessayer."
+        except Exception as e:
+            metrics["error"] = f"{type(e).__name__} - {e}"
+            print(f"API Error (Claude) in streaming {call_type}: {metrics['error']}")
+            yield f"\n\nDésolé, une erreur technique est survenue avec l'IA Claude ({type(e).__name__}). Veuillez réessayer."
+        finally:
+            metrics["total_s"] = time.perf_counter() - start_time
+            print(f"[STREAM] {call_type}: durée totale {metrics['total_s']:.2f}s")
+
     def _format_history_for_api(self, conversation_history):
          if not conversation_history: return "Aucun historique"
-         formatted_history = []
-         turns_to_include = 5 # Number of user/assistant turn pairs
-         
-         # Iterate backwards to get the most recent turns
-         user_turns = 0
-         assistant_turns = 0
-         temp_history = []
-         for msg in reversed(conversation_history):
-             if len(temp_history) >= turns_to_include * 2 : # Approx limit
-                 break
-             role, content = msg["role"], msg["content"]
-             if role == "system": continue
-             
-             role_name = "Utilisateur" if role == "user" else "Expert"
-             if role == "search_result": 
-                 role_name = "InfoWeb"
-                 content = f"[Résultat Recherche Web]: {content}"
-             
-             # Basic check for relevance, ignore very short/placeholder messages if needed
-             # if len(str(content).strip()) < 10 and role != "user": continue 
-
-             temp_history.append(f"{role_name}: {content}")
-
-             if role == "user": user_turns +=1
-             if role == "assistant": assistant_turns +=1
-             if user_turns >= turns_to_include and assistant_turns >= turns_to_include:
-                 break
-        
-         formatted_history = list(reversed(temp_history)) # Put back in chronological order
-         return "\n".join(formatted_history) if formatted_history else "Aucun historique pertinent."
-
-    def obtenir_reponse(self, question, conversation_history):
-        profile = self.get_current_profile()
-        if not profile: return "Erreur Critique: Profil expert non défini."
-        
-        api_messages_history = []
-        # History for Claude API should be a list of {"role": "user/assistant", "content": ...}
-        # Include a limited number of recent messages
-        history_limit_pairs = 8 # Max user/assistant pairs
-        
-        # Filter and format history
-        relevant_history = []
-        for msg in conversation_history:
-            role, content = msg.get("role"), msg.get("content")
-            if role == "system" or not isinstance(content, str): # Skip system messages and non-string content for this
-                continue
-            
-            # Map roles correctly for Claude
-            api_role = None
-            if role == "user":
-                api_role = "user"
-            elif role == "assistant" or role == "search_result":
-                api_role = "assistant"
-                if role == "search_result":
-                    content = f"[Info from Web Search]:\n{content}"
-            
-            if api_role:
-                relevant_history.append({"role": api_role, "content": content})
-        
-        # Take last N messages, ensuring it starts with user if possible, or just truncates
-        start_index = max(0, len(relevant_history) - (history_limit_pairs * 2))
-        api_messages_history = relevant_history[start_index:]
+         # Messages les plus récents qui tiennent dans le budget de tokens de l'analyse
+         formatted_history = self.analysis_history_builder.build_text(conversation_history)
+         return formatted_history if formatted_history else "Aucun historique pertinent."
+
+    def _prepare_conversation_request(self, question, conversation_history, profile=None, conversation_id=None,
+                                      document_scope=None):
+        """Construit les paramètres de l'appel API conversationnel pour un profil (courant par défaut).
+
+        L'historique est rempli à partir du message le plus récent jusqu'au budget de tokens;
+        les échanges plus anciens sont couverts par le résumé glissant de la conversation.
+        document_scope: clé des documents joints (par défaut conversation_id; clé de session
+        tant que la conversation n'est pas sauvegardée).
+        """
+        if document_scope is None:
+            document_scope = conversation_id
+        if profile is None:
+            profile = self.get_current_profile()
+        if not profile: return None
+
+        conversation_summary, summary_upto = None, 0
+        if conversation_id is not None and self.summary_store is not None:
+            conversation_summary, summary_upto = self.summary_store.get_conversation_summary(conversation_id)
+
+        reserved_tokens = estimate_tokens(question) + estimate_tokens(conversation_summary)
+        api_messages_history, window_start, all_api_messages = self.history_builder.build(
+            conversation_history, reserved_tokens=reserved_tokens
+        )
+
+        # Échanges sortis de la fenêtre et pas encore résumés: rafraîchir le résumé en arrière-plan
+        if conversation_id is not None and self.summary_store is not None and window_start > summary_upto:
+            pending_messages = all_api_messages[summary_upto:window_start]
+            if sum(estimate_tokens(m["content"]) for m in pending_messages) >= SUMMARY_MIN_NEW_TOKENS:
+                summary_refresher.schedule(conversation_id, self._refresh_conversation_summary,
+                                           conversation_id, all_api_messages[:window_start],
+                                           conversation_summary, summary_upto)
 
         api_messages_history.append({"role": "user", "content": question})
+
+        # Documents déjà analysés dans cette conversation: préfixe stable (cacheable) avant l'historique
+        uses_files = False
+        if document_scope is not None and self.attach_documents:
+            document_messages, uses_files = self.document_store.build_prefix_messages(document_scope)
+            api_messages_history = document_messages + api_messages_history
         
-        api_system_prompt = profile.get('content', 'Vous êtes un expert IA utile.')
+        api_system_prompt, profile_sections = self._select_profile_context(profile, question, conversation_history)
+        
+        request_kwargs = {
+            "model": self.model_name_global,
+            "max_tokens": 8000,
+            "messages": self._mark_stable_prefix(api_messages_history),
+            "system": self._build_system_prompt(api_system_prompt, conversation_summary, profile_sections),
+        }
+        if uses_files:
+            request_kwargs["extra_headers"] = {"anthropic-beta": FILES_API_BETA}
+        return request_kwargs
+
+    def _refresh_conversation_summary(self, conversation_id, covered_messages, previous_summary, summary_upto):
+        """Replie dans le résumé glissant les messages sortis de la fenêtre (exécuté en arrière-plan)."""
+        new_messages = covered_messages[summary_upto:]
+        if not new_messages:
+            return
+        exchanges_text = truncate_to_tokens(format_messages_for_summary(new_messages), SUMMARY_INPUT_MAX_TOKENS)
+        summary_prompt = (
+            f"Résumé actuel:\n{previous_summary or '(aucun)'}\n\n"
+            f"Nouveaux échanges à intégrer:\n{SEPARATOR_SINGLE}\n{exchanges_text}\n{SEPARATOR_SINGLE}\n\n"
+            "Produis le résumé mis à jour de toute la consultation."
+        )
+        print(f"[RÉSUMÉ] Rafraîchissement du résumé de la conversation {conversation_id} ({len(new_messages)} nouveau(x) message(s))")
+        response = self._call_api(
+            priority=PRIORITY_BACKGROUND,
+            model=self.model_name_global,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            system=SUMMARY_SYSTEM_PROMPT,
+            messages=[{"role": "user", "content": summary_prompt}]
+        )
+        self._record_usage(response, "resume")
+        if response.content and len(response.content) > 0 and response.content[0].text:
+            self.summary_store.save_conversation_summary(conversation_id, response.content[0].text, len(covered_messages))
+
+    def _lookup_cached_response(self, request_kwargs, profile):
+        """Retourne (clé de cache, réponse en cache ou None) pour une requête conversationnelle."""
+        if not self.response_cache_enabled or self.response_cache is None:
+            return None, None
+        profile_id, profile_content = profile.get("id"), profile.get("content", "")
+        self.response_cache.check_profile_version(profile_id, profile_content)
+        # Le contexte système au-delà du profil (résumé glissant) fait partie de la clé
+        system = request_kwargs.get("system")
+        extra_context = "\n".join(block["text"] for block in system[1:]) if isinstance(system, list) else system
+        cache_key = self.response_cache.make_key(request_kwargs["model"], profile_id, profile_content,
+                                                 request_kwargs["messages"], extra_context=extra_context)
+        return cache_key, self.response_cache.get(cache_key)
+
+    def obtenir_reponse(self, question, conversation_history, conversation_id=None, document_scope=None):
+        profile = self.get_current_profile()
+        request_kwargs = self._prepare_conversation_request(question, conversation_history, profile=profile,
+                                                            conversation_id=conversation_id,
+                                                            document_scope=document_scope)
+        if request_kwargs is None: return "Erreur Critique: Profil expert non défini."
+
+        cache_key, cached_response = self._lookup_cached_response(request_kwargs, profile)
+        if cached_response:
+            print("Réponse servie depuis le cache de réponses.")
+            return cached_response
         
         try:
             print(f"Appel API Claude pour réponse conversationnelle... Modèle: {self.model_name_global}")
-            response = self.anthropic.messages.create(
-                model=self.model_name_global, 
-                max_tokens=8000,
-                messages=api_messages_history, 
-                system=api_system_prompt
-            )
+            response = self._call_api(**request_kwargs)
+            self._record_usage(response, "conversation")
             if response.content and len(response.content) > 0 and response.content[0].text:
                 print("Réponse Claude reçue.")
+                if cache_key:
+                    self.response_cache.set(cache_key, response.content[0].text, profile_id=profile.get("id"))
                 return response.content[0].text
             else:
                  print("Erreur: Réponse vide ou mal formée de l'API (obtenir_reponse).")
@@ -585,6 +691,129 @@ class ExpertAdvisor:
             print(f"API Error (Claude) in obtenir_reponse: {type(e).__name__} - {e}")
             return f"Désolé, une erreur technique est survenue avec l'IA Claude ({type(e).__name__}). Veuillez réessayer."
 
+    def obtenir_reponse_stream(self, question, conversation_history, conversation_id=None, document_scope=None):
+        """Générateur: produit la réponse de l'expert par fragments de texte au fil de la génération.
+
+        Les latences (premier token, durée totale) sont disponibles dans self.last_stream_metrics.
+        """
+        profile = self.get_current_profile()
+        request_kwargs = self._prepare_conversation_request(question, conversation_history, profile=profile,
+                                                            conversation_id=conversation_id,
+                                                            document_scope=document_scope)
+        if request_kwargs is None:
+            yield "Erreur Critique: Profil expert non défini."
+            return
+
+        cache_key, cached_response = self._lookup_cached_response(request_kwargs, profile)
+        if cached_response:
+            print("Réponse servie depuis le cache de réponses.")
+            self.last_stream_metrics = {"call_type": "conversation", "first_token_s": 0.0, "total_s": 0.0,
+                                        "error": None, "cached": True}
+            yield cached_response
+            return
+
+        print(f"Appel API Claude (streaming) pour réponse conversationnelle... Modèle: {self.model_name_global}")
+        yield from self._stream_request(request_kwargs, "conversation", cache_key=cache_key, cache_tag=profile.get("id"))
+
+    def _consulter_profil(self, question, conversation_history, profile):
+        """Interroge un profil précis sans modifier le profil courant (utilisé par le mode panel)."""
+        start_time = time.perf_counter()
+        result = {"profile_id": profile["id"], "profile_name": profile["name"], "reponse": None, "erreur": None, "duree_s": None}
+        try:
+            request_kwargs = self._prepare_conversation_request(question, conversation_history, profile=profile)
+            cache_key, cached_response = self._lookup_cached_response(request_kwargs, profile)
+            if cached_response:
+                result["reponse"] = cached_response
+                result["duree_s"] = time.perf_counter() - start_time
+                return result
+            response = self._call_api(**request_kwargs)
+            self._record_usage(response, f"panel:{profile['id']}")
+            if response.content and len(response.content) > 0 and response.content[0].text:
+                result["reponse"] = response.content[0].text
+                if cache_key:
+                    self.response_cache.set(cache_key, result["reponse"], profile_id=profile["id"])
+            else:
+                result["erreur"] = "Réponse vide de l'API."
+        except APIError as e:
+            result["erreur"] = f"Erreur API ({getattr(e, 'status_code', 'N/A')}): {e.message}"
+        except Exception as e:
+            result["erreur"] = f"Erreur technique: {type(e).__name__} - {e}"
+        result["duree_s"] = time.perf_counter() - start_time
+        print(f"[PANEL] {profile['name']} terminé en {result['duree_s']:.2f}s" + (f" ({result['erreur']})" if result["erreur"] else ""))
+        return result
+
+    def consulter_panel_iter(self, question, profile_names, conversation_history, max_workers=PANEL_MAX_WORKERS):
+        """Générateur: pose la même question à plusieurs profils en parallèle.
+
+        Chaque résultat (dict profile_name/reponse/erreur/duree_s) est produit dès qu'il est
+        prêt, dans l'ordre de complétion. Le pool de threads est borné par max_workers.
+        """
+        profiles = []
+        for profile_name in profile_names:
+            profile = self.profile_manager.get_profile_by_name(profile_name)
+            if profile:
+                profiles.append(profile)
+            else:
+                yield {"profile_id": None, "profile_name": profile_name, "reponse": None,
+                       "erreur": f"Profil '{profile_name}' non trouvé.", "duree_s": 0.0}
+        if not profiles:
+            return
+
+        print(f"[PANEL] Consultation de {len(profiles)} expert(s) en parallèle (max {max_workers} simultanés)")
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(profiles)))) as executor:
+            futures = [executor.submit(self._consulter_profil, question, conversation_history, profile) for profile in profiles]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def synthetiser_panel(self, question, panel_results):
+        """Produit une synthèse des réponses du panel avec le profil courant comme coordonnateur."""
+        valid_results = [r for r in panel_results if r.get("reponse")]
+        if not valid_results:
+            return "Aucune réponse d'expert à synthétiser."
+
+        answers_text = "\n\n".join(
+            f"{SEPARATOR_DOUBLE}\nRÉPONSE DE L'EXPERT {r['profile_name']}\n{SEPARATOR_SINGLE}\n{r['reponse']}"
+            for r in valid_results
+        )
+        synthesis_prompt = (
+            f"La question suivante a été posée à un panel de {len(valid_results)} experts:\n\"{question}\"\n\n"
+            f"{answers_text}\n{SEPARATOR_DOUBLE}\n\n"
+            "Produisez une synthèse intégrée comprenant :\n"
+            "1.  **CONSENSUS:** Les points sur lesquels les experts s'entendent.\n"
+            "2.  **DIVERGENCES:** Les points de désaccord ou les nuances propres à chaque spécialité.\n"
+            "3.  **RECOMMANDATION FINALE:** La marche à suivre recommandée, en tenant compte de tous les avis."
+        )
+        profile = self.get_current_profile()
+        try:
+            response = self._call_api(
+                model=self.model_name_global,
+                max_tokens=8000,
+                messages=[{"role": "user", "content": synthesis_prompt}],
+                system=self._build_system_prompt(profile.get('content', 'Vous êtes un expert IA utile.'))
+            )
+            self._record_usage(response, "panel:synthese")
+            if response.content and len(response.content) > 0 and response.content[0].text:
+                return response.content[0].text
+            return "Désolé, la synthèse du panel a reçu une réponse vide de l'IA Claude."
+        except APIError as e:
+            print(f"Erreur API Anthropic (synthetiser_panel): {type(e).__name__} ({e.status_code}) - {e.message}")
+            return f"Désolé, une erreur API est survenue lors de la synthèse du panel ({e.status_code})."
+        except Exception as e:
+            print(f"API Error (Claude) in synthetiser_panel: {type(e).__name__} - {e}")
+            return f"Désolé, une erreur technique est survenue lors de la synthèse du panel ({type(e).__name__})."
+
+    def consulter_panel(self, question, profile_names, conversation_history, synthese=True, max_workers=PANEL_MAX_WORKERS):
+        """Consulte un panel d'experts en parallèle et retourne toutes les réponses (plus une synthèse optionnelle).
+
+        La durée totale est proche de celle de la réponse la plus lente plutôt que de leur somme.
+        """
+        start_time = time.perf_counter()
+        results = list(self.consulter_panel_iter(question, profile_names, conversation_history, max_workers=max_workers))
+        synthesis = self.synthetiser_panel(question, results) if synthese else None
+        total_time = time.perf_counter() - start_time
+        print(f"[PANEL] Consultation terminée en {total_time:.2f}s (somme séquentielle: {sum(r['duree_s'] or 0 for r in results):.2f}s)")
+        return {"question": question, "reponses": results, "synthese": synthesis, "duree_totale_s": total_time}
+
     def perform_web_search(self, query: str) -> str:
         """Effectue une recherche web RÉELLE via l'API Claude et retourne la synthèse des résultats."""
         if not query:
@@ -609,7 +838,7 @@ class ExpertAdvisor:
             print(f"[WEB] Envoi de la requête à Claude avec recherche web activée...")
 
             # Utiliser claude-sonnet-4-5-20250929 pour les recherches web
-            response = self.anthropic.messages.create(
+            response = self._call_api(
                 model="claude-sonnet-4-5-20250929",
                 max_tokens=8000,
                 temperature=0.1,  # Plus bas pour des résultats factuels
@@ -0,0 +1,132 @@
+"""
+Cache des extractions de fichiers téléversés pour EXPERTS IA
+Clé: SHA-256 des octets du fichier + extension + version des extracteurs.
+Le texte extrait (ou le bloc image encodé) est conservé sur disque (diskcache),
+avec éviction LRU bornée en taille; consulté avant tout parseur, de sorte qu'un
+devis ou un cahier des charges déjà vu n'est pas relu. Les compteurs sont gardés
+à part, hors éviction.
+"""
+
+import os
+import time
+import hashlib
+import threading
+
+try:
+    import diskcache
+except ImportError:  # diskcache est optionnel: repli sur un cache mémoire
+    diskcache = None
+
+from memory_cache import MemoryLRUCache
+
+# Définir le répertoire de données
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+EXTRACTION_CACHE_DIR = os.path.join(DATA_DIR, 'cache', 'extractions')
+
+DEFAULT_SIZE_LIMIT_BYTES = int(os.getenv('EXTRACTION_CACHE_SIZE_MB', '512')) * 1024 * 1024
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600  # 30 jours
+
+_STATS_HITS_KEY = "__stats__:hits"
+_STATS_MISSES_KEY = "__stats__:misses"
+_STATS_SAVED_KEY = "__stats__:saved_ms"
+
+
+def hash_bytes(data):
+    """Retourne le hash SHA-256 (hex) d'un contenu binaire."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ExtractionCache:
+    """Cache des contenus extraits, partagé par toutes les sessions (et les processus, sur disque)."""
+
+    def __init__(self, directory=EXTRACTION_CACHE_DIR, size_limit=DEFAULT_SIZE_LIMIT_BYTES, ttl=DEFAULT_TTL_SECONDS):
+        self.directory = directory
+        self.ttl = ttl
+        if diskcache is not None:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                self._cache = diskcache.Cache(directory, size_limit=size_limit,
+                                              eviction_policy='least-recently-used')
+                # Compteurs: jamais évincés (sinon remis à zéro) et sans prendre la place des extractions
+                self._meta = diskcache.Cache(os.path.join(directory, 'meta'), eviction_policy='none')
+                self.backend = "disk"
+                print(f"Cache d'extraction initialisé (disque): {directory}")
+                return
+            except Exception as e:
+                print(f"AVERTISSEMENT: Cache d'extraction disque indisponible ({e}), repli en mémoire.")
+        self._cache = MemoryLRUCache(max_entries=100)
+        self._meta = MemoryLRUCache(max_entries=float('inf'))
+        self.backend = "memory"
+        print("Cache d'extraction initialisé (mémoire).")
+
+    @staticmethod
+    def make_key(file_bytes, file_ext, extractor_version):
+        """Clé: version des extracteurs, extension (choix du parseur) et hash du contenu."""
+        return f"extract:{extractor_version}:{file_ext}:{hash_bytes(file_bytes)}"
+
+    def get(self, key):
+        """
+        Retourne l'entrée en cache ou None; met à jour les compteurs.
+
+        Returns:
+            dict ou None: {"content", "extract_s"}
+        """
+        try:
+            entry = self._cache.get(key)
+            if entry is None:
+                self._meta.incr(_STATS_MISSES_KEY)
+                return None
+            self._meta.incr(_STATS_HITS_KEY)
+            self._meta.incr(_STATS_SAVED_KEY, int(entry.get("extract_s", 0.0) * 1000))
+            return entry
+        except Exception as e:
+            print(f"[CACHE EXTRACTION] Erreur de lecture: {e}")
+            return None
+
+    def set(self, key, content, extract_s):
+        """Enregistre un contenu extrait (texte ou bloc image) et son temps d'extraction."""
+        try:
+            return self._cache.set(key, {"content": content, "extract_s": extract_s, "stored_at": time.time()},
+                                   expire=self.ttl)
+        except Exception as e:
+            print(f"[CACHE EXTRACTION] Erreur d'écriture: {e}")
+            return False
+
+    def clear(self):
+        """Vide entièrement le cache (compteurs inclus)."""
+        self._meta.clear()
+        return self._cache.clear()
+
+    def get_stats(self):
+        """Statistiques: hits, misses, taux de succès, temps d'extraction économisé, entrées et taille."""
+        hits = self._meta.get(_STATS_HITS_KEY, 0) or 0
+        misses = self._meta.get(_STATS_MISSES_KEY, 0) or 0
+        saved_ms = self._meta.get(_STATS_SAVED_KEY, 0) or 0
+        total = hits + misses
+        try:
+            size_bytes = self._cache.volume()
+        except Exception:
+            size_bytes = 0
+        return {
+            "backend": self.backend,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / total if total else 0.0,
+            "saved_seconds": saved_ms / 1000.0,
+            "entries": len(self._cache),
+            "size_bytes": size_bytes,
+        }
+
+
+_shared_extraction_cache = None
+_shared_extraction_cache_lock = threading.Lock()
+
+
+def get_extraction_cache():
+    """Retourne le cache d'extraction partagé par le processus (créé au premier appel)."""
+    global _shared_extraction_cache
+    if _shared_extraction_cache is None:
+        with _shared_extraction_cache_lock:
+            if _shared_extraction_cache is None:
+                _shared_extraction_cache = ExtractionCache()
+    return _shared_extraction_cache
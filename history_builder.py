@@ -0,0 +1,173 @@
+"""
+Construction de l'historique envoyé à l'API selon un budget de tokens
+Compte les tokens localement, remplit le budget à partir du message le plus
+récent et laisse les anciens échanges au résumé glissant de la conversation.
+"""
+
+import threading
+
+# Estimation locale: ~3.5 caractères par token pour du français technique
+CHARS_PER_TOKEN = 3.5
+IMAGE_BLOCK_TOKENS = 1600          # Image ~1568x1568 px
+MESSAGE_OVERHEAD_TOKENS = 4        # Rôle et séparateurs
+
+DEFAULT_HISTORY_BUDGET_TOKENS = 24000
+DEFAULT_MAX_MESSAGE_TOKENS = 8000  # Un message isolé (ex: analyse collée) est tronqué au-delà
+SUMMARY_MAX_TOKENS = 1500
+SUMMARY_INPUT_MAX_TOKENS = 60000   # Taille max des échanges résumés en un seul appel
+
+TRUNCATION_NOTICE = "\n[... contenu tronqué pour respecter le budget de contexte ...]\n"
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Tu maintiens le résumé d'une consultation entre un client et un expert en construction au Québec. "
+    "Conserve tous les faits utiles pour la suite: données du projet, dimensions, quantités, montants, "
+    "normes citées, décisions prises et questions ouvertes. Sois concis et factuel, en français."
+)
+
+
+def estimate_tokens(content):
+    """Estime localement le nombre de tokens d'un texte ou d'une liste de blocs de contenu."""
+    if content is None:
+        return 0
+    if isinstance(content, str):
+        return int(len(content) / CHARS_PER_TOKEN) + 1
+    total = 0
+    for block in content:
+        if isinstance(block, dict):
+            if block.get("type") == "image":
+                total += IMAGE_BLOCK_TOKENS
+            else:
+                total += estimate_tokens(block.get("text", ""))
+        else:
+            total += estimate_tokens(str(block))
+    return total
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Tronque un texte au budget donné en gardant le début et la fin."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max(0, int(max_tokens * CHARS_PER_TOKEN) - len(TRUNCATION_NOTICE))
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    return text[:head] + TRUNCATION_NOTICE + (text[-tail:] if tail else "")
+
+
+def to_api_message(msg):
+    """Convertit un message de session en message API (rôle user/assistant), ou None s'il est ignoré."""
+    role, content = msg.get("role"), msg.get("content")
+    if role == "system" or not isinstance(content, str):
+        return None
+    if role == "user":
+        return {"role": "user", "content": content}
+    if role == "assistant":
+        return {"role": "assistant", "content": content}
+    if role == "search_result":
+        return {"role": "assistant", "content": f"[Info from Web Search]:\n{content}"}
+    return None
+
+
+def format_messages_for_summary(messages):
+    """Met en forme des messages API en texte pour le résumé."""
+    lines = []
+    for msg in messages:
+        role_name = "Utilisateur" if msg["role"] == "user" else "Expert"
+        lines.append(f"{role_name}: {msg['content']}")
+    return "\n\n".join(lines)
+
+
+class HistoryBuilder:
+    """Sélectionne les messages les plus récents qui tiennent dans un budget de tokens."""
+
+    def __init__(self, budget_tokens=DEFAULT_HISTORY_BUDGET_TOKENS, max_message_tokens=DEFAULT_MAX_MESSAGE_TOKENS):
+        self.budget_tokens = budget_tokens
+        self.max_message_tokens = max_message_tokens
+
+    def build(self, conversation_history, reserved_tokens=0):
+        """
+        Construit la fenêtre d'historique pour l'API.
+
+        Args:
+            conversation_history: Messages de session (dict role/content), du plus ancien au plus récent
+            reserved_tokens: Tokens déjà consommés (question, résumé) à déduire du budget
+
+        Returns:
+            tuple: (messages API retenus, index de début de la fenêtre dans la liste convertie,
+                    liste complète des messages API convertis)
+        """
+        api_messages = [m for m in (to_api_message(msg) for msg in conversation_history) if m]
+        remaining = max(0, self.budget_tokens - reserved_tokens)
+        window = []
+        start_index = len(api_messages)
+
+        for index in range(len(api_messages) - 1, -1, -1):
+            message = api_messages[index]
+            content = truncate_to_tokens(message["content"], self.max_message_tokens)
+            cost = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+            if cost > remaining:
+                if window:
+                    break
+                # Le message le plus récent ne tient pas seul: le tronquer au budget restant
+                content = truncate_to_tokens(content, max(0, remaining - MESSAGE_OVERHEAD_TOKENS))
+                cost = remaining
+            window.append({"role": message["role"], "content": content})
+            remaining -= cost
+            start_index = index
+
+        window.reverse()
+        # L'API attend un premier message utilisateur
+        while window and window[0]["role"] != "user":
+            window.pop(0)
+            start_index += 1
+        return window, start_index, api_messages
+
+    def build_text(self, conversation_history):
+        """Variante texte (analyse de documents): 'Utilisateur: ...' / 'Expert: ...' dans le budget."""
+        lines = []
+        remaining = self.budget_tokens
+        for msg in reversed(conversation_history):
+            role, content = msg.get("role"), msg.get("content")
+            if role == "system" or not isinstance(content, str):
+                continue
+            role_name = "Utilisateur" if role == "user" else "Expert"
+            if role == "search_result":
+                role_name = "InfoWeb"
+                content = f"[Résultat Recherche Web]: {content}"
+            line = f"{role_name}: {truncate_to_tokens(content, self.max_message_tokens)}"
+            cost = estimate_tokens(line)
+            if cost > remaining:
+                break
+            lines.append(line)
+            remaining -= cost
+        return "\n".join(reversed(lines))
+
+
+class SummaryRefresher:
+    """Rafraîchit en arrière-plan le résumé glissant des conversations (un seul rafraîchissement à la fois par conversation)."""
+
+    def __init__(self):
+        self._in_flight = set()
+        self._lock = threading.Lock()
+
+    def schedule(self, conversation_id, refresh_func, *args):
+        """Lance refresh_func(*args) dans un thread démon si aucun rafraîchissement n'est en cours."""
+        with self._lock:
+            if conversation_id in self._in_flight:
+                return False
+            self._in_flight.add(conversation_id)
+
+        def _run():
+            try:
+                refresh_func(*args)
+            except Exception as e:
+                print(f"[RÉSUMÉ] Erreur lors du rafraîchissement du résumé (conversation {conversation_id}): {e}")
+            finally:
+                with self._lock:
+                    self._in_flight.discard(conversation_id)
+
+        threading.Thread(target=_run, name=f"summary-{conversation_id}", daemon=True).start()
+        return True
+
+
+# Un seul planificateur pour tout le processus
+summary_refresher = SummaryRefresher()
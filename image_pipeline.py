@@ -0,0 +1,184 @@
+"""
+Préparation des images pour EXPERTS IA
+Photos de chantier et plans ramenés au format attendu par l'API: décodage JPEG
+en mode brouillon (réduction dès le décodage, sans charger l'image pleine
+résolution), orientation EXIF appliquée puis métadonnées retirées (position GPS
+des chantiers), qualité choisie pour tenir dans le budget d'octets par image
+au lieu de refuser les photos de téléphone, sortie JPEG ou WebP.
+"""
+
+import io
+import os
+import base64
+
+from PIL import Image, ImageOps, features
+
+from upload_buffer import open_stream
+
+IMAGE_MAX_EDGE = 1568                             # Côté maximal utile pour l'API (au-delà, l'image est réduite)
+IMAGE_MAX_BYTES = 5 * 1024 * 1024 * 3 // 4        # Octets par image: base64 <= 5 MB
+IMAGE_MIN_BYTES = 32 * 1024                       # Budget plancher sous lequel une image n'est plus lisible
+IMAGE_MAX_QUALITY = int(os.getenv('IMAGE_MAX_QUALITY', '85'))
+IMAGE_MIN_QUALITY = int(os.getenv('IMAGE_MIN_QUALITY', '40'))
+IMAGE_MIN_EDGE = 512                              # Réduction minimale quand la qualité plancher ne suffit pas
+IMAGE_OUTPUT_FORMAT = os.getenv('IMAGE_OUTPUT_FORMAT', 'jpeg').lower()  # 'jpeg' ou 'webp'
+if IMAGE_OUTPUT_FORMAT == 'webp' and not features.check('webp'):
+    print("[IMAGES] Pillow compilé sans WebP, sortie JPEG.")
+    IMAGE_OUTPUT_FORMAT = 'jpeg'
+
+# Sources sans perte réencodées en PNG si elles tiennent dans le budget (plans, captures d'écran)
+LOSSLESS_FORMATS = {'PNG', 'GIF', 'BMP'}
+API_MEDIA_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif', 'WEBP': 'image/webp'}
+
+
+class ImageBudgetError(ValueError):
+    """L'image ne tient pas dans le budget d'octets, même réduite à la qualité plancher."""
+
+
+def target_size(width, height, max_edge=IMAGE_MAX_EDGE):
+    """Dimensions après réduction pour que le plus grand côté soit au plus 'max_edge' (proportions conservées)."""
+    scale = min(1.0, max_edge / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def decode_image(file_bytes, max_edge=IMAGE_MAX_EDGE):
+    """
+    Décode l'image réduite au plus grand côté 'max_edge', orientation EXIF appliquée.
+
+    Un JPEG est décodé en mode brouillon: le décodeur réduit directement par 2, 4 ou 8,
+    la mémoire et le temps de décodage baissent d'autant pour les photos de 12 MP et plus.
+
+    Returns:
+        tuple: (image PIL sans métadonnées, format d'origine)
+    """
+    img = Image.open(open_stream(file_bytes))
+    source_format = img.format
+    if source_format == 'JPEG':
+        # Les dimensions demandées tiennent compte des proportions, sinon le brouillon ne réduit presque jamais
+        img.draft('RGB', target_size(img.width, img.height, max_edge))
+    img = ImageOps.exif_transpose(img)
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    else:
+        img.load()
+    img.info = {}  # EXIF, XMP, commentaires: rien n'est réécrit à l'encodage
+    return img, source_format
+
+
+def _flatten(img):
+    """Image RGB pour un encodage avec perte (transparence posée sur fond blanc)."""
+    if img.mode in ('RGBA', 'LA', 'P', 'PA'):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _encode(img, output_format, quality=None):
+    buffered = io.BytesIO()
+    if output_format == 'WEBP':
+        img.save(buffered, format='WEBP', quality=quality, method=4)
+    elif output_format == 'JPEG':
+        img.save(buffered, format='JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buffered, format=output_format, optimize=True)
+    return buffered.getvalue()
+
+
+def _encode_within_budget(img, output_format, max_bytes):
+    """
+    Encodage avec perte à la meilleure qualité qui tient dans 'max_bytes' (recherche dichotomique,
+    un seul encodage dans le cas courant où la qualité maximale tient déjà).
+
+    Returns:
+        tuple: (octets, qualité) ou (None, None) si la qualité plancher ne tient pas
+    """
+    data = _encode(img, output_format, IMAGE_MAX_QUALITY)
+    if len(data) <= max_bytes:
+        return data, IMAGE_MAX_QUALITY
+    best = None
+    low, high = IMAGE_MIN_QUALITY, IMAGE_MAX_QUALITY - 1
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(img, output_format, quality)
+        if len(data) <= max_bytes:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best or (None, None)
+
+
+def encode_image(img, source_format, max_bytes=IMAGE_MAX_BYTES, output_format=None):
+    """
+    Encode une image décodée dans le budget d'octets: source sans perte en PNG si le PNG tient,
+    sinon JPEG/WebP à qualité adaptative, puis réduction des dimensions en dernier recours.
+
+    Returns:
+        tuple: (octets, type MIME, qualité ou None si sans perte, dimensions)
+
+    Raises:
+        ImageBudgetError: si l'image ne tient pas dans le budget même réduite
+    """
+    output_format = (output_format or IMAGE_OUTPUT_FORMAT).upper()
+    if source_format in LOSSLESS_FORMATS:
+        data = _encode(img, 'PNG')
+        if len(data) <= max_bytes:
+            return data, API_MEDIA_TYPES['PNG'], None, img.size
+    img = _flatten(img)
+    while True:
+        data, quality = _encode_within_budget(img, output_format, max_bytes)
+        if data is not None:
+            return data, API_MEDIA_TYPES[output_format], quality, img.size
+        if max(img.size) <= IMAGE_MIN_EDGE:
+            raise ImageBudgetError(f"même réduite à {max(img.size)} px, l'image dépasse le budget de {max_bytes} octets")
+        img = img.resize(target_size(img.width, img.height, max(IMAGE_MIN_EDGE, int(max(img.size) * 0.75))),
+                         Image.Resampling.LANCZOS)
+
+
+def prepare_image_block(file_bytes, filename, max_bytes=IMAGE_MAX_BYTES, output_format=None):
+    """
+    Prépare un bloc image de l'API à partir des octets téléversés.
+
+    Returns:
+        dict: Bloc {'type': 'image', 'source': {...}} (base64)
+
+    Raises:
+        ImageBudgetError: si l'image ne tient pas dans le budget
+    """
+    img, source_format = decode_image(file_bytes)
+    original_size = len(file_bytes)
+    data, media_type, quality, size = encode_image(img, source_format, max(max_bytes, IMAGE_MIN_BYTES), output_format)
+    if original_size > max_bytes or quality is not None and quality < IMAGE_MAX_QUALITY:
+        print(f"[IMAGES] {filename}: {original_size / 1024:.0f} Ko -> {len(data) / 1024:.0f} Ko "
+              f"({size[0]}x{size[1]}, {media_type}, qualité {quality})")
+    return {'type': 'image', 'source': {'type': 'base64', 'media_type': media_type,
+                                         'data': base64.b64encode(data).decode()}}
+
+
+def image_block_bytes(block):
+    """Taille en octets de l'image d'un bloc (base64 décodé)."""
+    return len(block['source']['data']) * 3 // 4
+
+
+def shrink_image_block(block, max_bytes):
+    """
+    Réencode un bloc image déjà préparé pour qu'il tienne dans 'max_bytes' (budget par requête).
+
+    Returns:
+        dict: Nouveau bloc, ou le bloc d'origine s'il tient déjà
+
+    Raises:
+        ImageBudgetError: si l'image ne tient pas dans le budget
+    """
+    if image_block_bytes(block) <= max_bytes:
+        return block
+    if max_bytes < IMAGE_MIN_BYTES:
+        raise ImageBudgetError(f"budget restant de {max_bytes} octets insuffisant")
+    img, source_format = decode_image(base64.b64decode(block['source']['data']))
+    data, media_type, _quality, _size = encode_image(img, source_format, max_bytes)
+    return {'type': 'image', 'source': {'type': 'base64', 'media_type': media_type,
+                                         'data': base64.b64encode(data).decode()}}
@@ -0,0 +1,211 @@
+"""
+Test de charge hors ligne pour EXPERTS IA
+Lance les parcours chat (streaming), analyse de documents, extraction de
+soumission et recherche web en parallèle contre le serveur de rejeu local
+(replay_server.py), sans réseau ni coût d'API, et affiche les latences.
+Seul le parcours extraction dépend de l'interface (streamlit, via la configuration
+de l'entreprise): sans elle, il est ignoré et les autres parcours s'exécutent.
+
+Utilisation:
+    python load_test.py --users 32 --requests 5 --scenarios chat,analyse,extraction,recherche
+    python load_test.py --server-url http://127.0.0.1:8765   # serveur de rejeu déjà lancé
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SCENARIOS = ("chat", "analyse", "extraction", "recherche")
+REPLAY_API_KEY = "replay-local"  # Le serveur de rejeu accepte n'importe quelle clé
+
+
+class InMemoryUpload:
+    """Fichier téléversé simulé (même interface que l'UploadedFile de Streamlit utilisée par read_file)."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+        self.size = len(data)
+
+    def getvalue(self):
+        return self._data
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LoadTestRunner:
+    """Exécute les parcours de l'application à forte concurrence et collecte latences et erreurs."""
+
+    def __init__(self, scenarios=SCENARIOS):
+        # Importés ici: le backend doit être choisi (LLM_BACKEND) avant la création des clients
+        from expert_logic import ExpertAdvisor
+
+        self.advisor_class = ExpertAdvisor
+        self.generator = None
+        if "extraction" in scenarios:
+            try:
+                from soumission_generator import SoumissionGenerator
+                self.generator = SoumissionGenerator()
+            except ImportError as e:
+                print(f"[CHARGE] Parcours extraction ignoré: {e}")
+                scenarios = tuple(s for s in scenarios if s != "extraction")
+        if not scenarios:
+            raise ValueError("Aucun parcours exécutable.")
+        self.scenarios = scenarios
+        self.results = []
+        self._lock = threading.Lock()
+
+    def _new_advisor(self):
+        advisor = self.advisor_class(api_key=REPLAY_API_KEY)
+        advisor.response_cache_enabled = False  # Mesurer le backend, pas le cache de réponses
+        return advisor
+
+    def _record(self, scenario, start, first_token_s=None, error=None):
+        with self._lock:
+            self.results.append({"scenario": scenario, "total_s": time.perf_counter() - start,
+                                 "first_token_s": first_token_s, "error": error})
+
+    def run_chat(self, advisor, user_index, request_index):
+        start = time.perf_counter()
+        question = f"Utilisateur {user_index}, question {request_index}: épaisseur d'isolant pour un mur 2x6?"
+        text = "".join(advisor.obtenir_reponse_stream(question, []))
+        metrics = advisor.last_stream_metrics
+        self._record("chat", start, metrics.get("first_token_s"), metrics.get("error") or (None if text else "vide"))
+
+    def run_analyse(self, advisor, user_index, request_index):
+        start = time.perf_counter()
+        content = f"Devis {user_index}-{request_index}\n" + "Ligne de devis: béton 25 MPa, 12 m3, 2 400 $\n" * 200
+        upload = InMemoryUpload(f"devis_{user_index}_{request_index}.txt", content.encode("utf-8"))
+        text = "".join(advisor.analyze_documents_stream([upload], []))
+        metrics = advisor.last_stream_metrics
+        self._record("analyse", start, metrics.get("first_token_s"), metrics.get("error") or (None if text else "vide"))
+
+    def run_extraction(self, advisor, user_index, request_index):
+        start = time.perf_counter()
+        messages = [
+            {"role": "user", "content": f"Projet {user_index}-{request_index}: rénovation de salle de bain 8x10."},
+            {"role": "assistant", "content": "Estimation: démolition 1 500 $, plomberie 4 200 $, céramique 3 800 $."},
+        ]
+        error = None
+        try:
+            self.generator.extract_estimation_data(messages)
+        except Exception as e:
+            error = str(e)[:200]
+        self._record("extraction", start, error=error)
+
+    def run_recherche(self, advisor, user_index, request_index):
+        start = time.perf_counter()
+        result = advisor.perform_web_search(f"prix du bois d'oeuvre au Québec ({user_index}-{request_index})")
+        self._record("recherche", start, error=result if result.startswith("❌") else None)
+
+    def run_user(self, user_index, requests_per_user):
+        advisor = self._new_advisor()
+        for request_index in range(requests_per_user):
+            scenario = self.scenarios[(user_index + request_index) % len(self.scenarios)]
+            start = time.perf_counter()
+            try:
+                getattr(self, f"run_{scenario}")(advisor, user_index, request_index)
+            except Exception as e:
+                self._record(scenario, start, error=f"{type(e).__name__}: {e}")
+
+    def run(self, users, requests_per_user):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            futures = [executor.submit(self.run_user, user_index, requests_per_user) for user_index in range(users)]
+            for future in as_completed(futures):
+                future.result()
+        return time.perf_counter() - start
+
+    def report(self, wall_time_s):
+        print("\n" + "=" * 78)
+        print(f"{'Parcours':<12} {'Req.':>5} {'Erreurs':>8} {'p50 (s)':>9} {'p95 (s)':>9} {'max (s)':>9} {'1er token p50':>14}")
+        print("-" * 78)
+        for scenario in self.scenarios:
+            rows = [r for r in self.results if r["scenario"] == scenario]
+            if not rows:
+                continue
+            totals = [r["total_s"] for r in rows]
+            first_tokens = [r["first_token_s"] for r in rows if r["first_token_s"] is not None]
+            errors = sum(1 for r in rows if r["error"])
+            print(f"{scenario:<12} {len(rows):>5} {errors:>8} {percentile(totals, 50):>9.2f} "
+                  f"{percentile(totals, 95):>9.2f} {max(totals):>9.2f} "
+                  f"{(f'{percentile(first_tokens, 50):.2f}' if first_tokens else '-'):>14}")
+        print("-" * 78)
+        print(f"Total: {len(self.results)} requêtes en {wall_time_s:.2f}s "
+              f"({len(self.results) / wall_time_s if wall_time_s else 0:.1f} req/s)")
+        failures = [r for r in self.results if r["error"]]
+        for failure in failures[:5]:
+            print(f"  ⚠️ {failure['scenario']}: {failure['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge hors ligne (serveur de rejeu local)")
+    parser.add_argument("--users", type=int, default=16, help="Utilisateurs simultanés")
+    parser.add_argument("--requests", type=int, default=4, help="Requêtes par utilisateur")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Parcours parmi: {', '.join(SCENARIOS)}")
+    parser.add_argument("--server-url", default=None, help="Serveur de rejeu existant (sinon un serveur est démarré)")
+    parser.add_argument("--first-token-ms", type=float, default=400.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proportion de 429 simulés")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="Proportion de 529 simulés")
+    parser.add_argument("--rpm", type=int, default=None, help="Limite de requêtes/minute du limiteur client")
+    parser.add_argument("--tpm", type=int, default=None, help="Limite de tokens d'entrée/minute du limiteur client")
+    parser.add_argument("--concurrency", type=int, default=None, help="Plafond de concurrence du limiteur client")
+    args = parser.parse_args()
+
+    scenarios = tuple(s.strip() for s in args.scenarios.split(",") if s.strip())
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"Parcours inconnu(s): {', '.join(unknown)}")
+
+    # Profils et configuration sont lus relativement au dossier de l'application
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    server = None
+    if args.server_url:
+        server_url = args.server_url
+    else:
+        from replay_server import ReplayConfig, start_replay_server
+        config = ReplayConfig(first_token_ms=args.first_token_ms, tokens_per_second=args.tokens_per_second,
+                              error_rate=args.error_rate, overload_rate=args.overload_rate,
+                              retry_after_s=0.5, recordings_path=None)
+        server = start_replay_server(port=0, config=config)
+        server_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # Aucun appel ne doit partir vers l'API réelle
+    os.environ["LLM_BACKEND"] = "replay"
+    os.environ["REPLAY_SERVER_URL"] = server_url
+    os.environ.pop("LLM_BASE_URL", None)
+    # Limites du contrôle d'admission (lues à l'import de rate_limiter)
+    if args.rpm:
+        os.environ["API_REQUESTS_PER_MINUTE"] = str(args.rpm)
+    if args.tpm:
+        os.environ["API_INPUT_TOKENS_PER_MINUTE"] = str(args.tpm)
+    if args.concurrency:
+        os.environ["API_MAX_CONCURRENCY"] = str(args.concurrency)
+
+    runner = LoadTestRunner(scenarios)
+    print(f"[CHARGE] {args.users} utilisateur(s) x {args.requests} requête(s) contre {server_url} "
+          f"(parcours: {', '.join(scenarios)})")
+    wall_time_s = runner.run(args.users, args.requests)
+    runner.report(wall_time_s)
+
+    from rate_limiter import get_admission_controller
+    print(f"Limiteur: {get_admission_controller().get_stats()}")
+    if server is not None:
+        print(f"Serveur de rejeu: {server.replay_state.stats}")
+        server.shutdown()
+    return 0 if not any(r["error"] for r in runner.results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
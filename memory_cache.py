@@ -0,0 +1,68 @@
+"""
+Cache LRU en mémoire pour EXPERTS IA
+Repli des caches sur disque quand diskcache n'est pas installé, et petits
+caches propres au processus (ex: encodages détectés). Reprend l'interface
+de diskcache utilisée par l'application: get/set avec expiration et étiquette,
+incr, evict par étiquette, clear, volume.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 500
+
+
+class MemoryLRUCache:
+    """Cache LRU en mémoire (un seul processus), avec expiration et étiquettes (même interface que diskcache)."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (value, expire_at, tag)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expire_at, _tag = item
+            if expire_at is not None and expire_at < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expire=None, tag=None):
+        with self._lock:
+            expire_at = time.time() + expire if expire else None
+            self._data[key] = (value, expire_at, tag)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return True
+
+    def incr(self, key, delta=1, default=0):
+        with self._lock:
+            value = self._data.get(key, (default, None, None))[0] + delta
+            self._data[key] = (value, None, None)
+            return value
+
+    def evict(self, tag):
+        with self._lock:
+            keys = [k for k, (_v, _e, t) in self._data.items() if t == tag]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            return count
+
+    def volume(self):
+        return sum(len(str(v)) for v, _e, _t in self._data.values())
+
+    def __len__(self):
+        return len(self._data)
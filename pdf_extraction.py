@@ -0,0 +1,162 @@
+"""
+Extraction du texte des PDF pour EXPERTS IA
+Moteur PyMuPDF (beaucoup plus rapide que PyPDF2): texte page par page avec
+marqueurs [Page N] pour que l'expert puisse citer ses sources, sélection de
+pages (ex: "1-20, 35"), plafond de caractères par page et découpage en tranches
+de pages pour la lecture parallèle des gros cahiers des charges. PyPDF2 reste
+le repli si PyMuPDF est absent ou ne peut pas ouvrir le fichier.
+"""
+
+import os
+import re
+
+try:
+    import pymupdf as fitz  # PyMuPDF >= 1.24
+except ImportError:
+    try:
+        import fitz  # PyMuPDF (ancien nom du module)
+    except ImportError:
+        fitz = None
+
+import PyPDF2
+
+from upload_buffer import read_buffer
+
+PDF_PAGE_CHAR_CAP = int(os.getenv('PDF_PAGE_CHAR_CAP', '20000'))  # Au-delà: page tronquée (plans vectoriels, tableaux)
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '100'))  # Taille d'une tranche lue par un processus
+PDF_PARALLEL_MIN_PAGES = 2 * PDF_PAGES_PER_TASK                   # En dessous, une seule tâche suffit
+
+_RANGE_PART_PATTERN = re.compile(r"^(\d*)\s*-\s*(\d*)$")
+
+
+class PageRangeError(ValueError):
+    """Sélection de pages mal formée."""
+
+
+def parse_page_range(spec, page_count):
+    """
+    Convertit une sélection de pages ("1-20, 35, 40-") en numéros de pages (base 1), triés et sans doublon.
+
+    Les pages hors du document sont ignorées. Une sélection vide retourne toutes les pages.
+
+    Raises:
+        PageRangeError: si la sélection est mal formée
+    """
+    if not spec or not str(spec).strip():
+        return list(range(1, page_count + 1))
+    pages = set()
+    for part in str(spec).replace(';', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if part.isdigit():
+            first = last = int(part)
+        else:
+            match = _RANGE_PART_PATTERN.match(part)
+            if not match or not (match.group(1) or match.group(2)):
+                raise PageRangeError(f"Sélection de pages invalide: '{part}'")
+            first = int(match.group(1)) if match.group(1) else 1
+            last = int(match.group(2)) if match.group(2) else page_count
+        if first > last:
+            raise PageRangeError(f"Sélection de pages invalide: '{part}' (début après la fin)")
+        pages.update(range(max(1, first), min(page_count, last) + 1))
+    return sorted(pages)
+
+
+def split_page_spans(page_numbers, pages_per_task=PDF_PAGES_PER_TASK):
+    """Découpe la liste de pages en tranches contiguës d'au plus 'pages_per_task' pages."""
+    return [page_numbers[i:i + pages_per_task] for i in range(0, len(page_numbers), pages_per_task)]
+
+
+def format_page(page_number, text, char_cap=PDF_PAGE_CHAR_CAP):
+    """Texte d'une page précédé de son marqueur; None si la page n'a pas de texte."""
+    text = (text or "").strip()
+    if not text:
+        return None
+    if char_cap and len(text) > char_cap:
+        text = f"{text[:char_cap]}\n[... page {page_number} tronquée: {len(text) - char_cap:,} caractères omis]".replace(",", " ")
+    return f"[Page {page_number}]\n{text}"
+
+
+def join_pages(page_texts, filename):
+    """Assemble les pages extraites; message d'erreur si aucune page n'a de texte."""
+    page_texts = [text for text in page_texts if text]
+    if not page_texts:
+        return f"Aucun texte n'a pu être extrait de {filename}. Le PDF est-il basé sur une image ou protégé ?"
+    return "\n\n".join(page_texts)
+
+
+def _open_document(source):
+    """Ouvre un PDF avec PyMuPDF depuis un chemin ou des octets."""
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def get_page_count(source):
+    """Nombre de pages (PyMuPDF ne lit que la table des objets, pas le contenu des pages)."""
+    with _open_document(source) as document:
+        return document.page_count
+
+
+def iter_pdf_pages(source, page_numbers=None, char_cap=PDF_PAGE_CHAR_CAP):
+    """
+    Lit les pages une à une et les rend au fur et à mesure.
+
+    Args:
+        source: Chemin du fichier ou octets du PDF
+        page_numbers: Pages à lire (base 1); toutes si None
+
+    Yields:
+        tuple: (numéro de page, texte formaté avec marqueur ou None si page vide)
+    """
+    with _open_document(source) as document:
+        if page_numbers is None:
+            page_numbers = range(1, document.page_count + 1)
+        for page_number in page_numbers:
+            page = document.load_page(page_number - 1)
+            yield page_number, format_page(page_number, page.get_text("text"), char_cap)
+
+
+def extract_page_span(source, page_numbers, char_cap=PDF_PAGE_CHAR_CAP):
+    """Extrait une tranche de pages (exécutée dans un processus du pool). Retourne les textes formatés."""
+    return [text for _page_number, text in iter_pdf_pages(source, page_numbers, char_cap)]
+
+
+def _extract_with_pypdf2(pdf_bytes_stream, filename, pages=None, char_cap=PDF_PAGE_CHAR_CAP):
+    """Repli PyPDF2 (même sortie: marqueurs de page, sélection, plafond)."""
+    pdf_bytes_stream.seek(0)
+    pdf_reader = PyPDF2.PdfReader(pdf_bytes_stream)
+    page_numbers = parse_page_range(pages, len(pdf_reader.pages))
+    return join_pages([format_page(n, pdf_reader.pages[n - 1].extract_text(), char_cap) for n in page_numbers],
+                      filename)
+
+
+def extract_pdf_text(file_stream, filename, pages=None, char_cap=PDF_PAGE_CHAR_CAP):
+    """
+    Extrait le texte d'un PDF (PyMuPDF, repli PyPDF2), page par page avec marqueurs.
+
+    Args:
+        file_stream: Flux binaire du PDF
+        pages: Sélection de pages ("1-20, 35"); toutes si None
+
+    Returns:
+        str: Texte ou message d'erreur
+    """
+    if fitz is not None:
+        try:
+            pdf_bytes = read_buffer(file_stream)
+            page_numbers = parse_page_range(pages, get_page_count(pdf_bytes))
+            if not page_numbers:
+                return f"Aucun texte à extraire: aucune page de {filename} ne correspond à la sélection '{pages}'."
+            return join_pages(extract_page_span(pdf_bytes, page_numbers, char_cap), filename)
+        except PageRangeError as e:
+            return f"Format de sélection de pages invalide pour {filename}: {str(e)}"
+        except Exception as e:
+            print(f"[PDF] PyMuPDF n'a pas pu lire {filename} ({e}), repli sur PyPDF2.")
+    try:
+        return _extract_with_pypdf2(file_stream, filename, pages, char_cap)
+    except PageRangeError as e:
+        return f"Format de sélection de pages invalide pour {filename}: {str(e)}"
+    except Exception as e:
+        return f"Erreur lors de la lecture du PDF {filename}: {str(e)}"
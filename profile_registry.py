@@ -0,0 +1,293 @@
+"""
+Registre partagé des profils experts pour EXPERTS IA
+Au démarrage, seule la première ligne (nom affiché) de chaque fichier est lue;
+le contenu complet est chargé à la demande dans un cache borné (LRU). Index
+nom -> id et liste des noms pré-triée; un seul registre par dossier pour tout
+le processus, rechargé quand un fichier (ou le dossier) change.
+"""
+
+import os
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Mapping
+
+PROFILE_EXTENSION = '.txt'
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '16'))  # Contenus complets gardés en mémoire
+PROFILE_RESCAN_INTERVAL_S = 2.0  # Délai minimal entre deux vérifications du dossier
+
+DEFAULT_PROFILE_ID = "default_expert"
+DEFAULT_PROFILE_NAME = "Expert par Défaut"
+DEFAULT_PROFILE_CONTENT = "Je suis un expert IA généraliste."
+
+
+def normalize_for_sort(text):
+    """Normalise le texte pour le tri en supprimant les accents."""
+    return unicodedata.normalize('NFD', text.lower()).encode('ascii', 'ignore').decode('ascii')
+
+
+def _read_display_name(path):
+    """Lit seulement la première ligne non vide d'un profil (son nom affiché), ou None si le fichier est vide."""
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            name = line.strip()
+            if name:
+                return name
+    return None
+
+
+def _parse_profile(profile_id, raw_content):
+    """Découpe un fichier de profil: première ligne = nom, reste = contenu (même règles qu'à l'origine)."""
+    content = raw_content.strip()
+    if not content:
+        return None
+    lines = content.split('\n', 1)
+    name = lines[0].strip() if lines else f"Profil_{profile_id}"
+    profile_content = lines[1].strip() if len(lines) > 1 else f"Profil: {name}"
+    return {"id": profile_id, "name": name, "content": profile_content}
+
+
+class ProfileRegistry:
+    """Index des profils d'un dossier; contenu chargé paresseusement et partagé par toutes les sessions."""
+
+    def __init__(self, profile_dir="profiles", cache_size=PROFILE_CACHE_SIZE):
+        self.profile_dir = profile_dir
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self._entries = {}         # id -> {"id", "name", "path", "mtime_ns"}
+        self._memory_profiles = {}  # Profils ajoutés par code (ex: profil par défaut), toujours en mémoire
+        self._name_to_id = {}
+        self._sorted_names = []
+        self._ordered_ids = []
+        self._bodies = OrderedDict()  # id -> (mtime_ns, profil complet), LRU
+        self._dir_mtime_ns = None
+        self._checked_at = 0.0
+        self.stats = {"scans": 0, "body_hits": 0, "body_loads": 0, "reloads": 0}
+        self.reload()
+
+    # --- Index ---
+
+    def reload(self):
+        """Relit les noms des profils nouveaux ou modifiés (première ligne seulement) et reconstruit les index."""
+        start_time = time.perf_counter()
+        entries = {}
+        with self._lock:
+            previous_entries = self._entries
+            self.stats["scans"] += 1
+            self._checked_at = time.monotonic()
+            try:
+                self._dir_mtime_ns = os.stat(self.profile_dir).st_mtime_ns
+                with os.scandir(self.profile_dir) as it:
+                    dir_entries = [e for e in it if e.name.endswith(PROFILE_EXTENSION) and e.is_file()]
+            except FileNotFoundError:
+                print(f"AVERTISSEMENT: Le dossier de profils '{self.profile_dir}' n'existe pas.")
+                self._dir_mtime_ns = None
+                dir_entries = []
+            except OSError as e:
+                print(f"Erreur lors de l'accès au dossier des profils '{self.profile_dir}': {str(e)}")
+                dir_entries = []
+
+            for dir_entry in dir_entries:
+                profile_id = os.path.splitext(dir_entry.name)[0]
+                try:
+                    mtime_ns = dir_entry.stat().st_mtime_ns
+                    previous = previous_entries.get(profile_id)
+                    if previous is not None and previous["mtime_ns"] == mtime_ns:
+                        entries[profile_id] = previous
+                        continue
+                    name = _read_display_name(dir_entry.path)
+                    if name is None:
+                        print(f"AVERTISSEMENT: Fichier de profil vide: {dir_entry.name}")
+                        continue
+                    entries[profile_id] = {"id": profile_id, "name": name, "path": dir_entry.path,
+                                           "mtime_ns": mtime_ns}
+                except Exception as e:
+                    print(f"Erreur lors du chargement du profil {dir_entry.name}: {str(e)}")
+
+            if not entries and not self._memory_profiles:
+                self._memory_profiles[DEFAULT_PROFILE_ID] = {
+                    "id": DEFAULT_PROFILE_ID, "name": DEFAULT_PROFILE_NAME, "content": DEFAULT_PROFILE_CONTENT}
+            self._entries = entries
+            # Contenus en cache dont le fichier a changé ou disparu
+            for profile_id in list(self._bodies):
+                entry = entries.get(profile_id)
+                if entry is None or entry["mtime_ns"] != self._bodies[profile_id][0]:
+                    del self._bodies[profile_id]
+            self._rebuild_indexes()
+        print(f"{len(entries)} profil(s) indexé(s) depuis {self.profile_dir} en {(time.perf_counter() - start_time) * 1000:.0f} ms")
+
+    def _rebuild_indexes(self):
+        names = {}
+        for profile_id, profile in self._memory_profiles.items():
+            names[profile_id] = profile["name"]
+        for profile_id, entry in self._entries.items():
+            names[profile_id] = entry["name"]
+        self._ordered_ids = sorted(names, key=lambda pid: (normalize_for_sort(names[pid]), pid))
+        self._sorted_names = [names[pid] for pid in self._ordered_ids]
+        # En cas de doublon de nom, le premier dans l'ordre trié l'emporte
+        self._name_to_id = {}
+        for profile_id in self._ordered_ids:
+            self._name_to_id.setdefault(names[profile_id], profile_id)
+
+    def _check_for_changes(self):
+        """Met l'index à jour si des fichiers ont été ajoutés, supprimés ou modifiés (au plus toutes les quelques secondes)."""
+        now = time.monotonic()
+        if now - self._checked_at < PROFILE_RESCAN_INTERVAL_S:
+            return
+        self._checked_at = now
+        try:
+            changed = os.stat(self.profile_dir).st_mtime_ns != self._dir_mtime_ns
+        except OSError:
+            changed = self._dir_mtime_ns is not None
+        if not changed:
+            for entry in self._entries.values():
+                try:
+                    if os.stat(entry["path"]).st_mtime_ns != entry["mtime_ns"]:
+                        changed = True
+                        break
+                except OSError:
+                    changed = True
+                    break
+        if changed:
+            self.stats["reloads"] += 1
+            self.reload()
+
+    # --- Accès ---
+
+    def add_profile(self, profile_id, display_name, profile_content):
+        """Ajoute (ou remplace) un profil en mémoire, sans fichier."""
+        with self._lock:
+            self._memory_profiles[profile_id] = {"id": profile_id, "name": display_name, "content": profile_content}
+            self._rebuild_indexes()
+
+    def get_profile(self, profile_id):
+        """Retourne le profil complet (id, name, content), chargé depuis le disque si nécessaire."""
+        with self._lock:
+            self._check_for_changes()
+            if profile_id in self._memory_profiles:
+                return self._memory_profiles[profile_id]
+            entry = self._entries.get(profile_id)
+            if entry is None:
+                return None
+            try:
+                mtime_ns = os.stat(entry["path"]).st_mtime_ns
+            except OSError:
+                # Fichier supprimé depuis le dernier scan
+                self.stats["reloads"] += 1
+                self.reload()
+                return None
+            cached = self._bodies.get(profile_id)
+            if cached is not None and cached[0] == mtime_ns:
+                self._bodies.move_to_end(profile_id)
+                self.stats["body_hits"] += 1
+                return cached[1]
+            return self._load_body(entry, mtime_ns)
+
+    def _load_body(self, entry, mtime_ns):
+        profile_id = entry["id"]
+        try:
+            with open(entry["path"], 'r', encoding='utf-8') as file:
+                profile = _parse_profile(profile_id, file.read())
+        except Exception as e:
+            print(f"Erreur lors du chargement du profil {profile_id}: {str(e)}")
+            return None
+        if profile is None:
+            print(f"AVERTISSEMENT: Fichier de profil vide: {os.path.basename(entry['path'])}")
+            return None
+        self.stats["body_loads"] += 1
+        if mtime_ns != entry["mtime_ns"] or profile["name"] != entry["name"]:
+            # Fichier modifié: le nom affiché a pu changer
+            entry["mtime_ns"] = mtime_ns
+            if profile["name"] != entry["name"]:
+                entry["name"] = profile["name"]
+                self._rebuild_indexes()
+        self._bodies[profile_id] = (mtime_ns, profile)
+        self._bodies.move_to_end(profile_id)
+        while len(self._bodies) > self.cache_size:
+            self._bodies.popitem(last=False)
+        return profile
+
+    def get_profile_by_name(self, name):
+        with self._lock:
+            self._check_for_changes()
+            profile_id = self._name_to_id.get(name)
+        return self.get_profile(profile_id) if profile_id is not None else None
+
+    def get_profile_id_by_name(self, name):
+        with self._lock:
+            self._check_for_changes()
+            return self._name_to_id.get(name)
+
+    def get_profile_names(self):
+        """Noms affichés, triés sans tenir compte des accents (liste pré-calculée)."""
+        with self._lock:
+            self._check_for_changes()
+            return list(self._sorted_names)
+
+    def get_profile_ids(self):
+        """Identifiants dans l'ordre des noms triés."""
+        with self._lock:
+            self._check_for_changes()
+            return list(self._ordered_ids)
+
+    def get_profile_name(self, profile_id):
+        with self._lock:
+            if profile_id in self._memory_profiles:
+                return self._memory_profiles[profile_id]["name"]
+            entry = self._entries.get(profile_id)
+            return entry["name"] if entry else None
+
+    def __contains__(self, profile_id):
+        return profile_id in self._memory_profiles or profile_id in self._entries
+
+    def __len__(self):
+        return len(self._ordered_ids)
+
+    def as_mapping(self):
+        """Vue dict en lecture seule (id -> profil) dont les contenus sont chargés à l'accès."""
+        return LazyProfileMapping(self)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, profiles=len(self._ordered_ids), cached_bodies=len(self._bodies),
+                        cache_size=self.cache_size)
+
+
+class LazyProfileMapping(Mapping):
+    """Mapping id -> profil: les clés viennent de l'index, le contenu n'est lu qu'à l'accès."""
+
+    def __init__(self, registry):
+        self._registry = registry
+
+    def __getitem__(self, profile_id):
+        profile = self._registry.get_profile(profile_id)
+        if profile is None:
+            raise KeyError(profile_id)
+        return profile
+
+    def __iter__(self):
+        return iter(self._registry.get_profile_ids())
+
+    def __len__(self):
+        return len(self._registry)
+
+    def __contains__(self, profile_id):
+        return profile_id in self._registry
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_profile_registry(profile_dir="profiles"):
+    """Retourne le registre partagé pour ce dossier de profils (créé au premier appel)."""
+    key = os.path.abspath(profile_dir)
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(key)
+            if registry is None:
+                registry = ProfileRegistry(profile_dir)
+                _registries[key] = registry
+    return registry
@@ -0,0 +1,247 @@
+"""
+Sélection des sections pertinentes des profils experts pour EXPERTS IA
+Les gros profils (tables de prix, étriers, poutres et linteaux) sont découpés
+en sections et indexés localement (BM25 avec NumPy, sans réseau). Seuls l'en-tête
+du profil (persona) et les sections les plus pertinentes pour la question et
+l'historique récent sont envoyés à l'API.
+"""
+
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+from history_builder import estimate_tokens
+from response_cache import hash_text
+
+RETRIEVAL_MIN_PROFILE_TOKENS = 6000   # En dessous, le profil est envoyé en entier
+PERSONA_HEADER_MAX_TOKENS = 1500      # En-tête toujours envoyé (identité, compétences)
+SECTION_MAX_TOKENS = 700              # Les longues tables sont découpées en tranches
+RETRIEVAL_TOP_K = 8
+RETRIEVAL_BUDGET_TOKENS = 6000        # Budget des sections sélectionnées
+RETRIEVAL_HISTORY_MESSAGES = 4        # Messages récents ajoutés à la requête
+HISTORY_QUERY_WEIGHT = 0.5            # Poids des termes de l'historique par rapport à la question
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-/.][a-z0-9]+)*")
+_HEADING_PATTERN = re.compile(r"^(\*\*.+\*\*|#{1,6} .+|[A-ZÀ-Ý0-9 .'/&()-]{6,}:?)$")
+
+STOPWORDS = {
+    'le', 'la', 'les', 'un', 'une', 'des', 'de', 'du', 'et', 'ou', 'en', 'au', 'aux', 'a', 'pour',
+    'par', 'sur', 'dans', 'avec', 'est', 'sont', 'que', 'qui', 'quel', 'quelle', 'quels', 'quelles',
+    'ce', 'cette', 'ces', 'se', 'sa', 'son', 'ses', 'il', 'elle', 'je', 'tu', 'nous', 'vous', 'ne',
+    'pas', 'plus', 'mon', 'ma', 'mes', 'the', 'of', 'and', 'for', 'to', 'in', 'on', 'with',
+}
+
+
+def tokenize_for_index(text):
+    """Termes d'indexation: minuscules sans accents; les codes produits (ex: AC5-TZ) gardent aussi leur forme complète."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    terms = []
+    for match in _TOKEN_PATTERN.findall(text):
+        parts = re.split(r"[-/.]", match)
+        if len(parts) > 1:
+            terms.append(match)
+        terms.extend(p for p in parts if p and p not in STOPWORDS and (len(p) > 1 or p.isdigit()))
+    return terms
+
+
+def _split_long_block(lines, max_tokens):
+    """Découpe un bloc trop long en tranches; la première ligne (en-tête de table) est répétée dans chaque tranche."""
+    header = lines[0]
+    chunks, current, current_tokens = [], [], 0
+    for line in lines[1:]:
+        line_tokens = estimate_tokens(line)
+        if current and current_tokens + line_tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        chunks.append(current)
+    return [[header] + chunk for chunk in chunks] or [lines]
+
+
+def split_profile(content, header_max_tokens=PERSONA_HEADER_MAX_TOKENS, section_max_tokens=SECTION_MAX_TOKENS):
+    """
+    Découpe un profil en en-tête (persona) et sections.
+
+    Les blocs sont séparés par les lignes vides; un titre isolé est rattaché au bloc suivant.
+
+    Returns:
+        tuple: (texte de l'en-tête, liste de sections {"text", "tokens"})
+    """
+    blocks, current, pending_heading = [], [], None
+    for line in content.splitlines():
+        if not line.strip():
+            if current:
+                blocks.append(current)
+                current = []
+            continue
+        if not current and pending_heading is None and _HEADING_PATTERN.match(line.strip()):
+            pending_heading = line
+            continue
+        if pending_heading is not None:
+            current.append(pending_heading)
+            pending_heading = None
+        current.append(line)
+    if pending_heading is not None:
+        current.append(pending_heading)
+    if current:
+        blocks.append(current)
+
+    header_lines, header_tokens, index = [], 0, 0
+    while index < len(blocks):
+        block_tokens = estimate_tokens("\n".join(blocks[index]))
+        if header_tokens + block_tokens > header_max_tokens:
+            break
+        header_lines.append("\n".join(blocks[index]))
+        header_tokens += block_tokens
+        index += 1
+
+    sections = []
+    for block in blocks[index:]:
+        text = "\n".join(block)
+        if estimate_tokens(text) > section_max_tokens and len(block) > 2:
+            pieces = ["\n".join(chunk) for chunk in _split_long_block(block, section_max_tokens)]
+        else:
+            pieces = [text]
+        for piece in pieces:
+            sections.append({"text": piece, "tokens": estimate_tokens(piece)})
+    return "\n\n".join(header_lines), sections
+
+
+class ProfileSectionIndex:
+    """Index BM25 des sections d'un profil (matrice de poids sections x termes)."""
+
+    def __init__(self, content):
+        self.header, self.sections = split_profile(content)
+        self.total_tokens = estimate_tokens(content)
+        self.vocabulary = {}
+        term_counts = []
+        for section in self.sections:
+            counts = {}
+            for term in tokenize_for_index(section["text"]):
+                term_id = self.vocabulary.setdefault(term, len(self.vocabulary))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            term_counts.append(counts)
+
+        n_sections, n_terms = len(self.sections), len(self.vocabulary)
+        tf = np.zeros((n_sections, n_terms), dtype=np.float32)
+        for row, counts in enumerate(term_counts):
+            if counts:
+                tf[row, list(counts.keys())] = list(counts.values())
+        lengths = tf.sum(axis=1)
+        average_length = lengths.mean() if n_sections else 0.0
+        document_frequency = (tf > 0).sum(axis=0)
+        idf = np.log(1.0 + (n_sections - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths / (average_length or 1.0))
+        self.weights = (tf * (BM25_K1 + 1.0) / (tf + norm[:, None])) * idf[None, :] if n_sections else tf
+
+    def score(self, weighted_terms):
+        """Score BM25 de chaque section pour une requête {terme: poids}."""
+        scores = np.zeros(len(self.sections), dtype=np.float32)
+        for term, weight in weighted_terms.items():
+            term_id = self.vocabulary.get(term)
+            if term_id is not None:
+                scores += weight * self.weights[:, term_id]
+        return scores
+
+    def select(self, weighted_terms, top_k=RETRIEVAL_TOP_K, budget_tokens=RETRIEVAL_BUDGET_TOKENS):
+        """Indices des sections retenues (meilleurs scores dans le budget), dans l'ordre du document."""
+        scores = self.score(weighted_terms)
+        selected, used_tokens = [], 0
+        for index in np.argsort(-scores, kind="stable"):
+            if scores[index] <= 0 or len(selected) >= top_k:
+                break
+            section_tokens = self.sections[index]["tokens"]
+            if used_tokens + section_tokens > budget_tokens:
+                continue
+            selected.append(int(index))
+            used_tokens += section_tokens
+        return sorted(selected)
+
+
+def build_query_terms(question, history_texts=()):
+    """Termes pondérés de la requête: la question pèse plus que l'historique récent."""
+    weighted_terms = {}
+    for term in tokenize_for_index(question or ""):
+        weighted_terms[term] = weighted_terms.get(term, 0.0) + 1.0
+    for text in history_texts:
+        for term in tokenize_for_index(text or ""):
+            weighted_terms[term] = weighted_terms.get(term, 0.0) + HISTORY_QUERY_WEIGHT
+    return weighted_terms
+
+
+class ProfileRetriever:
+    """Index des profils partagés par le processus; un index n'est reconstruit que si son profil change."""
+
+    def __init__(self):
+        self._indexes = {}  # profile_id -> (hash du contenu, ProfileSectionIndex)
+        self._lock = threading.Lock()
+        self.stats = {"builds": 0, "reuses": 0}
+
+    def get_index(self, profile):
+        profile_id, content = profile.get("id"), profile.get("content", "")
+        content_hash = hash_text(content)
+        cached = self._indexes.get(profile_id)
+        if cached is not None and cached[0] == content_hash:
+            self.stats["reuses"] += 1
+            return cached[1]
+        with self._lock:
+            cached = self._indexes.get(profile_id)
+            if cached is None or cached[0] != content_hash:
+                index = ProfileSectionIndex(content)
+                self._indexes[profile_id] = (content_hash, index)
+                self.stats["builds"] += 1
+                print(f"[PROFIL] Index des sections construit pour {profile_id}: {len(index.sections)} sections, "
+                      f"{len(index.vocabulary)} termes")
+                return index
+            return cached[1]
+
+    def select_sections(self, profile, question, history_texts=()):
+        """
+        Sélectionne l'en-tête et les sections pertinentes d'un gros profil.
+
+        Returns:
+            dict ou None: {"header", "sections_text", "selected", "total_sections",
+                           "profile_tokens", "sent_tokens"}; None si le profil est envoyé en entier
+                           (petit profil, en-tête vide ou aucune section pertinente)
+        """
+        content = profile.get("content", "")
+        if estimate_tokens(content) < RETRIEVAL_MIN_PROFILE_TOKENS:
+            return None
+        index = self.get_index(profile)
+        # En-tête vide (premier bloc plus long que PERSONA_HEADER_MAX_TOKENS): bloc système vide refusé par l'API
+        if not index.sections or not index.header.strip():
+            return None
+        selected = index.select(build_query_terms(question, history_texts))
+        if not selected:
+            return None  # Aucun terme de la question dans le profil: l'en-tête seul perdrait tout le contenu
+        sections_text = "\n\n".join(index.sections[i]["text"] for i in selected)
+        return {
+            "header": index.header,
+            "sections_text": sections_text,
+            "selected": selected,
+            "total_sections": len(index.sections),
+            "profile_tokens": index.total_tokens,
+            "sent_tokens": estimate_tokens(index.header) + estimate_tokens(sections_text),
+        }
+
+
+_shared_retriever = None
+_shared_retriever_lock = threading.Lock()
+
+
+def get_profile_retriever():
+    """Retourne le sélecteur de sections partagé par le processus (créé au premier appel)."""
+    global _shared_retriever
+    if _shared_retriever is None:
+        with _shared_retriever_lock:
+            if _shared_retriever is None:
+                _shared_retriever = ProfileRetriever()
+    return _shared_retriever
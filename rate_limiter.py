@@ -0,0 +1,250 @@
+"""
+Contrôle d'admission des appels API pour EXPERTS IA
+Limiteur partagé par tout le processus: seaux à jetons (requêtes et tokens
+d'entrée par minute), plafond de concurrence, file de priorité (chat interactif
+avant l'extraction en lot), pause commune après un 429 et disjoncteur.
+"""
+
+import os
+import heapq
+import itertools
+import threading
+import time
+
+from error_handler import (CircuitOpenError, compute_backoff_delay, get_retry_after,
+                           is_retryable_error)
+from history_builder import estimate_tokens
+
+# Priorités (plus petit = servi en premier)
+PRIORITY_INTERACTIVE = 0   # Chat, analyse, panel, recherche web
+PRIORITY_BACKGROUND = 5    # Résumés glissants
+PRIORITY_BATCH = 10        # Extraction de soumissions
+
+# Limites (surchargeables par variables d'environnement)
+API_REQUESTS_PER_MINUTE = float(os.getenv('API_REQUESTS_PER_MINUTE', '50'))
+API_INPUT_TOKENS_PER_MINUTE = float(os.getenv('API_INPUT_TOKENS_PER_MINUTE', '400000'))
+API_MAX_CONCURRENCY = int(os.getenv('API_MAX_CONCURRENCY', '16'))
+API_CALL_MAX_RETRIES = int(os.getenv('API_CALL_MAX_RETRIES', '4'))
+API_ADMISSION_TIMEOUT_S = float(os.getenv('API_ADMISSION_TIMEOUT', '120'))
+
+CIRCUIT_FAILURE_THRESHOLD = 5      # Échecs transitoires consécutifs avant ouverture
+CIRCUIT_RESET_TIMEOUT_S = 30.0     # Durée d'ouverture avant un essai (semi-ouvert)
+
+
+class TokenBucket:
+    """Seau à jetons: 'rate_per_minute' jetons par minute, rafale maximale = capacité."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(capacity or rate_per_minute)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount, now):
+        """Secondes à attendre avant de pouvoir consommer 'amount' jetons (0 si disponible)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # Une requête plus grosse que le seau passe quand il est plein
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate_per_second if self.rate_per_second > 0 else float('inf')
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class CircuitBreaker:
+    """Disjoncteur: ouvert après une série d'échecs transitoires, semi-ouvert après le délai."""
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT_S):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.half_open_trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "fermé"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "semi-ouvert"
+        return "ouvert"
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.half_open_trial = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.half_open_trial or self.consecutive_failures >= self.failure_threshold:
+            if self.opened_at is None or self.half_open_trial:
+                print(f"[LIMITEUR] Disjoncteur ouvert pour {self.reset_timeout:.0f}s "
+                      f"({self.consecutive_failures} échecs consécutifs)")
+            self.opened_at = time.monotonic()
+        self.half_open_trial = False
+
+
+def estimate_request_tokens(request_kwargs):
+    """Estime les tokens d'entrée d'une requête messages (système + messages)."""
+    system = request_kwargs.get("system")
+    total = estimate_tokens(system) if system else 0
+    for message in request_kwargs.get("messages", []):
+        total += estimate_tokens(message.get("content"))
+    return total
+
+
+class AdmissionController:
+    """Admission des appels API partagée par toutes les sessions du processus."""
+
+    def __init__(self, requests_per_minute=API_REQUESTS_PER_MINUTE,
+                 input_tokens_per_minute=API_INPUT_TOKENS_PER_MINUTE,
+                 max_concurrency=API_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._request_bucket = TokenBucket(requests_per_minute)
+        self._token_bucket = TokenBucket(input_tokens_per_minute)
+        self._breaker = CircuitBreaker()
+        self._condition = threading.Condition()
+        self._waiting = []  # Tas (priorité, ordre d'arrivée)
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0  # Pause commune après un 429 / une surcharge
+        self.stats = {'admitted': 0, 'retries': 0, 'rate_limited': 0, 'failures': 0,
+                      'rejected_circuit_open': 0, 'total_wait_s': 0.0}
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, estimated_tokens=0, timeout=API_ADMISSION_TIMEOUT_S):
+        """
+        Attend son tour (priorité puis ordre d'arrivée) et réserve une place.
+
+        Raises:
+            CircuitOpenError: si le disjoncteur est ouvert
+            TimeoutError: si l'attente dépasse 'timeout'
+        """
+        entry = (priority, next(self._sequence))
+        started_at = time.monotonic()
+        deadline = started_at + timeout if timeout else None
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    circuit_state = self._breaker.state
+                    if circuit_state == "ouvert":
+                        self.stats['rejected_circuit_open'] += 1
+                        raise CircuitOpenError(
+                            "Service IA temporairement indisponible après plusieurs échecs. "
+                            "Réessayez dans quelques instants.")
+                    # En semi-ouvert, un seul appel d'essai à la fois
+                    trial_busy = circuit_state == "semi-ouvert" and self._breaker.half_open_trial
+                    wait = None
+                    if self._waiting[0] == entry and self._in_flight < self.max_concurrency and not trial_busy:
+                        wait = max(self._paused_until - now,
+                                   self._request_bucket.wait_time(1, now),
+                                   self._token_bucket.wait_time(estimated_tokens, now))
+                        if wait <= 0:
+                            break
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            raise TimeoutError("Délai d'attente dépassé pour l'appel à l'API.")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._condition.wait(wait)
+                heapq.heappop(self._waiting)
+                if circuit_state == "semi-ouvert":
+                    self._breaker.half_open_trial = True
+                self._request_bucket.consume(1)
+                self._token_bucket.consume(estimated_tokens)
+                self._in_flight += 1
+                self.stats['admitted'] += 1
+                self.stats['total_wait_s'] += time.monotonic() - started_at
+                self._condition.notify_all()  # Réveiller le suivant dans la file
+            except BaseException:
+                if entry in self._waiting:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                self._condition.notify_all()
+                raise
+
+    def release(self, error=None):
+        """Libère la place; met à jour le disjoncteur et la pause commune selon le résultat."""
+        with self._condition:
+            self._in_flight -= 1
+            if error is None:
+                self._breaker.record_success()
+            elif is_retryable_error(error):
+                self.stats['failures'] += 1
+                self._breaker.record_failure()
+                if getattr(error, 'status_code', None) in (429, 529):
+                    self.stats['rate_limited'] += 1
+                    # Toutes les sessions reculent ensemble au lieu de réessayer chacune de son côté
+                    pause = get_retry_after(error)
+                    if pause is None:
+                        pause = compute_backoff_delay(self._breaker.consecutive_failures - 1)
+                    self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            else:
+                # Erreur de la requête elle-même (400, 401...): le service répond
+                self._breaker.record_success()
+            self._condition.notify_all()
+
+    def call(self, func, *args, priority=PRIORITY_INTERACTIVE, estimated_tokens=0,
+             max_retries=API_CALL_MAX_RETRIES, **kwargs):
+        """
+        Exécute func(*args, **kwargs) sous contrôle d'admission, avec réessais
+        (gigue, Retry-After respecté) pour les erreurs transitoires.
+        """
+        attempt = 0
+        while True:
+            self.acquire(priority, estimated_tokens)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self.release(e)
+                if not is_retryable_error(e) or attempt >= max_retries:
+                    raise
+                # Le délai de reprise est porté par la pause commune (429) ou par ce recul exponentiel
+                delay = 0.0 if getattr(e, 'status_code', None) in (429, 529) else compute_backoff_delay(attempt)
+                attempt += 1
+                self.stats['retries'] += 1
+                print(f"[LIMITEUR] Erreur transitoire ({type(e).__name__}), essai {attempt}/{max_retries}"
+                      f"{f' dans {delay:.1f}s' if delay else ''}")
+                if delay:
+                    time.sleep(delay)
+                continue
+            self.release()
+            return result
+
+    def create_message(self, client, priority=PRIORITY_INTERACTIVE, **request_kwargs):
+        """Raccourci: client.messages.create(**request_kwargs) sous contrôle d'admission."""
+        return self.call(client.messages.create, priority=priority,
+                         estimated_tokens=estimate_request_tokens(request_kwargs), **request_kwargs)
+
+    def get_stats(self):
+        """État du limiteur pour la vue admin."""
+        with self._condition:
+            now = time.monotonic()
+            return dict(self.stats,
+                        in_flight=self._in_flight,
+                        waiting=len(self._waiting),
+                        max_concurrency=self.max_concurrency,
+                        circuit_state=self._breaker.state,
+                        paused_for_s=max(0.0, self._paused_until - now),
+                        requests_available=int(self._request_bucket.tokens),
+                        input_tokens_available=int(self._token_bucket.tokens))
+
+
+_shared_controller = None
+_shared_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Retourne le contrôleur d'admission partagé par le processus (créé au premier appel)."""
+    global _shared_controller
+    if _shared_controller is None:
+        with _shared_controller_lock:
+            if _shared_controller is None:
+                _shared_controller = AdmissionController()
+    return _shared_controller
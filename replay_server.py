@@ -0,0 +1,523 @@
+"""
+Serveur local de rejeu de l'API Messages pour EXPERTS IA
+Remplace l'API Anthropic pour les tests de charge et les mesures de performance:
+même protocole /v1/messages (réponses JSON ou flux SSE), réponses rejouées depuis
+un fichier d'enregistrements (JSONL) ou synthétisées, latence simulée (premier
+token, débit de génération) et erreurs injectées (429 avec Retry-After, 529).
+Tient aussi lieu d'API de fichiers (/v1/files) pour les documents joints par référence.
+
+Utilisation:
+    python replay_server.py --port 8765 --error-rate 0.05
+    LLM_BACKEND=replay streamlit run app.py
+
+Mode enregistrement (relaie vers la vraie API et enregistre les réponses):
+    python replay_server.py --record --recordings data/replay/recordings.jsonl
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from document_store import FILES_API_BETA
+from response_cache import hash_text, normalize_text, _message_text
+
+# Définir le répertoire de données
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+DEFAULT_RECORDINGS_PATH = os.path.join(DATA_DIR, 'replay', 'recordings.jsonl')
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+UPSTREAM_API_URL = 'https://api.anthropic.com'
+
+SYNTHETIC_RESPONSE_WORDS = 250  # Longueur des réponses synthétisées (mots)
+CHARS_PER_TOKEN = 3.5
+IMAGE_FILE_TOKENS = 1600  # Image référencée par fichier
+
+SYNTHETIC_EXTRACTION_JSON = {
+    "numero_soumission": "2025-XXX",
+    "client": {"nom": "Client Test", "adresse": "123 rue Principale", "ville": "Granby"},
+    "projet": {"nom": "Rénovation (rejeu local)", "description": "Données synthétiques du serveur de rejeu"},
+    "travaux": [
+        {"categorie": "0.0", "nom": "Travaux préparatoires", "items": [
+            {"titre": "Protection des lieux", "description": "Simulation", "quantite": 1,
+             "unite": "forfait", "prix_unitaire": 500.0, "total": 500.0}
+        ]}
+    ],
+}
+
+
+class ReplayConfig:
+    """Paramètres de simulation (modifiables à chaud par les tests de charge)."""
+
+    def __init__(self, first_token_ms=400.0, first_token_jitter_ms=200.0, tokens_per_second=80.0,
+                 error_rate=0.0, overload_rate=0.0, retry_after_s=1.0,
+                 recordings_path=DEFAULT_RECORDINGS_PATH, record=False, upstream_url=UPSTREAM_API_URL):
+        self.first_token_ms = first_token_ms
+        self.first_token_jitter_ms = first_token_jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate          # Proportion de réponses 429
+        self.overload_rate = overload_rate    # Proportion de réponses 529 (API surchargée)
+        self.retry_after_s = retry_after_s
+        self.recordings_path = recordings_path
+        self.record = record
+        self.upstream_url = upstream_url
+
+
+def request_key(body):
+    """Clé d'un enregistrement: modèle, système, messages et outils normalisés."""
+    system = body.get("system")
+    system_text = _message_text(system) if isinstance(system, list) else (system or "")
+    payload = json.dumps({
+        "model": body.get("model"),
+        "system": normalize_text(system_text),
+        "messages": [[m.get("role"), normalize_text(_message_text(m.get("content")))] for m in body.get("messages", [])],
+        "tools": sorted(t.get("name", "") for t in body.get("tools") or []),
+    }, ensure_ascii=False, sort_keys=True)
+    return hash_text(payload)
+
+
+def question_key(body):
+    """Clé souple: dernier message utilisateur seulement (l'historique peut varier d'un essai à l'autre)."""
+    messages = body.get("messages") or [{}]
+    return hash_text(normalize_text(_message_text(messages[-1].get("content"))))
+
+
+def estimate_tokens(text):
+    return int(len(text or "") / CHARS_PER_TOKEN) + 1
+
+
+class RecordingStore:
+    """Enregistrements de réponses (JSONL), indexés par clé exacte et par clé souple."""
+
+    def __init__(self, path):
+        self.path = path
+        self._exact = {}
+        self._by_question = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._index(entry)
+            print(f"[REJEU] {len(self._exact)} enregistrement(s) chargé(s) depuis {path}")
+
+    def _index(self, entry):
+        self._exact[entry["key"]] = entry["response"]
+        self._by_question.setdefault(entry.get("question_key"), entry["response"])
+
+    def find(self, body):
+        response = self._exact.get(request_key(body))
+        if response is None:
+            response = self._by_question.get(question_key(body))
+        return response
+
+    def add(self, body, response):
+        entry = {"key": request_key(body), "question_key": question_key(body), "recorded_at": time.time(),
+                 "response": response}
+        with self._lock:
+            self._index(entry)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def __len__(self):
+        return len(self._exact)
+
+
+class ReplayState:
+    """État partagé du serveur: configuration, enregistrements, préfixes déjà mis en cache et statistiques."""
+
+    def __init__(self, config):
+        self.config = config
+        self.recordings = RecordingStore(config.recordings_path)
+        self.cached_prefixes = set()
+        self.files = {}  # file_id -> métadonnées et contenu (API de fichiers simulée, en mémoire)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "streamed": 0, "replayed": 0, "synthetic": 0, "recorded": 0,
+                      "rate_limited": 0, "overloaded": 0, "in_flight": 0, "max_in_flight": 0,
+                      "files_uploaded": 0, "file_references": 0}
+
+    def count(self, name, delta=1):
+        with self.lock:
+            self.stats[name] += delta
+            if name == "in_flight":
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+
+
+def _cacheable_prefix_tokens(body):
+    """Tokens du préfixe marqué cache_control (système), pour simuler le prompt caching."""
+    system = body.get("system")
+    if not isinstance(system, list):
+        return None, 0
+    prefix = [block.get("text", "") for block in system if isinstance(block, dict) and block.get("cache_control")]
+    if not prefix:
+        return None, 0
+    text = "\n".join(prefix)
+    return hash_text(text), estimate_tokens(text)
+
+
+def _synthetic_content(body):
+    """Contenu synthétique selon le type d'appel: recherche web, extraction JSON ou réponse d'expert."""
+    question = _message_text((body.get("messages") or [{}])[-1].get("content"))
+    tools = body.get("tools") or []
+    if any(t.get("name") == "web_search" for t in tools):
+        tool_id = f"srvtoolu_{uuid.uuid4().hex[:24]}"
+        return [
+            {"type": "server_tool_use", "id": tool_id, "name": "web_search", "input": {"query": question[:200]}},
+            {"type": "web_search_tool_result", "tool_use_id": tool_id, "content": [
+                {"type": "web_search_result", "title": "Résultat simulé", "url": "https://example.com/rejeu",
+                 "encrypted_content": "", "page_age": None}
+            ]},
+            {"type": "text", "text": f"Résultats de recherche simulés (rejeu local) pour: {question[:200]}"},
+        ]
+    if "JSON" in question:
+        return [{"type": "text", "text": json.dumps(SYNTHETIC_EXTRACTION_JSON, ensure_ascii=False, indent=2)}]
+    words = ("Réponse simulée par le serveur de rejeu local pour les tests de charge. "
+             "Aucun appel n'a été fait à l'API réelle. ").split()
+    text = " ".join(words[i % len(words)] for i in range(SYNTHETIC_RESPONSE_WORDS))
+    return [{"type": "text", "text": text}]
+
+
+def _file_references(body):
+    """Identifiants des fichiers référencés par les blocs document/image des messages."""
+    file_ids = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for block in content:
+            source = block.get("source") if isinstance(block, dict) else None
+            if isinstance(source, dict) and source.get("type") == "file":
+                file_ids.append(source.get("file_id"))
+    return file_ids
+
+
+def _file_tokens(file_entry):
+    if file_entry["mime_type"].startswith("image/"):
+        return IMAGE_FILE_TOKENS
+    return estimate_tokens(file_entry["data"].decode('utf-8', errors='replace'))
+
+
+def _build_message(body, content, state):
+    """Message API complet (usage compris) à partir d'un contenu."""
+    input_tokens = estimate_tokens(json.dumps(body.get("messages", []), ensure_ascii=False))
+    with state.lock:
+        input_tokens += sum(_file_tokens(state.files[file_id]) for file_id in _file_references(body)
+                            if file_id in state.files)
+    prefix_hash, prefix_tokens = _cacheable_prefix_tokens(body)
+    cache_read, cache_creation = 0, 0
+    if prefix_hash:
+        with state.lock:
+            if prefix_hash in state.cached_prefixes:
+                cache_read = prefix_tokens
+            else:
+                state.cached_prefixes.add(prefix_hash)
+                cache_creation = prefix_tokens
+    output_text = "".join(block.get("text", "") for block in content if block.get("type") == "text")
+    return {
+        "id": f"msg_replay_{uuid.uuid4().hex[:20]}",
+        "type": "message",
+        "role": "assistant",
+        "model": body.get("model", "replay"),
+        "content": content,
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": estimate_tokens(output_text),
+                  "cache_creation_input_tokens": cache_creation, "cache_read_input_tokens": cache_read},
+    }
+
+
+def _file_metadata(entry):
+    return {"id": entry["id"], "type": "file", "filename": entry["filename"], "mime_type": entry["mime_type"],
+            "size_bytes": len(entry["data"]), "created_at": entry["created_at"], "downloadable": False}
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    """Gestionnaire HTTP: POST /v1/messages, API de fichiers (/v1/files), GET /health et GET /stats."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive, comme l'API réelle
+    server_version = "ExpertsIAReplay/1.0"
+
+    @property
+    def state(self):
+        return self.server.replay_state
+
+    def log_message(self, format, *args):
+        pass  # Silencieux: des milliers de requêtes en test de charge
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, error_type, message, headers=None):
+        self._send_json(status, {"type": "error", "error": {"type": error_type, "message": message}}, headers)
+
+    def do_GET(self):
+        if self.path.startswith("/health"):
+            self._send_json(200, {"status": "ok"})
+        elif self.path.startswith("/stats"):
+            with self.state.lock:
+                stats = dict(self.state.stats, recordings=len(self.state.recordings), files=len(self.state.files))
+            self._send_json(200, stats)
+        elif self.path.startswith("/v1/files"):
+            file_id = self._file_id_from_path()
+            with self.state.lock:
+                if not file_id:
+                    files = [_file_metadata(entry) for entry in self.state.files.values()]
+                    self._send_json(200, {"data": files, "has_more": False,
+                                          "first_id": files[0]["id"] if files else None,
+                                          "last_id": files[-1]["id"] if files else None})
+                elif file_id in self.state.files:
+                    self._send_json(200, _file_metadata(self.state.files[file_id]))
+                else:
+                    self._send_error(404, "not_found_error", f"File not found: {file_id}")
+        else:
+            self._send_error(404, "not_found_error", f"Chemin inconnu: {self.path}")
+
+    def do_DELETE(self):
+        file_id = self._file_id_from_path() if self.path.startswith("/v1/files") else None
+        with self.state.lock:
+            entry = self.state.files.pop(file_id, None) if file_id else None
+        if entry is None:
+            self._send_error(404, "not_found_error", f"File not found: {file_id or self.path}")
+        else:
+            self._send_json(200, {"id": file_id, "type": "file_deleted"})
+
+    def _file_id_from_path(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        return path[len("/v1/files/"):] if path.startswith("/v1/files/") else None
+
+    def _upload_file(self):
+        """POST /v1/files: multipart/form-data avec un champ 'file'."""
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            self._send_error(400, "invalid_request_error", "multipart/form-data attendu.")
+            return
+        form = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + raw)
+        for part in form.iter_parts():
+            if part.get_param("name", header="content-disposition") != "file":
+                continue
+            entry = {"id": f"file_replay_{uuid.uuid4().hex[:20]}", "filename": part.get_filename() or "upload",
+                     "mime_type": part.get_content_type(), "data": part.get_payload(decode=True) or b"",
+                     "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+            with self.state.lock:
+                self.state.files[entry["id"]] = entry
+                self.state.stats["files_uploaded"] += 1
+            self._send_json(200, _file_metadata(entry))
+            return
+        self._send_error(400, "invalid_request_error", "Champ 'file' manquant.")
+
+    def do_POST(self):
+        if self.path.startswith("/v1/files"):
+            self._upload_file()
+            return
+        if not self.path.startswith("/v1/messages"):
+            self._send_error(404, "not_found_error", f"Chemin inconnu: {self.path}")
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_error(400, "invalid_request_error", "Corps JSON invalide.")
+            return
+
+        state, config = self.state, self.state.config
+        # Références de fichiers: mêmes erreurs que l'API (fichier inconnu, en-tête bêta manquant)
+        file_ids = _file_references(body)
+        if file_ids:
+            if FILES_API_BETA not in (self.headers.get("anthropic-beta") or ""):
+                self._send_error(400, "invalid_request_error",
+                                 f"Les références de fichiers exigent l'en-tête anthropic-beta: {FILES_API_BETA}")
+                return
+            with state.lock:
+                missing = [file_id for file_id in file_ids if file_id not in state.files]
+                state.stats["file_references"] += len(file_ids)
+            if missing:
+                self._send_error(404, "not_found_error", f"File not found: {missing[0]}")
+                return
+        state.count("requests")
+        state.count("in_flight")
+        try:
+            # Erreurs injectées
+            roll = random.random()
+            if roll < config.error_rate:
+                state.count("rate_limited")
+                self._send_error(429, "rate_limit_error", "Limite de taux simulée (rejeu local).",
+                                 {"retry-after": f"{config.retry_after_s:g}"})
+                return
+            if roll < config.error_rate + config.overload_rate:
+                state.count("overloaded")
+                self._send_error(529, "overloaded_error", "Surcharge simulée (rejeu local).")
+                return
+
+            message = self._resolve_message(body)
+            if message is None:
+                return
+            time.sleep(max(0.0, random.gauss(config.first_token_ms, config.first_token_jitter_ms / 2)) / 1000.0)
+            if body.get("stream"):
+                state.count("streamed")
+                self._stream_message(message)
+            else:
+                output_tokens = message["usage"]["output_tokens"]
+                if config.tokens_per_second > 0:
+                    time.sleep(output_tokens / config.tokens_per_second)
+                self._send_json(200, message)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client parti (flux abandonné)
+        finally:
+            state.count("in_flight", -1)
+
+    def _resolve_message(self, body):
+        """Réponse enregistrée, relayée (mode enregistrement) ou synthétisée."""
+        state = self.state
+        recorded = state.recordings.find(body)
+        if recorded is not None:
+            state.count("replayed")
+            return _build_message(body, recorded.get("content", []), state)
+        if state.config.record:
+            return self._record_upstream(body)
+        state.count("synthetic")
+        return _build_message(body, _synthetic_content(body), state)
+
+    def _record_upstream(self, body):
+        """Relaie la requête vers l'API réelle (sans flux), enregistre et retourne la réponse."""
+        import httpx
+        upstream_body = dict(body, stream=False)
+        headers = {name: self.headers[name] for name in ("x-api-key", "anthropic-version", "anthropic-beta")
+                   if self.headers.get(name)}
+        try:
+            response = httpx.post(f"{self.state.config.upstream_url}/v1/messages", json=upstream_body,
+                                  headers=headers, timeout=600)
+        except httpx.HTTPError as e:
+            self._send_error(502, "api_error", f"API amont injoignable: {e}")
+            return None
+        if response.status_code != 200:
+            self.send_response(response.status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response.content)))
+            if response.headers.get("retry-after"):
+                self.send_header("retry-after", response.headers["retry-after"])
+            self.end_headers()
+            self.wfile.write(response.content)
+            return None
+        message = response.json()
+        self.state.recordings.add(body, {"content": message.get("content", [])})
+        self.state.count("recorded")
+        return message
+
+    def _write_event(self, event, data):
+        payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+        self.wfile.write(f"{len(payload):x}\r\n".encode('ascii') + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_message(self, message):
+        """Envoie le message en flux SSE (événements message_start ... message_stop), au débit simulé."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        tokens_per_second = self.state.config.tokens_per_second
+        usage = message["usage"]
+        start = dict(message, content=[], stop_reason=None, usage=dict(usage, output_tokens=1))
+        self._write_event("message_start", {"type": "message_start", "message": start})
+        for index, block in enumerate(message["content"]):
+            if block.get("type") != "text":
+                self._write_event("content_block_start", {"type": "content_block_start", "index": index, "content_block": block})
+                self._write_event("content_block_stop", {"type": "content_block_stop", "index": index})
+                continue
+            self._write_event("content_block_start", {"type": "content_block_start", "index": index,
+                                                      "content_block": {"type": "text", "text": ""}})
+            words = block.get("text", "").split(" ")
+            for position in range(0, len(words), 4):  # ~5 tokens par fragment
+                chunk = " ".join(words[position:position + 4]) + (" " if position + 4 < len(words) else "")
+                if tokens_per_second > 0:
+                    time.sleep(estimate_tokens(chunk) / tokens_per_second)
+                self._write_event("content_block_delta", {"type": "content_block_delta", "index": index,
+                                                          "delta": {"type": "text_delta", "text": chunk}})
+            self._write_event("content_block_stop", {"type": "content_block_stop", "index": index})
+        self._write_event("message_delta", {"type": "message_delta",
+                                            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                            "usage": {"output_tokens": usage["output_tokens"]}})
+        self._write_event("message_stop", {"type": "message_stop"})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_replay_server(host=DEFAULT_HOST, port=DEFAULT_PORT, config=None):
+    """
+    Démarre le serveur de rejeu dans un thread démon (utilisé par load_test.py).
+
+    Args:
+        host: Adresse d'écoute
+        port: Port (0 = port libre choisi par le système)
+        config: ReplayConfig (valeurs par défaut sinon)
+
+    Returns:
+        ThreadingHTTPServer: serveur démarré (server.replay_state pour la configuration et les statistiques)
+    """
+    server = ThreadingHTTPServer((host, port), ReplayRequestHandler)
+    server.daemon_threads = True
+    server.replay_state = ReplayState(config or ReplayConfig())
+    threading.Thread(target=server.serve_forever, name="replay-server", daemon=True).start()
+    print(f"[REJEU] Serveur de rejeu démarré sur http://{host}:{server.server_address[1]}")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur local de rejeu de l'API Messages (tests de charge)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS_PATH, help="Fichier JSONL des réponses enregistrées")
+    parser.add_argument("--record", action="store_true", help="Relayer vers l'API réelle et enregistrer les réponses manquantes")
+    parser.add_argument("--first-token-ms", type=float, default=400.0, help="Latence moyenne avant le premier token")
+    parser.add_argument("--jitter-ms", type=float, default=200.0, help="Variation de la latence du premier token")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="Débit de génération simulé (0 = instantané)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proportion de réponses 429")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="Proportion de réponses 529")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="En-tête Retry-After des 429 (secondes)")
+    args = parser.parse_args()
+
+    config = ReplayConfig(first_token_ms=args.first_token_ms, first_token_jitter_ms=args.jitter_ms,
+                          tokens_per_second=args.tokens_per_second, error_rate=args.error_rate,
+                          overload_rate=args.overload_rate, retry_after_s=args.retry_after,
+                          recordings_path=args.recordings, record=args.record)
+    server = ThreadingHTTPServer((args.host, args.port), ReplayRequestHandler)
+    server.daemon_threads = True
+    server.replay_state = ReplayState(config)
+    print(f"[REJEU] Serveur de rejeu en écoute sur http://{args.host}:{args.port} "
+          f"({'enregistrement' if args.record else 'rejeu'}, 429: {args.error_rate:.0%}, 529: {args.overload_rate:.0%})")
+    print(f"[REJEU] Lancer l'application avec LLM_BACKEND=replay REPLAY_SERVER_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[REJEU] Arrêt du serveur.")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Cache persistant des réponses LLM pour EXPERTS IA
+Clé: modèle + profil (id + hash du contenu) + historique normalisé + question.
+Stockage sur disque (diskcache) partagé entre les processus Streamlit, avec
+expiration (TTL), éviction LRU bornée en taille et invalidation par profil.
+Les compteurs et les versions de profil sont gardés à part, hors éviction.
+"""
+
+import os
+import json
+import hashlib
+import threading
+import unicodedata
+
+try:
+    import diskcache
+except ImportError:  # diskcache est optionnel: repli sur un cache mémoire
+    diskcache = None
+
+from memory_cache import MemoryLRUCache
+
+# Définir le répertoire de données
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+RESPONSE_CACHE_DIR = os.path.join(DATA_DIR, 'cache', 'responses')
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600          # 7 jours
+DEFAULT_SIZE_LIMIT_BYTES = 256 * 1024 * 1024  # 256 MB
+MEMORY_CACHE_MAX_ENTRIES = 500
+
+_STATS_HITS_KEY = "__stats__:hits"
+_STATS_MISSES_KEY = "__stats__:misses"
+_PROFILE_VERSION_PREFIX = "__profile_version__:"
+
+
+def hash_text(text):
+    """Retourne le hash SHA-256 (hex) d'un texte."""
+    return hashlib.sha256((text or "").encode('utf-8')).hexdigest()
+
+
+def normalize_text(text):
+    """Normalise un texte pour la clé de cache (Unicode NFC, espaces compactés)."""
+    if not isinstance(text, str):
+        return ""
+    return " ".join(unicodedata.normalize('NFC', text).split())
+
+
+def _message_text(content):
+    """Extrait le texte d'un contenu de message API (chaîne ou liste de blocs)."""
+    if isinstance(content, str):
+        return content
+    parts = []
+    for block in content or []:
+        if isinstance(block, dict):
+            if block.get("type") == "text":
+                parts.append(block.get("text", ""))
+            elif block.get("type") in ("image", "document"):
+                source = block.get("source", {})
+                if source.get("type") == "file":
+                    # Document joint par référence (API de fichiers)
+                    parts.append(f"[{block['type']}:{source.get('file_id')}]")
+                else:
+                    parts.append(f"[{block['type']}:{hash_text(str(source.get('data', '')))}]")
+    return "\n".join(parts)
+
+
+class ResponseCache:
+    """Cache des réponses de l'IA, partagé par toutes les sessions."""
+
+    def __init__(self, directory=RESPONSE_CACHE_DIR, ttl=DEFAULT_TTL_SECONDS, size_limit=DEFAULT_SIZE_LIMIT_BYTES):
+        self.ttl = ttl
+        self.directory = directory
+        self._profile_versions = {}  # Versions de profil déjà vérifiées par ce processus
+        self._lock = threading.Lock()
+        if diskcache is not None:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                self._cache = diskcache.Cache(directory, size_limit=size_limit,
+                                              eviction_policy='least-recently-used')
+                # Compteurs et versions de profil: jamais évincés (sinon compteurs remis à zéro et
+                # réponses d'une version de profil périmée servies à nouveau)
+                self._meta = diskcache.Cache(os.path.join(directory, 'meta'), eviction_policy='none')
+                self.backend = "disk"
+                print(f"Cache de réponses initialisé (disque): {directory}")
+                return
+            except Exception as e:
+                print(f"AVERTISSEMENT: Cache disque indisponible ({e}), repli en mémoire.")
+        self._cache = MemoryLRUCache(max_entries=MEMORY_CACHE_MAX_ENTRIES)
+        self._meta = MemoryLRUCache(max_entries=float('inf'))
+        self.backend = "memory"
+        print("Cache de réponses initialisé (mémoire).")
+
+    def make_key(self, model, profile_id, profile_content, messages, extra_context=None):
+        """Construit la clé: modèle, profil (id + hash du contenu), historique normalisé et question.
+
+        La question correspond au dernier message de la liste 'messages'. extra_context
+        (ex: résumé glissant de la conversation) fait aussi partie de la clé.
+        """
+        normalized_messages = [
+            [message.get("role"), normalize_text(_message_text(message.get("content")))]
+            for message in messages
+        ]
+        payload = json.dumps({
+            "model": model,
+            "profile_id": profile_id,
+            "profile_hash": hash_text(profile_content),
+            "messages": normalized_messages,
+            "extra_context": normalize_text(extra_context) if extra_context else None,
+        }, ensure_ascii=False, sort_keys=True)
+        return "resp:" + hash_text(payload)
+
+    def check_profile_version(self, profile_id, profile_content):
+        """Invalide les entrées d'un profil si son contenu (fichier) a changé depuis la dernière vérification."""
+        if profile_id is None:
+            return False
+        content_hash = hash_text(profile_content)
+        if self._profile_versions.get(profile_id) == content_hash:
+            return False
+        with self._lock:
+            version_key = _PROFILE_VERSION_PREFIX + profile_id
+            stored_hash = self._meta.get(version_key)
+            changed = stored_hash is not None and stored_hash != content_hash
+            if changed:
+                evicted = self._cache.evict(profile_id)
+                print(f"[CACHE RÉPONSES] Profil {profile_id} modifié: {evicted} entrée(s) invalidée(s).")
+            if stored_hash != content_hash:
+                self._meta.set(version_key, content_hash)
+            self._profile_versions[profile_id] = content_hash
+        return changed
+
+    def get(self, key):
+        """Retourne la réponse en cache ou None; met à jour les compteurs de hits/misses."""
+        try:
+            value = self._cache.get(key)
+            self._meta.incr(_STATS_HITS_KEY if value is not None else _STATS_MISSES_KEY)
+            return value
+        except Exception as e:
+            print(f"[CACHE RÉPONSES] Erreur de lecture: {e}")
+            return None
+
+    def set(self, key, response_text, profile_id=None, ttl=None):
+        """Enregistre une réponse; l'étiquette (tag) du profil permet l'invalidation ciblée."""
+        if not response_text:
+            return False
+        try:
+            return self._cache.set(key, response_text, expire=ttl or self.ttl, tag=profile_id)
+        except Exception as e:
+            print(f"[CACHE RÉPONSES] Erreur d'écriture: {e}")
+            return False
+
+    def invalidate_profile(self, profile_id):
+        """Supprime toutes les réponses en cache d'un profil."""
+        try:
+            return self._cache.evict(profile_id)
+        except Exception as e:
+            print(f"[CACHE RÉPONSES] Erreur d'invalidation du profil {profile_id}: {e}")
+            return 0
+
+    def clear(self):
+        """Vide entièrement le cache (compteurs inclus)."""
+        self._profile_versions.clear()
+        self._meta.clear()
+        return self._cache.clear()
+
+    def get_stats(self):
+        """Statistiques du cache: hits, misses, taux de succès, nombre d'entrées et taille."""
+        hits = self._meta.get(_STATS_HITS_KEY, 0) or 0
+        misses = self._meta.get(_STATS_MISSES_KEY, 0) or 0
+        total = hits + misses
+        try:
+            size_bytes = self._cache.volume()
+        except Exception:
+            size_bytes = 0
+        return {
+            "backend": self.backend,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / total if total else 0.0,
+            "entries": len(self._cache),
+            "size_bytes": size_bytes,
+        }
+
+
+_shared_response_cache = None
+_shared_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Retourne le cache de réponses partagé par le processus (créé au premier appel)."""
+    global _shared_response_cache
+    if _shared_response_cache is None:
+        with _shared_response_cache_lock:
+            if _shared_response_cache is None:
+                _shared_response_cache = ResponseCache()
+    return _shared_response_cache
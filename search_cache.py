@@ -0,0 +1,274 @@
+"""
+Cache des résultats de recherche web (/search) pour EXPERTS IA
+Table SQLite avec normalisation des requêtes (casse, accents, espaces),
+durée de vie adaptée au type de recherche (prix vs réglementation)
+et correspondance des quasi-doublons.
+"""
+
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from datetime import datetime
+
+# Définir le répertoire de données
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+SEARCH_CACHE_DB = os.path.join(DATA_DIR, 'search_cache.db')
+
+# Durées de vie selon la nature de la recherche
+TTL_PRICING_SECONDS = 2 * 24 * 3600      # Prix et coûts: changent vite
+TTL_REGULATION_SECONDS = 30 * 24 * 3600  # Codes, normes, règlements: stables
+TTL_DEFAULT_SECONDS = 7 * 24 * 3600
+
+PRICING_KEYWORDS = {
+    'prix', 'cout', 'couts', 'tarif', 'tarifs', 'taux', 'soumission', 'estimation',
+    'budget', 'facture', 'prime', 'salaire', 'cher', 'coute', 'coutent', '$',
+}
+REGULATION_KEYWORDS = {
+    'code', 'norme', 'normes', 'reglement', 'reglements', 'reglementation', 'loi',
+    'rbq', 'ccq', 'csa', 'cnb', 'cnrc', 'permis', 'zonage', 'exigence', 'exigences',
+    'conformite', 'cmeq', 'cmmtq', 'article',
+}
+STOPWORDS = {
+    'le', 'la', 'les', 'l', 'de', 'des', 'du', 'd', 'un', 'une', 'et', 'ou', 'en',
+    'au', 'aux', 'a', 'pour', 'par', 'sur', 'dans', 'avec', 'quel', 'quelle',
+    'quels', 'quelles', 'est', 'sont', 'the', 'of', 'for', 'in', 'on', 'what',
+}
+
+NEAR_DUPLICATE_THRESHOLD = 0.8  # Similarité de Jaccard minimale entre ensembles de mots
+NEAR_DUPLICATE_SCAN_LIMIT = 500  # Nombre max d'entrées récentes comparées
+
+
+def normalize_query(query):
+    """Normalise une requête: minuscules, sans accents, ponctuation et espaces compactés."""
+    if not query:
+        return ""
+    text = unicodedata.normalize('NFKD', query.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    # Conserver les opérateurs utiles (site:, $) et les chiffres
+    text = re.sub(r"[^a-z0-9$:./\-]+", " ", text)
+    return " ".join(text.split())
+
+
+def query_tokens(normalized_query):
+    """Ensemble des mots significatifs d'une requête normalisée."""
+    return {t for t in normalized_query.split() if t not in STOPWORDS}
+
+
+def numeric_tokens(tokens):
+    """Mots contenant un chiffre (dimensions 2x4, années, quantités): doivent être identiques entre quasi-doublons."""
+    return {t for t in tokens if any(c.isdigit() for c in t)}
+
+
+def classify_query(normalized_query):
+    """Retourne la catégorie de la requête ('prix', 'reglementation' ou 'general')."""
+    tokens = set(normalized_query.split())
+    if '$' in normalized_query or tokens & PRICING_KEYWORDS:
+        return 'prix'
+    if tokens & REGULATION_KEYWORDS:
+        return 'reglementation'
+    return 'general'
+
+
+def ttl_for_category(category):
+    return {
+        'prix': TTL_PRICING_SECONDS,
+        'reglementation': TTL_REGULATION_SECONDS,
+    }.get(category, TTL_DEFAULT_SECONDS)
+
+
+class SearchCache:
+    """Cache SQLite des résultats de recherche web, avec statistiques de hits et de latence économisée."""
+
+    def __init__(self, db_path=SEARCH_CACHE_DB):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        self._create_tables()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _create_tables(self):
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS search_cache (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        normalized_query TEXT NOT NULL UNIQUE,
+                        token_key TEXT NOT NULL,
+                        query TEXT NOT NULL,
+                        results TEXT NOT NULL,
+                        expert_profile TEXT,
+                        category TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        expires_at REAL NOT NULL,
+                        latency_s REAL DEFAULT 0,
+                        hit_count INTEGER DEFAULT 0,
+                        last_hit_at REAL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_token_key ON search_cache(token_key)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_expires ON search_cache(expires_at)")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS search_cache_stats (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        hits INTEGER DEFAULT 0,
+                        near_hits INTEGER DEFAULT 0,
+                        misses INTEGER DEFAULT 0,
+                        saved_seconds REAL DEFAULT 0
+                    )
+                """)
+                conn.execute("INSERT OR IGNORE INTO search_cache_stats (id) VALUES (1)")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Erreur lors de la création des tables du cache de recherche: {e}")
+
+    def _record_hit(self, conn, row, near=False):
+        now = time.time()
+        conn.execute("UPDATE search_cache SET hit_count = hit_count + 1, last_hit_at = ? WHERE id = ?",
+                     (now, row['id']))
+        conn.execute(f"""
+            UPDATE search_cache_stats
+            SET hits = hits + 1, {'near_hits = near_hits + 1,' if near else ''}
+                saved_seconds = saved_seconds + ?
+            WHERE id = 1
+        """, (row['latency_s'] or 0,))
+
+    def get_cached_search(self, query):
+        """Retourne le résultat en cache pour la requête (exacte ou quasi-identique), sinon None."""
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                # 1. Correspondance exacte sur la requête normalisée
+                row = conn.execute(
+                    "SELECT * FROM search_cache WHERE normalized_query = ? AND expires_at > ?",
+                    (normalized, now)
+                ).fetchone()
+
+                # 2. Mêmes mots significatifs (ordre différent, mots vides)
+                tokens = query_tokens(normalized)
+                token_key = " ".join(sorted(tokens))
+                near = False
+                if row is None and token_key:
+                    row = conn.execute(
+                        "SELECT * FROM search_cache WHERE token_key = ? AND expires_at > ? ORDER BY created_at DESC LIMIT 1",
+                        (token_key, now)
+                    ).fetchone()
+                    near = row is not None
+
+                # 3. Quasi-doublon: similarité de Jaccard sur les entrées récentes, mêmes nombres et dimensions
+                #    ('prix 2x4' ne doit pas servir 'prix 2x6', ni 'code 2015' servir 'code 2020')
+                if row is None and tokens:
+                    numbers = numeric_tokens(tokens)
+                    best_row, best_score = None, 0.0
+                    candidates = conn.execute(
+                        "SELECT * FROM search_cache WHERE expires_at > ? ORDER BY created_at DESC LIMIT ?",
+                        (now, NEAR_DUPLICATE_SCAN_LIMIT)
+                    ).fetchall()
+                    for candidate in candidates:
+                        candidate_tokens = set(candidate['token_key'].split())
+                        if numeric_tokens(candidate_tokens) != numbers:
+                            continue
+                        union = tokens | candidate_tokens
+                        score = len(tokens & candidate_tokens) / len(union) if union else 0.0
+                        if score > best_score:
+                            best_row, best_score = candidate, score
+                    if best_score >= NEAR_DUPLICATE_THRESHOLD:
+                        row, near = best_row, True
+
+                if row is None:
+                    conn.execute("UPDATE search_cache_stats SET misses = misses + 1 WHERE id = 1")
+                    return None
+
+                self._record_hit(conn, row, near=near)
+                print(f"[CACHE RECHERCHE] {'Quasi-doublon' if near else 'Hit'} pour '{query}' (entrée: '{row['query']}')")
+                return row['results']
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la lecture du cache de recherche: {e}")
+            return None
+
+    def cache_search_result(self, query, results, expert_profile=None, latency_s=0.0):
+        """Enregistre (ou remplace) le résultat d'une recherche avec une durée de vie selon sa catégorie."""
+        normalized = normalize_query(query)
+        if not normalized or not results:
+            return False
+        category = classify_query(normalized)
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("""
+                    INSERT INTO search_cache (normalized_query, token_key, query, results, expert_profile,
+                                              category, created_at, expires_at, latency_s)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(normalized_query) DO UPDATE SET
+                        query = excluded.query, results = excluded.results,
+                        expert_profile = excluded.expert_profile, category = excluded.category,
+                        created_at = excluded.created_at, expires_at = excluded.expires_at,
+                        latency_s = excluded.latency_s
+                """, (normalized, " ".join(sorted(query_tokens(normalized))), query, results, expert_profile,
+                      category, now, now + ttl_for_category(category), latency_s or 0.0))
+                return True
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la mise en cache de la recherche: {e}")
+            return False
+
+    def purge_expired(self):
+        """Supprime les entrées expirées. Retourne le nombre d'entrées supprimées."""
+        try:
+            conn = self._connect()
+            try:
+                return conn.execute("DELETE FROM search_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la purge du cache de recherche: {e}")
+            return 0
+
+    def get_stats(self):
+        """Statistiques pour la vue admin: taux de succès, latence économisée, entrées par catégorie."""
+        stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'hit_rate': 0.0, 'saved_seconds': 0.0,
+                 'entries': 0, 'expired_entries': 0, 'by_category': {}, 'top_queries': []}
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT * FROM search_cache_stats WHERE id = 1").fetchone()
+                if row:
+                    stats.update(hits=row['hits'], near_hits=row['near_hits'], misses=row['misses'],
+                                 saved_seconds=row['saved_seconds'] or 0.0)
+                total = stats['hits'] + stats['misses']
+                stats['hit_rate'] = stats['hits'] / total if total else 0.0
+                now = time.time()
+                stats['entries'] = conn.execute("SELECT COUNT(*) FROM search_cache WHERE expires_at > ?", (now,)).fetchone()[0]
+                stats['expired_entries'] = conn.execute("SELECT COUNT(*) FROM search_cache WHERE expires_at <= ?", (now,)).fetchone()[0]
+                stats['by_category'] = {
+                    r['category']: r['n'] for r in conn.execute(
+                        "SELECT category, COUNT(*) AS n FROM search_cache WHERE expires_at > ? GROUP BY category", (now,))
+                }
+                stats['top_queries'] = [
+                    {'query': r['query'], 'hit_count': r['hit_count'], 'category': r['category'],
+                     'expires_at': datetime.fromtimestamp(r['expires_at']).strftime('%Y-%m-%d %H:%M')}
+                    for r in conn.execute(
+                        "SELECT query, hit_count, category, expires_at FROM search_cache WHERE expires_at > ? "
+                        "ORDER BY hit_count DESC, created_at DESC LIMIT 5", (now,))
+                ]
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Erreur SQLite lors de la lecture des statistiques du cache de recherche: {e}")
+        return stats
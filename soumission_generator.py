@@ -7,22 +7,29 @@ Extrait les données d'estimation depuis les conversations et remplit template.h
 import json
 import os
 from datetime import datetime
-from anthropic import Anthropic
+from anthropic_client import get_shared_client
 from entreprise_config import get_entreprise_config, get_commercial_params
+from rate_limiter import get_admission_controller, PRIORITY_BATCH
+from response_cache import get_response_cache
+
+# Étiquette du cache de réponses pour les extractions (invalidation ciblée)
+EXTRACTION_CACHE_TAG = "__extraction_soumission__"
 
 
 class SoumissionGenerator:
     """Gère l'extraction de données et la génération de soumissions clients."""
 
-    def __init__(self, anthropic_client):
+    def __init__(self, anthropic_client=None, api_key=None):
         """
         Initialise le générateur de soumissions.
 
         Args:
-            anthropic_client: Instance de Anthropic API client
+            anthropic_client: Instance de Anthropic API client (optionnel)
+            api_key: Clé API utilisée pour obtenir le client partagé si aucun client n'est fourni
         """
-        self.anthropic = anthropic_client
+        self.anthropic = anthropic_client if anthropic_client is not None else get_shared_client(api_key)
         self.model = "claude-sonnet-4-5-20250929"
+        self.response_cache = get_response_cache()
 
     def extract_estimation_data(self, conversation_messages):
         """
@@ -582,22 +589,10 @@ Note: Virgule APRÈS le premier objet, PAS de virgule après le deuxième (derni
 """
 
         try:
-            print("[EXTRACTION] Appel API Claude pour extraction...")
-
-            response = self.anthropic.messages.create(
-                model=self.model,
-                max_tokens=8000,  # Augmenté pour capturer plus de détails
-                temperature=0.0,  # Température à 0 pour extraction fidèle et déterministe
-                messages=[
-                    {
-                        "role": "user",
-                        "content": extraction_prompt
-                    }
-                ]
-            )
-
-            if response.content and len(response.content) > 0:
-                json_text = response.content[0].text.strip()
+            raw_text, cache_key = self._request_extraction_text(extraction_prompt)
+
+            if raw_text:
+                json_text = raw_text.strip()
 
                 # Nettoyer le JSON si nécessaire (enlever markdown)
                 if json_text.startswith("```json"):
@@ -644,6 +639,9 @@ Note: Virgule APRÈS le premier objet, PAS de virgule après le deuxième (derni
                         # Relancer l'erreur originale
                         raise e
 
+                # Mettre en cache uniquement une extraction valide (température 0: résultat reproductible)
+                self.response_cache.set(cache_key, raw_text, profile_id=EXTRACTION_CACHE_TAG)
+
                 # Ajouter numéro et date si manquants
                 if not data.get("numero_soumission") or data["numero_soumission"] == "2025-XXX":
                     data["numero_soumission"] = self._generate_soumission_number()
@@ -671,6 +669,42 @@ Note: Virgule APRÈS le premier objet, PAS de virgule après le deuxième (derni
             print(f"[EXTRACTION] ❌ Erreur: {str(e)}")
             raise Exception(f"Erreur lors de l'extraction: {str(e)}")
 
+    def _request_extraction_text(self, extraction_prompt):
+        """
+        Retourne le texte brut d'extraction, depuis le cache de réponses si la même
+        conversation a déjà été extraite, sinon via l'API Claude.
+
+        Returns:
+            tuple: (texte brut ou None, clé de cache)
+        """
+        messages = [
+            {
+                "role": "user",
+                "content": extraction_prompt
+            }
+        ]
+        cache_key = self.response_cache.make_key(self.model, EXTRACTION_CACHE_TAG, "", messages)
+        cached_text = self.response_cache.get(cache_key)
+        if cached_text:
+            print("[EXTRACTION] ✅ Extraction servie depuis le cache de réponses")
+            return cached_text, cache_key
+
+        print("[EXTRACTION] Appel API Claude pour extraction...")
+
+        # Extraction en lot: passe après les appels interactifs dans la file partagée
+        response = get_admission_controller().create_message(
+            self.anthropic,
+            priority=PRIORITY_BATCH,
+            model=self.model,
+            max_tokens=8000,  # Augmenté pour capturer plus de détails
+            temperature=0.0,  # Température à 0 pour extraction fidèle et déterministe
+            messages=messages
+        )
+
+        if response.content and len(response.content) > 0:
+            return response.content[0].text, cache_key
+        return None, cache_key
+
     def _format_conversation_for_extraction(self, messages):
         """Formate les messages pour l'extraction."""
         formatted = []
@@ -0,0 +1,171 @@
+"""
+Lecture en flux des tableurs pour EXPERTS IA
+XLSX (openpyxl en lecture seule, valeurs seulement), XLS (xlrd à la demande)
+et CSV lus ligne par ligne: toutes les feuilles, plafonds de lignes et de
+colonnes avec avis de troncature, lignes et colonnes entièrement vides
+retirées, sortie compacte (séparateur tabulation) écrite en une seule passe.
+"""
+
+import io
+import os
+import csv
+import datetime
+
+from upload_buffer import read_buffer
+
+SPREADSHEET_MAX_ROWS = int(os.getenv('SPREADSHEET_MAX_ROWS', '20000'))     # Par feuille
+SPREADSHEET_MAX_COLUMNS = int(os.getenv('SPREADSHEET_MAX_COLUMNS', '60'))
+SPREADSHEET_MAX_SHEETS = int(os.getenv('SPREADSHEET_MAX_SHEETS', '20'))
+OUTPUT_DELIMITER = '\t'  # Moins de guillemets qu'avec la virgule (décimales à la française, adresses)
+
+
+def format_cell(value):
+    """Valeur de cellule en texte compact ("" si vide; 12.0 -> "12"; dates sans heure nulle)."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat() if value.time() == datetime.time(0) else value.isoformat(sep=' ')
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value).strip()
+
+
+class SheetWriter:
+    """
+    Accumule les lignes non vides d'une feuille (dans la limite du plafond) en notant les colonnes
+    utilisées, puis les écrit sans les colonnes entièrement vides.
+    """
+
+    def __init__(self, name, max_rows=SPREADSHEET_MAX_ROWS, max_columns=SPREADSHEET_MAX_COLUMNS):
+        self.name = name
+        self.max_rows = max_rows
+        self.max_columns = max_columns
+        self.rows = []
+        self.used_columns = set()
+        self.truncated_columns = False
+        self.truncated = False
+
+    def add_row(self, values):
+        """Ajoute une ligne de valeurs brutes. Retourne False quand le plafond de lignes est atteint."""
+        if len(self.rows) >= self.max_rows:
+            self.truncated = True
+            return False
+        if len(values) > self.max_columns:
+            if any(value not in (None, "") for value in values[self.max_columns:]):
+                self.truncated_columns = True
+            values = values[:self.max_columns]
+        cells = [format_cell(value) for value in values]
+        used = [index for index, cell in enumerate(cells) if cell]
+        if used:
+            self.rows.append(cells)
+            self.used_columns.update(used)
+        return True
+
+    def write(self, output, declared_rows=None):
+        """Écrit l'en-tête de la feuille, ses lignes (colonnes utilisées seulement) et les avis de troncature."""
+        columns = sorted(self.used_columns)
+        output.write(f"### Feuille: {self.name} ({len(self.rows)} lignes x {len(columns)} colonnes)\n")
+        writer = csv.writer(output, delimiter=OUTPUT_DELIMITER, lineterminator='\n')
+        for cells in self.rows:
+            writer.writerow([cells[index] if index < len(cells) else "" for index in columns])
+        if self.truncated:
+            declared = f" sur environ {declared_rows}" if declared_rows else ""
+            output.write(f"[... feuille tronquée: {self.max_rows} lignes lues{declared} (limite SPREADSHEET_MAX_ROWS)]\n")
+        if self.truncated_columns:
+            output.write(f"[... colonnes au-delà de la {self.max_columns}e non incluses]\n")
+        output.write("\n")
+
+
+def _write_sheets(sheets, output, max_sheets=SPREADSHEET_MAX_SHEETS):
+    """
+    Écrit chaque feuille fournie par l'itérateur 'sheets' de tuples (nom, lignes, lignes déclarées).
+
+    Returns:
+        int: Nombre de feuilles écrites
+    """
+    written = 0
+    for name, rows, declared_rows in sheets:
+        if written >= max_sheets:
+            output.write(f"[... feuilles suivantes non incluses (limite de {max_sheets} feuilles)]\n")
+            break
+        sheet = SheetWriter(name)
+        for values in rows:
+            if not sheet.add_row(values):
+                break
+        sheet.write(output, declared_rows)
+        written += 1
+    return written
+
+
+def _iter_xlsx_sheets(file_stream, max_columns):
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_stream, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            # +1 colonne pour détecter les données coupées par le plafond
+            yield (worksheet.title, worksheet.iter_rows(values_only=True, max_col=max_columns + 1),
+                   worksheet.max_row)
+    finally:
+        workbook.close()  # Le mode lecture seule garde le fichier ouvert
+
+
+def _iter_xls_sheets(file_bytes, max_columns):
+    import xlrd
+    workbook = xlrd.open_workbook(file_contents=file_bytes, on_demand=True)
+    try:
+        for sheet_index in range(workbook.nsheets):
+            sheet = workbook.sheet_by_index(sheet_index)
+            rows = (sheet.row_values(row_index, 0, max_columns + 1) for row_index in range(sheet.nrows))
+            yield sheet.name, rows, sheet.nrows
+            workbook.unload_sheet(sheet_index)
+    finally:
+        workbook.release_resources()
+
+
+def _decode_csv(raw_bytes, filename):
+    try:
+        return str(raw_bytes, 'utf-8-sig')
+    except UnicodeDecodeError:
+        print(f"Décodage UTF-8 échoué pour {filename}, essai avec Latin-1.")
+        return str(raw_bytes, 'latin1')
+
+
+def read_spreadsheet_streaming(file_stream, filename, file_ext, max_columns=SPREADSHEET_MAX_COLUMNS):
+    """
+    Lit un tableur (.xlsx, .xls, .csv) en flux et retourne un texte compact, une section par feuille.
+
+    Returns:
+        str: Texte ou message d'erreur
+    """
+    output = io.StringIO()
+    file_stream.seek(0)
+    if file_ext == '.csv':
+        try:
+            decoded_content = _decode_csv(read_buffer(file_stream), filename)
+        except Exception as de:
+            return f"Erreur de décodage pour {filename}: {str(de)}"
+        sheets = iter([(os.path.splitext(filename)[0], csv.reader(io.StringIO(decoded_content)), None)])
+        _write_sheets(sheets, output)
+        return output.getvalue()
+
+    if file_ext == '.xlsx':
+        try:
+            _write_sheets(_iter_xlsx_sheets(file_stream, max_columns), output)
+        except ImportError:
+            return "INFO: La bibliothèque 'openpyxl' est requise pour lire les fichiers .xlsx. Veuillez l'installer."
+        except Exception as e_xlsx:
+            return f"Erreur lors de la lecture du XLSX {filename}: {str(e_xlsx)}"
+        return output.getvalue()
+
+    if file_ext == '.xls':
+        try:
+            _write_sheets(_iter_xls_sheets(file_stream.read(), max_columns), output)
+        except ImportError:
+            return "INFO: La bibliothèque 'xlrd' est requise pour lire les fichiers .xls. Veuillez l'installer."
+        except Exception as e_xls:
+            return f"Erreur lors de la lecture du XLS {filename}: {str(e_xls)}"
+        return output.getvalue()
+
+    return f"Format de tableur non géré: {filename}"
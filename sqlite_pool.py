@@ -0,0 +1,167 @@
+"""
+Pool de connexions SQLite pour EXPERTS IA
+Connexions réutilisées entre les sessions Streamlit (une base = un pool partagé
+par le processus), en mode WAL (les lectures ne bloquent plus les écritures),
+avec délai d'attente sur verrou, cache de pages et cache de requêtes préparées
+par connexion. Mesure la latence par opération, l'attente d'une connexion
+libre et l'attente du verrou d'écriture.
+"""
+
+import os
+import time
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', '8'))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '16384'))   # Cache de pages par connexion
+SQLITE_STATEMENT_CACHE = 128                                            # Requêtes préparées gardées par connexion
+SQLITE_POOL_WAIT_TIMEOUT_S = 30.0
+
+
+class SQLitePool:
+    """Connexions partagées vers une base SQLite, prêtées à un thread le temps d'une opération."""
+
+    def __init__(self, db_path, max_connections=SQLITE_POOL_SIZE, busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS):
+        self.db_path = db_path
+        self.max_connections = max(1, max_connections)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle = queue.LifoQueue()  # La connexion la plus récente a son cache de pages le plus chaud
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()  # Connexion déjà prêtée au thread (opérations imbriquées)
+        self.stats = {"connections_created": 0, "checkouts": 0, "pool_wait_s": 0.0, "pool_wait_max_s": 0.0,
+                      "lock_wait_s": 0.0, "lock_wait_max_s": 0.0, "locked_errors": 0, "operations": {}}
+
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                               timeout=self.busy_timeout_ms / 1000, cached_statements=SQLITE_STATEMENT_CACHE)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # Sûr en WAL: seule la dernière transaction peut être perdue
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size=-{int(SQLITE_CACHE_SIZE_KB)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.max_connections
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            with self._lock:
+                self.stats["connections_created"] += 1
+            return conn
+        try:
+            return self._idle.get(timeout=SQLITE_POOL_WAIT_TIMEOUT_S)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"Aucune connexion libre vers {self.db_path} après {SQLITE_POOL_WAIT_TIMEOUT_S:.0f}s")
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            try:
+                conn.execute("ROLLBACK")  # Transaction laissée ouverte par une erreur
+            except sqlite3.Error:
+                pass
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self, operation="autre"):
+        """Prête une connexion au thread pour la durée du bloc et mesure l'opération."""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            yield held  # Opération imbriquée dans le même thread: même connexion
+            return
+        wait_start = time.perf_counter()
+        conn = self._checkout()
+        started_at = time.perf_counter()
+        self._local.conn = conn
+        failed = False
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            failed = True
+            if 'locked' in str(e) or 'busy' in str(e):
+                with self._lock:
+                    self.stats["locked_errors"] += 1
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._local.conn = None
+            self._release(conn)
+            self._record(operation, started_at - wait_start, time.perf_counter() - started_at, failed)
+
+    def begin_immediate(self, cursor):
+        """Ouvre une transaction d'écriture en mesurant l'attente du verrou (autres écrivains)."""
+        wait_start = time.perf_counter()
+        cursor.execute("BEGIN IMMEDIATE")
+        waited_s = time.perf_counter() - wait_start
+        with self._lock:
+            self.stats["lock_wait_s"] += waited_s
+            self.stats["lock_wait_max_s"] = max(self.stats["lock_wait_max_s"], waited_s)
+
+    def _record(self, operation, pool_wait_s, elapsed_s, failed):
+        with self._lock:
+            self.stats["checkouts"] += 1
+            self.stats["pool_wait_s"] += pool_wait_s
+            self.stats["pool_wait_max_s"] = max(self.stats["pool_wait_max_s"], pool_wait_s)
+            op_stats = self.stats["operations"].setdefault(
+                operation, {"count": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0})
+            op_stats["count"] += 1
+            op_stats["errors"] += int(failed)
+            op_stats["total_s"] += elapsed_s
+            op_stats["max_s"] = max(op_stats["max_s"], elapsed_s)
+
+    def get_stats(self):
+        """Compteurs du pool et latence par opération (moyenne et maximum en millisecondes)."""
+        with self._lock:
+            stats = {key: value for key, value in self.stats.items() if key != "operations"}
+            stats["operations"] = {
+                name: {"count": op["count"], "errors": op["errors"],
+                       "avg_ms": op["total_s"] / op["count"] * 1000 if op["count"] else 0.0,
+                       "max_ms": op["max_s"] * 1000}
+                for name, op in self.stats["operations"].items()}
+            stats.update(db_path=self.db_path, open_connections=self._created, idle_connections=self._idle.qsize())
+            return stats
+
+    def close(self):
+        """Ferme les connexions inactives (arrêt de l'application)."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def get_sqlite_pool(db_path):
+    """Retourne le pool partagé par le processus pour cette base (créé au premier appel)."""
+    key = os.path.abspath(db_path)
+    pool = _shared_pools.get(key)
+    if pool is None:
+        with _shared_pools_lock:
+            pool = _shared_pools.get(key)
+            if pool is None:
+                pool = _shared_pools[key] = SQLitePool(db_path)
+    return pool
@@ -27,15 +27,19 @@ class TakeoffExpertAdvisor:
             if 'expert_advisor' in st.session_state:
                 self.expert_advisor = st.session_state.expert_advisor
             else:
-                # Créer une nouvelle instance si API key disponible
-                api_key = st.session_state.get('anthropic_api_key')
+                # Créer une nouvelle instance si API key disponible (client Anthropic partagé)
+                api_key = st.session_state.get('user_api_key') or st.session_state.get('anthropic_api_key')
                 if api_key:
                     self.expert_advisor = ExpertAdvisor(api_key)
                     st.session_state.expert_advisor = self.expert_advisor
 
-            # Charger le gestionnaire de profils
+            # Gestionnaire de profils: celui de la session, sinon celui de l'ExpertAdvisor
+            # (tous deux adossés au registre de profils partagé par le processus)
             if 'profile_manager' in st.session_state:
                 self.profile_manager = st.session_state.profile_manager
+            elif self.expert_advisor is not None:
+                self.profile_manager = self.expert_advisor.profile_manager
+                st.session_state.profile_manager = self.profile_manager
             else:
                 self.profile_manager = ExpertProfileManager()
                 st.session_state.profile_manager = self.profile_manager
@@ -55,9 +59,8 @@ class TakeoffExpertAdvisor:
             return []
 
         try:
-            profiles = self.profile_manager.get_all_profiles()
-            # Retourner les noms de profils triés
-            return sorted([prof['name'] for prof in profiles.values()])
+            # Noms déjà triés par le registre (sans charger le contenu des profils)
+            return self.profile_manager.get_profile_names()
         except:
             return []
 
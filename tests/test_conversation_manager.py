@@ -0,0 +1,80 @@
+"""Stockage des conversations (un message par ligne, en ajout seulement) sur une base SQLite temporaire."""
+
+import json
+import sqlite3
+
+import pytest
+
+from conversation_manager import ConversationManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return ConversationManager(db_path=str(tmp_path / "conversations.db"))
+
+
+def _messages(count):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(count)]
+
+
+def test_append_only_save_round_trip(manager):
+    messages = _messages(3)
+    conversation_id = manager.save_conversation(None, messages)
+    messages += _messages(5)[3:]
+    assert manager.save_conversation(conversation_id, messages) == conversation_id
+    assert manager.load_conversation(conversation_id) == messages
+
+
+@pytest.mark.parametrize("change", ["edit_earlier", "truncate_and_append"])
+def test_diverged_history_is_rewritten(manager, change):
+    messages = _messages(6)
+    conversation_id = manager.save_conversation(None, messages)
+    if change == "edit_earlier":
+        # Seul un message antérieur au dernier change: l'ancienne vérification ne le voyait pas
+        messages[1] = {"role": "assistant", "content": "réponse corrigée"}
+        messages.append({"role": "user", "content": "suite"})
+    else:
+        messages = messages[:2] + [{"role": "user", "content": f"nouveau {i}"} for i in range(4)] + [messages[5]]
+    manager.save_conversation(conversation_id, messages)
+    assert manager.load_conversation(conversation_id) == messages
+
+
+def _create_legacy_database(db_path, conversations):
+    """Base à l'ancien format: toute la conversation en liste JSON dans la colonne 'messages'."""
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE conversations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            last_updated_at TEXT NOT NULL,
+            messages TEXT NOT NULL
+        )
+    """)
+    conn.executemany("INSERT INTO conversations (name, created_at, last_updated_at, messages) VALUES (?, ?, ?, ?)",
+                     [(name, "2024-01-01T10:00:00", "2024-01-02T10:00:00", payload) for name, payload in conversations])
+    conn.commit()
+    conn.close()
+
+
+def test_legacy_messages_are_migrated(tmp_path):
+    db_path = str(tmp_path / "ancien.db")
+    legacy = _messages(4) + [{"role": "assistant", "content": "Prévoir un linteau", "id": "m-4"}]
+    _create_legacy_database(db_path, [("Ancienne", json.dumps(legacy)), ("Corrompue", "[{pas du json")])
+
+    manager = ConversationManager(db_path=db_path)
+    assert manager.load_conversation(1) == legacy
+    assert manager.load_conversation(1, tail=2) == legacy[-2:]
+    conn = sqlite3.connect(db_path)
+    rows = dict(conn.execute("SELECT id, messages FROM conversations").fetchall())
+    message_count = conn.execute("SELECT message_count FROM conversations WHERE id = 1").fetchone()[0]
+    conn.close()
+    assert rows[1] == ""  # Vidée une fois migrée: pas de nouvelle migration au prochain démarrage
+    assert rows[2] == "[{pas du json"  # Illisible: laissée telle quelle
+    assert message_count == len(legacy)
+    assert [result["id"] for result in manager.search_conversations("linteau")["results"]] == [1]
+
+    # Après migration, les sauvegardes ajoutent seulement les nouveaux messages
+    legacy.append({"role": "user", "content": "Et pour 3 mètres ?"})
+    manager.save_conversation(1, legacy)
+    assert ConversationManager(db_path=db_path).load_conversation(1) == legacy
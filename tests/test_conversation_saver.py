@@ -0,0 +1,176 @@
+"""Sauvegarde différée des conversations: regroupement, vidage, abandon avant suppression et arrêt."""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from conversation_manager import ConversationManager
+from conversation_saver import WriteBehindSaver
+
+
+class RecordingManager(ConversationManager):
+    """Gestionnaire réel qui compte les écritures et peut échouer sur verrou pour les premières."""
+
+    def __init__(self, db_path):
+        super().__init__(db_path=db_path)
+        self.saves = []
+        self.locked_failures = 0
+
+    def save_conversation(self, conversation_id, messages, name=None, raise_errors=False, create_missing=True):
+        if conversation_id is not None and self.locked_failures:
+            self.locked_failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        self.saves.append((conversation_id, len(messages)))
+        return super().save_conversation(conversation_id, messages, name=name, raise_errors=raise_errors,
+                                         create_missing=create_missing)
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return RecordingManager(str(tmp_path / "differe.db"))
+
+
+@pytest.fixture
+def saver(manager):
+    saver = WriteBehindSaver(manager, delay_s=30.0, max_delay_s=60.0)  # Écrit seulement sur flush/arrêt
+    yield saver
+    saver.shutdown(timeout=5)
+
+
+def _messages(count):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(count)]
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition jamais atteinte"
+        time.sleep(0.01)
+
+
+def test_new_conversation_written_immediately(manager, saver):
+    conversation_id = saver.save(None, _messages(1))
+    assert conversation_id is not None
+    assert manager.load_conversation(conversation_id) == _messages(1)
+    assert saver.get_stats()["pending"] == 0
+
+
+def test_rapid_saves_coalesced_into_one_write(manager, saver):
+    conversation_id = saver.save(None, _messages(1))
+    messages = _messages(1)
+    for count in range(2, 7):
+        messages = _messages(count)
+        saver.save(conversation_id, messages)
+    messages.append({"role": "user", "content": "modifié après dépôt"})  # L'état déposé est une copie
+
+    assert manager.load_conversation(conversation_id) == _messages(1)  # Pas encore écrit
+    assert saver.load_conversation(conversation_id) == _messages(6)    # Relecture avant écriture
+    assert saver.flush(timeout=5)
+    assert manager.saves == [(None, 1), (conversation_id, 6)]
+    assert manager.load_conversation(conversation_id) == _messages(6)
+    stats = saver.get_stats()
+    assert stats["enqueued"] == 5 and stats["coalesced"] == 4 and stats["writes"] == 1
+    assert stats["pending"] == 0
+    assert saver.pending_messages(conversation_id) is None
+
+
+def test_written_after_delay_without_flush(manager):
+    saver = WriteBehindSaver(manager, delay_s=0.05, max_delay_s=0.2)
+    try:
+        conversation_id = saver.save(None, _messages(1))
+        saver.save(conversation_id, _messages(3))
+        _wait_until(lambda: saver.get_stats()["writes"] == 1)
+        assert manager.load_conversation(conversation_id) == _messages(3)
+    finally:
+        saver.shutdown(timeout=5)
+
+
+def test_discard_prevents_write_after_delete(manager, saver):
+    conversation_id = saver.save(None, _messages(1))
+    saver.save(conversation_id, _messages(4))
+    saver.discard(conversation_id)
+    assert manager.delete_conversation(conversation_id)
+    assert saver.flush(timeout=5)
+    assert manager.saves == [(None, 1)]
+    assert manager.load_conversation(conversation_id) == []  # Pas recréée par une écriture tardive
+
+
+def test_locked_database_retried(manager):
+    saver = WriteBehindSaver(manager, delay_s=0.02, max_delay_s=0.1)  # Nouvel essai après le délai de regroupement
+    try:
+        conversation_id = saver.save(None, _messages(1))
+        manager.locked_failures = 2
+        saver.save(conversation_id, _messages(2))
+        _wait_until(lambda: saver.get_stats()["writes"] == 1)
+        assert manager.load_conversation(conversation_id) == _messages(2)
+        stats = saver.get_stats()
+        assert stats["failures"] == 2 and stats["dropped"] == 0 and stats["pending"] == 0
+    finally:
+        saver.shutdown(timeout=5)
+
+
+def test_shutdown_flushes_then_saves_synchronously(manager):
+    saver = WriteBehindSaver(manager, delay_s=30.0, max_delay_s=60.0)
+    conversation_id = saver.save(None, _messages(1))
+    saver.save(conversation_id, _messages(2))
+    assert saver.shutdown(timeout=5)
+    assert manager.load_conversation(conversation_id) == _messages(2)
+    assert not saver._thread.is_alive()
+    saver.save(conversation_id, _messages(3))  # File fermée: écriture directe
+    assert manager.load_conversation(conversation_id) == _messages(3)
+
+
+def test_deleted_conversation_not_recreated(manager, saver):
+    conversation_id = saver.save(None, _messages(1))
+    assert manager.delete_conversation(conversation_id)  # Supprimée par une autre session
+    for count in range(2, 5):
+        saver.save(conversation_id, _messages(count))
+        assert saver.flush(timeout=5)
+    assert manager.list_conversations() == []
+    stats = saver.get_stats()
+    assert stats["missing"] == 3 and stats["writes"] == 0
+
+
+def test_update_only_save_reports_missing_id(manager):
+    assert manager.save_conversation(42, _messages(2), create_missing=False) is None
+    assert manager.list_conversations() == []
+    assert manager.save_conversation(42, _messages(2)) is not None  # Mode par défaut: création
+
+
+def test_discard_during_failing_write_is_not_retried(tmp_path):
+    class BlockingManager(RecordingManager):
+        """Première écriture différée bloquée jusqu'au signal, puis en échec sur verrou."""
+
+        def __init__(self, db_path):
+            super().__init__(db_path)
+            self.writing, self.release = threading.Event(), threading.Event()
+
+        def save_conversation(self, conversation_id, messages, **kwargs):
+            if conversation_id is not None and not self.release.is_set():
+                self.writing.set()
+                self.release.wait(5)
+                self.saves.append((conversation_id, len(messages)))
+                raise sqlite3.OperationalError("database is locked")
+            return super().save_conversation(conversation_id, messages, **kwargs)
+
+    manager = BlockingManager(str(tmp_path / "abandon.db"))
+    saver = WriteBehindSaver(manager, delay_s=0.01, max_delay_s=0.05)
+    try:
+        conversation_id = saver.save(None, _messages(1))
+        saver.save(conversation_id, _messages(2))
+        assert manager.writing.wait(5)
+        discarding = threading.Thread(target=saver.discard, args=(conversation_id,))
+        discarding.start()
+        time.sleep(0.05)  # discard() attend l'écriture en cours
+        manager.release.set()
+        discarding.join(5)
+        assert not discarding.is_alive()
+        assert manager.delete_conversation(conversation_id)
+        time.sleep(0.1)  # Au-delà du délai de nouvel essai
+        assert saver.flush(timeout=5)
+        assert manager.saves == [(None, 1), (conversation_id, 2)]  # Pas de nouvel essai après l'abandon
+        assert manager.list_conversations() == []
+    finally:
+        saver.shutdown(timeout=5)
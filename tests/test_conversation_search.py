@@ -0,0 +1,109 @@
+"""Recherche plein texte (FTS5) des conversations: classement, mode récence et pagination par clé."""
+
+import pytest
+
+import conversation_manager
+from conversation_manager import ConversationManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = ConversationManager(db_path=str(tmp_path / "recherche.db"))
+    if not manager.search_enabled:
+        pytest.skip("SQLite sans FTS5")
+    return manager
+
+
+def _create(manager, name, *contents, updated_at=None):
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": content} for i, content in enumerate(contents)]
+    conversation_id = manager.save_conversation(None, messages, name=name)
+    if updated_at:
+        with manager._connect("test") as conn:
+            conn.execute("UPDATE conversations SET last_updated_at = ? WHERE id = ?", (updated_at, conversation_id))
+    return conversation_id
+
+
+def _ids(page):
+    return [result["id"] for result in page["results"]]
+
+
+def _all_pages(manager, text, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        page = manager.search_conversations(text, limit=limit, cursor=cursor, **filters)
+        pages.append(_ids(page))
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_relevance_ranks_name_and_repeated_terms_first(manager):
+    once = _create(manager, "Garage", "Quel linteau pour la porte du garage ?", "Un LVL suffit.")
+    named = _create(manager, "Linteau de fenêtre", "Ouverture de 2 mètres.", "Linteau en bois, linteau double.")
+    _create(manager, "Terrasse", "Fondation de la terrasse.")
+
+    page = manager.search_conversations("linteau")
+    assert _ids(page) == [named, once]
+    assert page["next_cursor"] is None
+    assert page["results"][0]["score"] < page["results"][1]["score"]  # bm25: plus petit = plus pertinent
+    best = page["results"][1]
+    assert best["seq"] == 0
+    assert "**linteau**" in best["snippet"]
+
+
+def test_every_term_required_and_accents_ignored(manager):
+    both = _create(manager, "Dalle", "Béton pour la dalle du garage.")
+    _create(manager, "Mur", "Béton pour le mur de fondation.")
+    assert _ids(manager.search_conversations("beton garage")) == [both]
+    assert _ids(manager.search_conversations("béton toiture")) == []
+    assert _ids(manager.search_conversations("le de")) == []  # Mots vides seulement
+
+
+def test_relevance_cursor_pages_without_overlap(manager):
+    created = {_create(manager, f"Projet {i}", "Calcul de solive " + "solive " * (i % 3)) for i in range(7)}
+    pages = _all_pages(manager, "solive", limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    seen = [conversation_id for page in pages for conversation_id in page]
+    assert len(seen) == len(set(seen))
+    assert set(seen) == created
+
+
+def test_frequent_terms_fall_back_to_recency(manager, monkeypatch):
+    monkeypatch.setattr(conversation_manager, "SEARCH_RANK_MAX_ROWS", 0)  # Tout terme est « très fréquent »
+    ids = [_create(manager, f"Chantier {i}", "Isolation des combles.", updated_at=f"2024-03-0{i + 1}T09:00:00")
+           for i in range(5)]
+    page = manager.search_conversations("isolation", limit=2)
+    assert page["next_cursor"][0] == "recence"
+    assert page["results"][0]["score"] is None
+    assert _all_pages(manager, "isolation", limit=2) == [ids[::-1][:2], ids[::-1][2:4], ids[:1]]
+
+
+def test_cursor_from_other_mode_restarts(manager):
+    for i in range(3):
+        _create(manager, f"Plancher {i}", "Portée des poutrelles.")
+    first_page = manager.search_conversations("poutrelles", limit=2)
+    assert first_page["next_cursor"][0] == "pertinence"
+    stale = manager.search_conversations("poutrelles", limit=2, cursor=("recence", "9999-12-31", 0))
+    assert _ids(stale) == _ids(first_page)
+
+
+def test_date_filter(manager):
+    _create(manager, "Ancien", "Permis de construire.", updated_at="2023-05-01T10:00:00")
+    recent = _create(manager, "Récent", "Permis de rénovation.", updated_at="2024-05-01T10:00:00")
+    assert _ids(manager.search_conversations("permis", updated_from="2024-01-01")) == [recent]
+    assert len(manager.search_conversations("permis", updated_to="2024-12-31")["results"]) == 2
+
+
+def test_index_follows_rename_append_and_delete(manager):
+    conversation_id = _create(manager, "Sans titre", "Question sur la toiture.")
+    assert manager.update_conversation_title(conversation_id, "Bardeaux d'asphalte")
+    assert _ids(manager.search_conversations("bardeaux")) == [conversation_id]
+    assert _ids(manager.search_conversations("titre")) == []
+
+    messages = manager.load_conversation(conversation_id) + [{"role": "assistant", "content": "Pente minimale 4/12."}]
+    manager.save_conversation(conversation_id, messages)
+    assert manager.search_conversations("pente")["results"][0]["seq"] == 1
+
+    assert manager.delete_conversation(conversation_id)
+    assert _ids(manager.search_conversations("toiture")) == []
+    assert _ids(manager.search_conversations("bardeaux")) == []
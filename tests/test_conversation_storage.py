@@ -0,0 +1,86 @@
+"""Compression des messages (zlib au-delà du seuil), lecture des anciennes lignes en clair et compactage."""
+
+import pytest
+
+from conversation_manager import COMPRESSED_PAYLOAD_MARKER, MESSAGE_COMPRESS_MIN_BYTES, ConversationManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return ConversationManager(db_path=str(tmp_path / "stockage.db"))
+
+
+def _long_text(word="poutre"):
+    text = f"Calcul de la {word} principale: charge, portée et flèche admissible. "
+    return text * (MESSAGE_COMPRESS_MIN_BYTES // len(text) + 2)
+
+
+def _stored_rows(manager, conversation_id):
+    with manager._connect("test") as conn:
+        return conn.execute("""
+            SELECT seq, content, extra, raw_size FROM conversation_messages
+            WHERE conversation_id = ? ORDER BY seq
+        """, (conversation_id,)).fetchall()
+
+
+def test_large_messages_compressed_and_round_trip(manager):
+    blocks = [{"type": "text", "text": _long_text("solive")}]
+    messages = [
+        {"role": "user", "content": "Question courte"},
+        {"role": "assistant", "content": _long_text(), "id": "m-1"},
+        {"role": "user", "content": blocks},
+    ]
+    conversation_id = manager.save_conversation(None, messages)
+    assert manager.load_conversation(conversation_id) == messages
+
+    short, long_text, structured = _stored_rows(manager, conversation_id)
+    assert short["content"] == "Question courte"
+    assert isinstance(long_text["content"], bytes) and long_text["content"].startswith(COMPRESSED_PAYLOAD_MARKER)
+    assert len(long_text["content"]) < len(_long_text().encode("utf-8"))
+    assert long_text["extra"] == '{"id": "m-1"}'  # Sous le seuil: gardé en clair
+    assert isinstance(structured["extra"], bytes)  # Blocs de contenu, en JSON compressé
+    assert long_text["raw_size"] == len(_long_text().encode("utf-8")) + len('{"id": "m-1"}')
+
+    # Le texte indexé est le texte en clair
+    assert [result["id"] for result in manager.search_conversations("flèche admissible")["results"]] == [conversation_id]
+
+
+def test_legacy_text_rows_readable_and_compacted(manager):
+    conversation_id = manager.save_conversation(None, [{"role": "user", "content": "Bonjour"}])
+    legacy_text = _long_text("chevron")
+    with manager._connect("test") as conn:
+        # Ligne écrite avant la compression: TEXT brut, raw_size NULL
+        conn.execute("""
+            INSERT INTO conversation_messages (conversation_id, seq, role, content, created_at)
+            VALUES (?, 1, 'assistant', ?, '2024-01-01T00:00:00')
+        """, (conversation_id, legacy_text))
+        conn.execute("UPDATE conversations SET message_count = 2, messages_hash = NULL WHERE id = ?", (conversation_id,))
+    expected = [{"role": "user", "content": "Bonjour"}, {"role": "assistant", "content": legacy_text}]
+    assert manager.load_conversation(conversation_id) == expected
+
+    report = manager.get_storage_report()
+    assert report["messages"] == 2
+    assert report["compressed_messages"] == 0
+    assert report["raw_bytes"] == report["stored_bytes"]
+
+    result = manager.compact_storage(vacuum=True)
+    assert result["compressed"] == 1
+    assert manager.load_conversation(conversation_id) == expected
+    stored = _stored_rows(manager, conversation_id)[1]
+    assert stored["content"].startswith(COMPRESSED_PAYLOAD_MARKER)
+    assert stored["raw_size"] == len(legacy_text.encode("utf-8"))
+
+    report = manager.get_storage_report()
+    assert report["compressed_messages"] == 1
+    assert report["raw_bytes"] > report["stored_bytes"]
+    assert report["ratio"] > 1.0
+    assert manager.compact_storage(vacuum=False)["compressed"] == 0  # Déjà compressé: rien à refaire
+
+
+def test_payload_below_threshold_kept_as_text():
+    assert ConversationManager._pack_payload("x" * (MESSAGE_COMPRESS_MIN_BYTES - 1)) == "x" * (MESSAGE_COMPRESS_MIN_BYTES - 1)
+    assert ConversationManager._pack_payload(None) is None
+    packed = ConversationManager._pack_payload("é" * MESSAGE_COMPRESS_MIN_BYTES)
+    assert packed.startswith(COMPRESSED_PAYLOAD_MARKER)
+    assert ConversationManager._unpack_payload(packed) == "é" * MESSAGE_COMPRESS_MIN_BYTES
+    assert ConversationManager._unpack_payload("ancien texte") == "ancien texte"
@@ -0,0 +1,39 @@
+"""Décodage des fichiers texte: UTF-8, BOM, puis encodage détecté avec repli sur cp1252 s'il est douteux."""
+
+import pytest
+
+from encoding_detection import FALLBACK_ENCODING, choose_encoding, decode_text
+
+
+@pytest.mark.parametrize("text", [
+    "Prix très bas",
+    "Le coût à prévoir",
+    "Réfection: coût à prévoir, très élevé",
+])
+def test_short_cp1252_french_decoded_as_cp1252(text):
+    assert decode_text(text.encode("cp1252"), filename="export.csv") == text
+    assert decode_text(text.encode("cp1252")) == text  # Encodage en cache: même résultat
+
+
+def test_utf8_and_bom():
+    assert decode_text("Coût très élevé".encode("utf-8")) == "Coût très élevé"
+    assert decode_text("\ufeffCoût".encode("utf-8")) == "Coût"
+
+
+def test_multibyte_encoding_kept_when_confident():
+    text = "日本語のテキストです。見積書と仕様書を確認してください。" * 4
+    assert decode_text(text.encode("shift_jis")) == text
+
+
+@pytest.mark.parametrize("encoding, confidence, expected", [
+    ("Windows-1250", 0.99, FALLBACK_ENCODING),
+    ("MacCyrillic", 0.9, FALLBACK_ENCODING),
+    ("ascii", 1.0, FALLBACK_ENCODING),
+    ("inconnu", 0.9, FALLBACK_ENCODING),
+    ("Windows-1252", 0.1, FALLBACK_ENCODING),
+    ("ISO-8859-1", 0.8, "ISO-8859-1"),
+    ("SHIFT_JIS", 0.3, FALLBACK_ENCODING),
+    ("SHIFT_JIS", 0.8, "SHIFT_JIS"),
+])
+def test_choose_encoding(encoding, confidence, expected):
+    assert choose_encoding(encoding, confidence) == expected
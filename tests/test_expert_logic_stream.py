@@ -0,0 +1,94 @@
+"""Flux de réponse: la place du limiteur d'admission est rendue à la fin du flux ou à sa fermeture."""
+
+import gc
+from types import SimpleNamespace
+
+import expert_logic
+from expert_logic import ExpertAdvisor
+from rate_limiter import AdmissionController
+
+
+class _FakeStream:
+    def __init__(self, chunks):
+        self.text_stream = iter(chunks)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+        return False
+
+    def get_final_message(self):
+        return SimpleNamespace(usage=None)
+
+
+class _TransientError(Exception):
+    status_code = 503
+
+
+def _advisor(chunks, failures=0):
+    streams = []
+
+    def stream(**request_kwargs):
+        if len(streams) < failures:
+            streams.append(None)
+            raise _TransientError("service indisponible")
+        streams.append(_FakeStream(chunks))
+        return streams[-1]
+
+    advisor = SimpleNamespace(admission=AdmissionController(max_concurrency=1), last_stream_metrics=None,
+                              response_cache=None, anthropic=SimpleNamespace(messages=SimpleNamespace(stream=stream)),
+                              _record_usage=lambda response, call_type: None)
+    return advisor, streams
+
+
+def _stream(advisor):
+    return ExpertAdvisor._stream_request(advisor, {"messages": [{"role": "user", "content": "Bonjour"}]}, "test")
+
+
+def test_slot_released_when_stream_finishes():
+    advisor, streams = _advisor(["Bon", "jour"])
+    assert "".join(_stream(advisor)) == "Bonjour"
+    stats = advisor.admission.get_stats()
+    assert stats["in_flight"] == 0
+    assert stats["failures"] == 0
+    assert streams[0].closed
+
+
+def test_slot_released_when_generator_closed_mid_stream():
+    advisor, streams = _advisor(["a", "b", "c"])
+    generator = _stream(advisor)
+    assert next(generator) == "a"
+    assert advisor.admission.get_stats()["in_flight"] == 1
+    generator.close()
+    stats = advisor.admission.get_stats()
+    assert stats["in_flight"] == 0
+    assert stats["failures"] == 0
+    assert stats["circuit_state"] == "fermé"
+    assert streams[0].closed
+
+
+def test_slot_released_when_generator_abandoned():
+    advisor, streams = _advisor(["a", "b", "c"])
+    generator = _stream(advisor)
+    next(generator)
+    del generator
+    gc.collect()
+    assert advisor.admission.get_stats()["in_flight"] == 0
+    assert streams[0].closed
+    # La place rendue est réutilisable sans attendre (plafond de concurrence = 1)
+    advisor.admission.acquire(timeout=1)
+    advisor.admission.release()
+
+
+def test_retries_before_first_chunk_are_counted(monkeypatch):
+    monkeypatch.setattr(expert_logic, "compute_backoff_delay", lambda attempt: 0.0)
+    advisor, streams = _advisor(["ok"], failures=2)
+    assert "".join(_stream(advisor)) == "ok"
+    stats = advisor.admission.get_stats()
+    assert stats["retries"] == 2
+    assert stats["admitted"] == 3
+    assert stats["failures"] == 2
+    assert stats["in_flight"] == 0
@@ -0,0 +1,42 @@
+"""Cache des extractions: les compteurs survivent à l'éviction LRU et ne prennent pas la place des contenus."""
+
+import pytest
+
+import extraction_cache
+from extraction_cache import ExtractionCache
+
+FILLER = "x" * 4000
+
+
+@pytest.fixture(params=["disk", "memory"])
+def cache(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        monkeypatch.setattr(extraction_cache, "diskcache", None)
+    cache = ExtractionCache(directory=str(tmp_path / "extractions"), size_limit=64 * 1024)
+    if request.param == "memory":
+        cache._cache.max_entries = 20
+    assert cache.backend == request.param
+    return cache
+
+
+def test_stats_survive_eviction(cache):
+    cache.set("extract:a", "texte du devis", extract_s=1.5)
+    assert cache.get("extract:a")["content"] == "texte du devis"
+    assert cache.get("extract:absente") is None
+    for i in range(200):
+        cache.set(f"extract:filler-{i}", FILLER, extract_s=0.1)
+    assert cache.get("extract:filler-0") is None  # Bien évincée
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    assert stats["saved_seconds"] == pytest.approx(1.5)
+
+
+def test_counters_do_not_take_entry_slots(cache):
+    for i in range(5):
+        cache.set(f"extract:{i}", f"contenu {i}", extract_s=0.2)
+        cache.get(f"extract:{i}")
+        cache.get(f"extract:absente-{i}")
+    assert cache.get_stats()["entries"] == 5
+    cache.clear()
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (0, 0, 0)
@@ -0,0 +1,52 @@
+"""Sélection des sections de profil: repli sur le profil complet quand la sélection ne sert à rien."""
+
+from types import SimpleNamespace
+
+from expert_logic import ExpertAdvisor
+from profile_retrieval import PERSONA_HEADER_MAX_TOKENS, ProfileRetriever
+
+
+def _section(title, word):
+    return f"**{title}**\n" + "\n".join(f"- {word} {i}: {word} standard, {word} renforcé" for i in range(40))
+
+
+def _large_profile(header="Vous êtes un expert en charpente au Québec.\nCompétences: calculs, devis, normes."):
+    sections = [_section(f"TABLE {name.upper()}", name) for name in
+                ("poutre", "linteau", "solive", "chevron", "colonne", "fondation", "plancher", "toiture")]
+    return "\n\n".join([header] + sections * 3)
+
+
+def _select_context(retriever, profile, question):
+    advisor = SimpleNamespace(profile_retrieval_enabled=True, last_profile_retrieval=None,
+                              profile_manager=SimpleNamespace(select_profile_sections=retriever.select_sections))
+    return ExpertAdvisor._select_profile_context(advisor, profile, question, [])
+
+
+def test_selects_header_and_matching_sections():
+    profile = {"id": "CHARPENTE", "content": _large_profile()}
+    selection = ProfileRetriever().select_sections(profile, "dimension linteau")
+    assert selection is not None
+    assert selection["header"].startswith("Vous êtes un expert")
+    assert selection["selected"]
+    assert "linteau" in selection["sections_text"]
+
+
+def test_no_matching_section_falls_back_to_full_profile():
+    profile = {"id": "CHARPENTE", "content": _large_profile()}
+    retriever = ProfileRetriever()
+    assert retriever.select_sections(profile, "prix étrier") is None
+    system_text, sections = _select_context(retriever, profile, "prix étrier")
+    assert system_text == profile["content"]
+    assert sections is None
+
+
+def test_empty_header_falls_back_to_full_profile():
+    # Premier bloc plus long que l'en-tête permis: aucun en-tête possible
+    oversized_first_block = "\n".join(f"Ligne de présentation {i} " + "x" * 80
+                                      for i in range(PERSONA_HEADER_MAX_TOKENS // 10))
+    profile = {"id": "SANS_ENTETE", "content": _large_profile(header=oversized_first_block)}
+    retriever = ProfileRetriever()
+    assert retriever.select_sections(profile, "dimension linteau") is None
+    system_text, sections = _select_context(retriever, profile, "dimension linteau")
+    assert system_text == profile["content"]
+    assert sections is None
@@ -0,0 +1,208 @@
+"""Contrôle d'admission: ordre de priorité, pause Retry-After et disjoncteur, sur une horloge simulée."""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limiter
+from error_handler import CircuitOpenError
+from rate_limiter import (CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT_S, PRIORITY_BATCH,
+                          PRIORITY_INTERACTIVE, AdmissionController)
+
+
+class FakeClock:
+    """Remplace le module time du limiteur: le temps n'avance que sur demande (ou pendant une attente)."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class _FakeClockCondition(threading.Condition):
+    """Une attente bornée avance l'horloge simulée au lieu de dormir."""
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            return super().wait()
+        self.clock.sleep(timeout)
+        return super().wait(0)
+
+
+class _TransientError(Exception):
+    def __init__(self, status_code=503, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def controller(clock):
+    admission = AdmissionController(requests_per_minute=6000, input_tokens_per_minute=10 ** 9, max_concurrency=1)
+    admission._condition = _FakeClockCondition(clock)
+    return admission
+
+
+def _wait_until(predicate):
+    for _ in range(2000):
+        if predicate():
+            return
+        threading.Event().wait(0.001)
+    raise AssertionError("condition jamais atteinte")
+
+
+def _open_circuit(controller):
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD):
+        controller.acquire()
+        controller.release(_TransientError(503))
+
+
+def test_interactive_admitted_before_earlier_batch(controller):
+    controller.acquire()  # Place unique occupée
+    admitted = []
+
+    def waiter(priority, label):
+        controller.acquire(priority, timeout=None)
+        admitted.append(label)
+        controller.release()
+
+    threads = [threading.Thread(target=waiter, args=(PRIORITY_BATCH, "lot"))]
+    threads[0].start()
+    _wait_until(lambda: controller.get_stats()["waiting"] == 1)
+    threads.append(threading.Thread(target=waiter, args=(PRIORITY_INTERACTIVE, "chat")))
+    threads[1].start()
+    _wait_until(lambda: controller.get_stats()["waiting"] == 2)
+
+    controller.release()
+    for thread in threads:
+        thread.join(5)
+    assert admitted == ["chat", "lot"]
+    assert controller.get_stats()["in_flight"] == 0
+
+
+def test_retry_after_pauses_every_caller(controller, clock):
+    controller.acquire()
+    controller.release(_TransientError(429, headers={"retry-after": "7"}))
+    stats = controller.get_stats()
+    assert stats["rate_limited"] == 1
+    assert stats["paused_for_s"] == pytest.approx(7.0)
+
+    started_at = clock.now
+    controller.acquire(PRIORITY_BATCH)
+    assert clock.now - started_at == pytest.approx(7.0)
+    controller.release()
+    assert controller.get_stats()["paused_for_s"] == 0.0
+
+
+def test_retry_after_pause_respects_admission_timeout(controller, clock):
+    controller.acquire()
+    controller.release(_TransientError(429, headers={"retry-after-ms": "20000"}))
+    with pytest.raises(TimeoutError):
+        controller.acquire(timeout=5)
+    assert controller.get_stats()["waiting"] == 0
+
+
+def test_circuit_breaker_transitions(controller, clock):
+    _open_circuit(controller)
+    assert controller.get_stats()["circuit_state"] == "ouvert"
+
+    clock.sleep(CIRCUIT_RESET_TIMEOUT_S)
+    assert controller.get_stats()["circuit_state"] == "semi-ouvert"
+    controller.acquire()  # Appel d'essai
+    controller.release(_TransientError(503))  # Essai raté: réouverture immédiate
+    assert controller.get_stats()["circuit_state"] == "ouvert"
+
+    clock.sleep(CIRCUIT_RESET_TIMEOUT_S)
+    controller.acquire()
+    controller.release()  # Essai réussi: disjoncteur refermé
+    assert controller.get_stats()["circuit_state"] == "fermé"
+
+
+def test_half_open_allows_a_single_trial(clock):
+    admission = AdmissionController(requests_per_minute=6000, input_tokens_per_minute=10 ** 9, max_concurrency=4)
+    admission._condition = _FakeClockCondition(clock)
+    _open_circuit(admission)
+    clock.sleep(CIRCUIT_RESET_TIMEOUT_S)
+    admission.acquire()
+    with pytest.raises(TimeoutError):
+        admission.acquire(timeout=1)  # Attend la fin de l'essai en cours
+    admission.release()
+    admission.acquire(timeout=1)
+    admission.release()
+
+
+def test_client_errors_do_not_trip_the_circuit(controller):
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD + 1):
+        controller.acquire()
+        controller.release(_TransientError(400))
+    stats = controller.get_stats()
+    assert stats["circuit_state"] == "fermé"
+    assert stats["failures"] == 0
+
+
+def test_open_circuit_rejects_call_without_invoking_api(controller):
+    _open_circuit(controller)
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        controller.call(calls.append, "requête")
+    stats = controller.get_stats()
+    assert calls == []
+    assert stats["rejected_circuit_open"] == 1
+    assert stats["waiting"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_waiters_rejected_when_circuit_opens(controller):
+    for _ in range(CIRCUIT_FAILURE_THRESHOLD - 1):
+        controller.acquire()
+        controller.release(_TransientError(503))
+    controller.acquire()
+    errors = []
+
+    def waiter():
+        try:
+            controller.acquire(timeout=None)
+        except CircuitOpenError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    _wait_until(lambda: controller.get_stats()["waiting"] == 1)
+    controller.release(_TransientError(503))  # Dernier échec: ouverture
+    thread.join(5)
+    assert len(errors) == 1
+    stats = controller.get_stats()
+    assert stats["waiting"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_call_retries_transient_errors(controller, clock):
+    results = iter([_TransientError(503), "ok"])
+
+    def flaky():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert controller.call(flaky, max_retries=2) == "ok"
+    stats = controller.get_stats()
+    assert stats["retries"] == 1
+    assert stats["admitted"] == 2
+    assert stats["circuit_state"] == "fermé"
@@ -0,0 +1,85 @@
+"""Serveur de rejeu local (port éphémère): flux SSE, API de fichiers, 429 injectés et pilote du test de charge."""
+
+import anthropic
+import pytest
+
+import anthropic_client
+from document_store import FILES_API_BETA
+from error_handler import get_retry_after
+from replay_server import ReplayConfig, start_replay_server
+
+
+@pytest.fixture
+def server():
+    config = ReplayConfig(first_token_ms=0.0, first_token_jitter_ms=0.0, tokens_per_second=0.0,
+                          retry_after_s=0.5, recordings_path=None)
+    server = start_replay_server(port=0, config=config)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    client = anthropic_client._build_client(anthropic_client.REPLAY_API_KEY,
+                                            f"http://127.0.0.1:{server.server_address[1]}")
+    yield client
+    client.close()
+
+
+def _request(content="Quelle épaisseur d'isolant pour un mur 2x6?"):
+    return {"model": "replay", "max_tokens": 100, "messages": [{"role": "user", "content": content}]}
+
+
+def test_streamed_message(server, client):
+    with client.messages.stream(**_request()) as stream:
+        chunks = [text for text in stream.text_stream if text]
+        final_message = stream.get_final_message()
+    assert len(chunks) > 1
+    assert "".join(chunks) == final_message.content[0].text
+    assert final_message.content[0].text.startswith("Réponse simulée")
+    assert final_message.stop_reason == "end_turn"
+    assert final_message.usage.input_tokens > 0 and final_message.usage.output_tokens > 0
+    assert server.replay_state.stats["streamed"] == 1
+
+
+def test_file_upload_and_reference(server, client):
+    uploaded = client.beta.files.upload(file=("devis.txt", "Béton 25 MPa, 12 m3".encode("utf-8"), "text/plain"))
+    assert uploaded.id.startswith("file_replay_")
+    assert uploaded.filename == "devis.txt" and uploaded.size_bytes == len("Béton 25 MPa, 12 m3".encode("utf-8"))
+    assert client.beta.files.retrieve_metadata(uploaded.id).id == uploaded.id
+
+    document = {"type": "document", "source": {"type": "file", "file_id": uploaded.id}}
+    request = _request([document, {"type": "text", "text": "Analyse ce devis"}])
+    with pytest.raises(anthropic.BadRequestError):
+        client.messages.create(**request)  # En-tête bêta de l'API de fichiers manquant
+    message = client.beta.messages.create(betas=[FILES_API_BETA], **request)
+    assert message.content[0].text
+    assert server.replay_state.stats["files_uploaded"] == 1
+    assert server.replay_state.stats["file_references"] == 1
+
+
+def test_injected_rate_limit(server, client):
+    server.replay_state.config.error_rate = 1.0
+    with pytest.raises(anthropic.RateLimitError) as excinfo:
+        client.messages.create(**_request())
+    assert excinfo.value.status_code == 429
+    assert get_retry_after(excinfo.value) == 0.5
+    assert server.replay_state.stats["rate_limited"] == 1
+
+
+def test_load_test_driver_without_ui(server, monkeypatch, tmp_path):
+    import expert_logic
+    import load_test
+    from response_cache import ResponseCache
+
+    response_cache = ResponseCache(directory=str(tmp_path / "responses"))
+    monkeypatch.setattr(expert_logic, "get_response_cache", lambda: response_cache)
+    monkeypatch.setenv("LLM_BACKEND", anthropic_client.BACKEND_REPLAY)
+    monkeypatch.setenv("REPLAY_SERVER_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.delenv("LLM_BASE_URL", raising=False)
+    runner = load_test.LoadTestRunner(("chat",))
+    runner.run(users=2, requests_per_user=1)
+    assert [result["scenario"] for result in runner.results] == ["chat", "chat"]
+    assert [result["error"] for result in runner.results] == [None, None]
+    assert server.replay_state.stats["streamed"] == 2
@@ -0,0 +1,52 @@
+"""Cache des réponses: compteurs et versions de profil survivent à l'éviction LRU des réponses."""
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+FILLER = "x" * 4000
+
+
+def _flood(cache, count=200):
+    """Remplit le cache de réponses jusqu'à évincer les plus anciennes entrées."""
+    for i in range(count):
+        cache.set(f"resp:filler-{i}", FILLER)
+
+
+@pytest.fixture(params=["disk", "memory"])
+def make_cache(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        monkeypatch.setattr(response_cache, "diskcache", None)
+
+    def factory():
+        cache = ResponseCache(directory=str(tmp_path / "responses"), size_limit=64 * 1024)
+        if request.param == "memory":
+            cache._cache.max_entries = 20
+        assert cache.backend == request.param
+        return cache
+    return factory
+
+
+def test_stats_survive_eviction(make_cache):
+    cache = make_cache()
+    cache.set("resp:a", "réponse a")
+    assert cache.get("resp:a") == "réponse a"
+    assert cache.get("resp:absente") is None
+    _flood(cache)
+    assert cache.get("resp:filler-0") is None  # Bien évincée
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_profile_version_survives_eviction(make_cache):
+    cache = make_cache()
+    cache.check_profile_version("PLOMBIER", "profil v1")
+    _flood(cache)
+    key = cache.make_key("modele", "PLOMBIER", "profil v1", [{"role": "user", "content": "question"}])
+    cache.set(key, "réponse pour v1", profile_id="PLOMBIER")
+
+    # Même cache vu par un autre processus (versions déjà vérifiées inconnues) après modification du profil
+    cache._profile_versions.clear()
+    assert cache.check_profile_version("PLOMBIER", "profil v2") is True
+    assert cache.get(key) is None
@@ -0,0 +1,40 @@
+"""Cache des recherches web: les quasi-doublons ne mélangent pas des nombres, dimensions ou années différents."""
+
+import pytest
+
+from search_cache import NEAR_DUPLICATE_THRESHOLD, SearchCache, normalize_query, query_tokens
+
+# Dix mots significatifs: un seul mot différent donne une similarité de Jaccard de 9/11 (>= 0.8)
+PRICE_2X4 = "prix 2x4 epinette traite huit pieds quincaillerie rona laval livraison chantier"
+PRICE_2X6 = "prix 2x6 epinette traite huit pieds quincaillerie rona laval livraison chantier"
+CODE_2015 = "code 2015 garde-corps escalier exterieur hauteur minimale residentiel quebec balcon"
+CODE_2020 = "code 2020 garde-corps escalier exterieur hauteur minimale residentiel quebec balcon"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SearchCache(db_path=str(tmp_path / "search_cache.db"))
+
+
+def _jaccard(first, second):
+    a, b = query_tokens(normalize_query(first)), query_tokens(normalize_query(second))
+    return len(a & b) / len(a | b)
+
+
+@pytest.mark.parametrize("cached_query, other_query", [(PRICE_2X4, PRICE_2X6), (CODE_2015, CODE_2020)])
+def test_different_numbers_miss_the_cache(cache, cached_query, other_query):
+    assert _jaccard(cached_query, other_query) >= NEAR_DUPLICATE_THRESHOLD  # Assez proches pour l'étape floue
+    cache.cache_search_result(cached_query, "résultat en cache")
+    assert cache.get_cached_search(other_query) is None
+    assert cache.get_stats()["misses"] == 1
+
+
+def test_near_duplicate_with_same_numbers_hits(cache):
+    cache.cache_search_result(PRICE_2X4, "prix du 2x4")
+    assert cache.get_cached_search(PRICE_2X4 + " montreal") == "prix du 2x4"
+    assert cache.get_stats()["near_hits"] == 1
+
+
+def test_reordered_query_hits(cache):
+    cache.cache_search_result(CODE_2015, "article du code 2015")
+    assert cache.get_cached_search(" ".join(reversed(CODE_2015.split()))) == "article du code 2015"
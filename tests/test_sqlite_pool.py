@@ -0,0 +1,121 @@
+"""Pool de connexions SQLite partagé (WAL, opérations imbriquées, transactions abandonnées)."""
+
+import sqlite3
+import threading
+
+import pytest
+
+from sqlite_pool import SQLitePool, get_sqlite_pool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = SQLitePool(str(tmp_path / "pool.db"), max_connections=2, busy_timeout_ms=200)
+    with pool.connection("schema") as conn:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, label TEXT)")
+    yield pool
+    pool.close()
+
+
+def _count(pool):
+    with pool.connection("count") as conn:
+        return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+
+def test_connections_use_wal_and_busy_timeout(pool):
+    with pool.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 200
+
+
+def test_connection_reused_between_operations(pool):
+    for i in range(5):
+        with pool.connection("insert") as conn:
+            conn.execute("INSERT INTO items (label) VALUES (?)", (f"item {i}",))
+    stats = pool.get_stats()
+    assert stats["connections_created"] == 1
+    assert stats["idle_connections"] == 1
+    assert stats["operations"]["insert"]["count"] == 5
+
+
+def test_nested_operation_shares_the_thread_connection(pool):
+    with pool.connection("outer") as outer:
+        pool.begin_immediate(outer.cursor())
+        outer.execute("INSERT INTO items (label) VALUES ('imbriqué')")
+        with pool.connection("inner") as inner:
+            assert inner is outer
+            assert inner.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 1  # Même transaction
+        outer.execute("COMMIT")
+    stats = pool.get_stats()
+    assert stats["connections_created"] == 1
+    assert "inner" not in stats["operations"]  # Seule l'opération externe est mesurée
+
+
+def test_open_transaction_rolled_back_on_release(pool):
+    with pytest.raises(RuntimeError):
+        with pool.connection("failing") as conn:
+            pool.begin_immediate(conn.cursor())
+            conn.execute("INSERT INTO items (label) VALUES ('perdu')")
+            raise RuntimeError("erreur au milieu de la transaction")
+    assert pool.get_stats()["operations"]["failing"]["errors"] == 1
+    assert _count(pool) == 0
+    # Connexion rendue propre: un autre écrivain obtient le verrou tout de suite
+    with pool.connection("write") as conn:
+        assert not conn.in_transaction
+        pool.begin_immediate(conn.cursor())
+        conn.execute("INSERT INTO items (label) VALUES ('gardé')")
+        conn.execute("COMMIT")
+    assert _count(pool) == 1
+
+
+def test_readers_not_blocked_by_writer(pool):
+    with pool.connection("insert") as conn:
+        conn.execute("INSERT INTO items (label) VALUES ('validé')")
+    write_open, read_done = threading.Event(), threading.Event()
+    seen = []
+
+    def reader():
+        write_open.wait(5)
+        seen.append(_count(pool))
+        read_done.set()
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    with pool.connection("write") as conn:
+        pool.begin_immediate(conn.cursor())
+        conn.execute("INSERT INTO items (label) VALUES ('en cours')")
+        write_open.set()
+        assert read_done.wait(5)  # Lecture pendant l'écriture (WAL): ancienne version, sans attendre
+        conn.execute("COMMIT")
+    thread.join(5)
+    assert seen == [1]
+    assert _count(pool) == 2
+    assert pool.get_stats()["connections_created"] == 2
+
+
+def test_second_writer_waits_then_fails_on_busy_timeout(pool):
+    with pool.connection("write") as conn:
+        pool.begin_immediate(conn.cursor())
+        errors = []
+
+        def writer():
+            try:
+                with pool.connection("competing_write") as other:
+                    pool.begin_immediate(other.cursor())
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        thread.join(5)
+        conn.execute("COMMIT")
+    assert len(errors) == 1 and "locked" in str(errors[0])
+    stats = pool.get_stats()
+    assert stats["locked_errors"] == 1
+    assert stats["operations"]["competing_write"]["errors"] == 1
+
+
+def test_shared_pool_per_database(tmp_path):
+    path = str(tmp_path / "partage.db")
+    assert get_sqlite_pool(path) is get_sqlite_pool(str(tmp_path / "." / "partage.db"))
+    assert get_sqlite_pool(path) is not get_sqlite_pool(str(tmp_path / "autre.db"))
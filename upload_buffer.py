@@ -0,0 +1,198 @@
+"""
+Tampon partagé des fichiers téléversés pour EXPERTS IA
+Un fichier téléversé est exposé une seule fois en mémoire en lecture seule
+(memoryview sur le tampon de l'UploadedFile, sans copie) et passé tel quel à
+tous les parseurs via un flux sans copie. Pour les processus de lecture, un
+gros fichier est écrit une fois dans un fichier temporaire que chaque processus
+projette en mémoire (mmap), au lieu d'en recevoir une copie sérialisée.
+Mesure aussi le pic de mémoire d'une lecture (Linux).
+"""
+
+import io
+import os
+import mmap
+import tempfile
+from contextlib import contextmanager
+
+UPLOAD_SPILL_THRESHOLD_MB = float(os.getenv('UPLOAD_SPILL_THRESHOLD_MB', '16'))  # Au-delà: fichier projeté pour les processus
+
+
+class BufferStream(io.RawIOBase):
+    """Flux binaire en lecture seule sur un tampon (bytes, memoryview, mmap), sans copie du tampon."""
+
+    def __init__(self, data):
+        super().__init__()
+        self._view = memoryview(data).cast('B')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def getbuffer(self):
+        """Vue en lecture seule sur tout le tampon (comme io.BytesIO.getbuffer, sans copie)."""
+        return self._view.toreadonly()
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = len(self._view) + offset
+        else:
+            raise ValueError(f"whence invalide: {whence}")
+        if position < 0:
+            raise ValueError("position négative")
+        self._position = position
+        return position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = len(self._view)
+        else:
+            end = min(len(self._view), self._position + size)
+        start = min(self._position, end)
+        self._position = max(self._position, end)
+        return self._view[start:end].tobytes()
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, target):
+        chunk = self._view[self._position:self._position + len(target)]
+        target[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def open_stream(data):
+    """Flux binaire sans copie sur un contenu téléversé (bytes, memoryview ou mmap)."""
+    return BufferStream(data)
+
+
+def read_buffer(file_stream):
+    """Tout le contenu d'un flux, sans copie quand il expose son tampon (BufferStream, io.BytesIO)."""
+    if hasattr(file_stream, 'getbuffer'):
+        return file_stream.getbuffer()
+    file_stream.seek(0)
+    return file_stream.read()
+
+
+class UploadBuffer:
+    """
+    Contenu d'un fichier téléversé en lecture seule, partagé par les parseurs d'une ingestion.
+
+    Attributs:
+        name: Nom du fichier
+        view: memoryview en lecture seule (aucune copie de l'UploadedFile)
+        size: Taille en octets
+        path: Fichier temporaire (créé à la demande par spill()) ou None
+    """
+
+    def __init__(self, name, data, spill_threshold_mb=UPLOAD_SPILL_THRESHOLD_MB):
+        self.name = name
+        self._bytes = data if isinstance(data, bytes) else None
+        self.view = memoryview(data).toreadonly()
+        self.size = self.view.nbytes
+        self.spill_threshold_bytes = int(spill_threshold_mb * 1024 * 1024)
+        self.path = None
+
+    @classmethod
+    def from_upload(cls, uploaded_file):
+        """Tampon d'un UploadedFile de Streamlit (getbuffer, sans copie) ou de tout objet avec getvalue()."""
+        if hasattr(uploaded_file, 'getbuffer'):
+            return cls(uploaded_file.name, uploaded_file.getbuffer())
+        return cls(uploaded_file.name, uploaded_file.getvalue())
+
+    @property
+    def is_large(self):
+        return self.size >= self.spill_threshold_bytes
+
+    def spill(self):
+        """Écrit le contenu une seule fois dans un fichier temporaire (lu ensuite par mmap). Retourne son chemin."""
+        if self.path is None:
+            fd, path = tempfile.mkstemp(suffix=os.path.splitext(self.name)[1], prefix='upload_')
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(self.view)
+            self.path = path
+        return self.path
+
+    def payload(self):
+        """Contenu sérialisable pour un processus: les octets d'origine s'il y en a, sinon une copie (petits fichiers)."""
+        return self._bytes if self._bytes is not None else self.view.tobytes()
+
+    def close(self):
+        """Supprime le fichier temporaire et libère la vue (l'UploadedFile redevient modifiable)."""
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+        try:
+            self.view.release()
+        except BufferError:
+            pass  # Une sous-vue est encore référencée: libérée par le ramasse-miettes
+
+
+@contextmanager
+def mapped_file(path):
+    """Projette un fichier temporaire en mémoire (lecture seule) et fournit sa memoryview."""
+    with open(path, 'rb') as file_handle:
+        mapping = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield memoryview(mapping)
+    finally:
+        try:
+            mapping.close()
+        except BufferError:
+            pass  # Une vue est encore référencée par un parseur: fermée par le ramasse-miettes
+
+
+def _read_status_kb(field):
+    with open('/proc/self/status') as status_file:
+        for line in status_file:
+            if line.startswith(field):
+                return int(line.split()[1])
+    return None
+
+
+class PeakMemory:
+    """Résultat de measure_peak_memory: pic de mémoire résidente au-delà du niveau de départ (Mo), ou None."""
+
+    def __init__(self):
+        self.peak_mb = None
+
+
+@contextmanager
+def measure_peak_memory():
+    """
+    Mesure le pic de mémoire résidente du processus pendant le bloc (Linux: VmHWM remis à zéro
+    par /proc/self/clear_refs). Dans un processus partagé par plusieurs sessions, la mesure
+    inclut les allocations des autres threads; dans un processus du pool, elle est exacte.
+    """
+    measure = PeakMemory()
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        start_kb = _read_status_kb('VmRSS')
+    except OSError:
+        start_kb = None
+    try:
+        yield measure
+    finally:
+        if start_kb is not None:
+            try:
+                measure.peak_mb = max(0, _read_status_kb('VmHWM') - start_kb) / 1024
+            except (OSError, TypeError):
+                pass